@@ -0,0 +1,184 @@
+import collections
+import json
+import re
+import time
+
+
+ACTIONS = ['kick', 'warn']
+
+
+class ruleSet():
+    """
+    Regex and word list rules, compiled into one pattern so a message is searched once for all of them.
+    A rule is a dict with a "regex" or a list of "words", an "action" (kick or warn) and a "reason".
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        parts = []
+        for rule in rules:
+            pattern = self.__pattern(rule)
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError('Rule "%s" is not a valid regex: %s' % (rule.get('name', len(self.rules)), str(e)))
+            if rule.get('action', 'kick') not in ACTIONS:
+                raise ValueError('Rule "%s" has an unknown action' % rule.get('name', len(self.rules)))
+            parts.append('(?P<r%i>%s)' % (len(self.rules), pattern))
+            self.rules.append(rule)
+        try:
+            self.matcher = re.compile('|'.join(parts)) if parts else None
+        except re.error as e:
+            raise ValueError('The rules can not be combined: ' + str(e))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __pattern(self, rule):
+        if rule.get('words'):
+            # longest words first, so a word does not stop at a shorter word it starts with
+            words = sorted(set(rule['words']), key=len, reverse=True)
+            pattern = r'\b(?:%s)\b' % '|'.join([re.escape(w) for w in words])
+        else:
+            pattern = rule.get('regex', '')
+            if not pattern:
+                raise ValueError('Rule "%s" needs a regex or words' % rule.get('name', len(self.rules)))
+        if not rule.get('case_sensitive', False):
+            pattern = '(?i:%s)' % pattern
+        return pattern
+
+    def match(self, message):
+        """
+        The first rule that matches the message, or None
+        """
+        if self.matcher is None:
+            return None
+        m = self.matcher.search(message)
+        if m is None:
+            return None
+        return self.rules[int(m.lastgroup[1:])]
+
+
+class floodDetector():
+    """
+    Per channel and user: too many messages in a short time (flood), or the same message again and again (repeat).
+    A user is reset after being reported, so a burst is reported once.
+    """
+
+    def __init__(self, messages=6, seconds=8, repeats=3, repeatSeconds=60, reasons=None):
+        self.reasons = {'flood': 'Stop flooding.', 'repeat': 'Stop repeating yourself.'}
+        self.reasons.update(reasons or {})
+        self.messages = max(int(messages), 1)
+        self.seconds = seconds
+        self.repeats = max(int(repeats), 1)
+        self.repeatSeconds = repeatSeconds
+        self.users = {}  # (channel, nick) -> [message times, last message, repeat count, time of its first repeat]
+        self.sweepSize = 1000
+
+    def __len__(self):
+        return len(self.users)
+
+    def check(self, channel, nick, message, now=None):
+        """
+        Returns 'flood', 'repeat' or None
+        """
+        now = time.time() if now is None else now
+        key = (channel, nick.lower())
+        user = self.users.get(key, None)
+        if user is None:
+            if len(self.users) >= self.sweepSize:
+                self.sweep(now)
+            user = self.users[key] = [collections.deque(maxlen=self.messages), None, 0, now]
+        times = user[0]
+        times.append(now)
+        message = message.strip().lower()
+        if message == user[1] and now - user[3] <= self.repeatSeconds:
+            user[2] += 1
+        else:
+            user[1], user[2], user[3] = message, 1, now
+        if len(times) >= self.messages and now - times[0] <= self.seconds:
+            del self.users[key]
+            return 'flood'
+        if user[2] >= self.repeats:
+            del self.users[key]
+            return 'repeat'
+        return None
+
+    def sweep(self, now=None):
+        """
+        Drops the users that did not write for long enough to not matter anymore
+        """
+        now = time.time() if now is None else now
+        maxAge = max(self.seconds, self.repeatSeconds)
+        self.users = {k: u for k, u in self.users.items() if now - u[0][-1] <= maxAge}
+        self.sweepSize = max(2 * len(self.users), 1000)
+
+
+class chanServQueue():
+    """
+    Sends ChanServ commands at most <rate> per second (with bursts of up to <burst>), so a wave of kicks
+    does not get the bot throttled by the server. The same pending command is only queued once.
+    """
+
+    def __init__(self, bot, rate=1.0, burst=3):
+        self.bot = bot
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.lastRefill = time.time()
+        self.pending = collections.deque()
+        self.keys = set()
+        self.handle = None
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, key, line):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.pending.append((key, line))
+        if self.handle is None:
+            self.drain()
+        return True
+
+    def kick(self, channel, nick, reason=None):
+        line = 'kick {channel} {nick}'.format(channel=channel, nick=nick)
+        if reason:
+            line += ' ' + reason
+        return self.put(('kick', channel, nick.lower()), line)
+
+    def drain(self):
+        self.handle = None
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+        while self.pending and self.tokens >= 1:
+            key, line = self.pending.popleft()
+            self.keys.discard(key)
+            self.tokens -= 1
+            self.sent += 1
+            self.bot.privmsg('ChanServ', line)
+        if self.pending:
+            self.handle = self.bot.loop.call_later((1 - self.tokens) / self.rate, self.drain)
+
+    def clear(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.pending.clear()
+        self.keys.clear()
+
+
+def loadRules(path):
+    """
+    Reads a rules file, see moderation.json.example. Returns the ruleSet and the floodDetector.
+    """
+    with open(path, encoding='utf-8') as fd:
+        data = json.load(fd)
+    flood, repeat = data.get('flood', {}), data.get('repeat', {})
+    detector = floodDetector(messages=flood.get('messages', 6), seconds=flood.get('seconds', 8),
+                             repeats=repeat.get('messages', 3), repeatSeconds=repeat.get('seconds', 60),
+                             reasons={k: v['reason'] for k, v in [('flood', flood), ('repeat', repeat)] if v.get('reason')})
+    return ruleSet(data.get('rules', [])), detector
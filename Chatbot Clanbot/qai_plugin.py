@@ -4,18 +4,24 @@ import re
 import itertools
 import irc3
 from irc3.plugins.command import command
+import os
+import sys
 import time
-import threading
 
+if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from botcore.identify import NickServIdentification
+from botcore.logs import get_queue_logger
+from botcore.storage import BatchedDb
+from botcore.utils import pack_lines
+from moderation import ruleSet, floodDetector, chanServQueue, loadRules
+from roster import clanRoster, clanApiSource, clanFileSource, DEFAULT_URL as FAF_API_URL
 from taunts import USE_FORBIDDEN, TALKING_REACTION, TAUNTS
-NICKSERVIDENTIFIEDRESPONSES = {}
-NICKSERVIDENTIFIEDRESPONSESLOCK = None
 
-CLANMEMBER = {}
-IGNOREUSERS = ['NickServ', 'ChanServ', 'OperServ']
+IGNOREUSERS = {'NickServ', 'ChanServ', 'OperServ'}
 ALLTAUNTS = []
-BEQUIETCHANNELS = ['#aeolus']
-MODERATEDCHANNELS = []
+BEQUIETCHANNELS = {'#aeolus'}
+MODERATEDCHANNELS = set()
 
 
 @irc3.extend
@@ -25,23 +31,40 @@ def action(bot, *args):
 @irc3.plugin
 class Plugin(object):
 
+    requires = [
+        'botcore.identify',
+        'botcore.metrics',
+    ]
+
     def __init__(self, bot):
         self.bot = bot
         self.timers = {}
         self._rage = {}
-
-        global ALLTAUNTS, IGNOREUSERS, MODERATEDCHANNELS, NICKSERVIDENTIFIEDRESPONSESLOCK
-        NICKSERVIDENTIFIEDRESPONSESLOCK = threading.Lock()
+        self.logger = get_queue_logger('clanbot', self.bot.config.get('log_level', 'info'))
+        self.chanServ = chanServQueue(bot, rate=self.bot.config.get('chanserv_rate', 1),
+                                      burst=self.bot.config.get('chanserv_burst', 3))
+        self.rules, self.flood = ruleSet(), floodDetector()
+        self.__loadModerationRules()
+        self.Db = BatchedDb.of(bot, delay=self.bot.config.get('db_save_delay', 5))
+        self.roster = clanRoster(self.Db)
+        self.syncHandle = None
+
+        global ALLTAUNTS, IGNOREUSERS, MODERATEDCHANNELS
         ALLTAUNTS.extend(USE_FORBIDDEN)
         ALLTAUNTS.extend(TAUNTS)
         ALLTAUNTS.extend(TALKING_REACTION)
-        IGNOREUSERS.extend([self.bot.config['nick']])
+        IGNOREUSERS.add(self.bot.config['nick'])
         for channel in self.bot.config['moderatedChannels']:
-            MODERATEDCHANNELS.append('#' + channel)
+            MODERATEDCHANNELS.add('#' + channel)
 
     @classmethod
     def reload(cls, old):
-        return cls(old.bot)
+        new = cls(old.bot)
+        new.chanServ = old.chanServ
+        if old.syncHandle is not None:
+            old.syncHandle.cancel()
+            new.__scheduleSync()
+        return new
 
     def after_reload(self):
         self._taunt('#qai_channel')
@@ -49,10 +72,8 @@ class Plugin(object):
     @irc3.event(irc3.rfc.CONNECTED)
     def nickserv_auth(self, *args, **kwargs):
         self.bot.privmsg('nickserv', 'identify %s' % self.bot.config['nickserv_password'])
-        if 'clan' in self.bot.db:
-            if 'names' in self.bot.db['clan']:
-                global CLANMEMBER
-                CLANMEMBER = self.bot.db['clan'].get('names', {}) #doing this here to init CLANMEMBER after the bot got its db
+        if self.syncHandle is None:
+            self.__scheduleSync(delay=10)
 
     @irc3.event(irc3.rfc.JOIN)
     def on_join(self, channel, mask):
@@ -62,17 +83,61 @@ class Plugin(object):
         self.bot.privmsg('OperServ', 'svsjoin %s %s' % (nick, channel))
 
     @irc3.event(irc3.rfc.PRIVMSG)
-    @asyncio.coroutine
     def on_privmsg(self, *args, **kwargs):
         msg, channel, sender = kwargs['data'], kwargs['target'], kwargs['mask']
-        #print(sender + ": " + msg)
-        print(sender.nick + ": " + msg)
-        if sender.startswith("NickServ!"):
-            self.__handleNickservMessage(msg)
+        self.logger.debug('%s %s: %s', channel, sender.nick, msg)
         if sender.nick in IGNOREUSERS:
             return
         if not channel in MODERATEDCHANNELS:
             return
+        self.__moderate(sender.nick, channel, msg)
+
+    def __moderate(self, nick, channel, msg):
+        rule = self.rules.match(msg)
+        if rule is not None:
+            self.logger.info('%s broke the rule "%s" in %s: %s', nick, rule.get('name', '?'), channel, msg)
+            if rule.get('action', 'kick') == 'kick':
+                self.chanServ.kick(channel, nick, rule.get('reason'))
+            elif rule.get('reason'):
+                self.bot.privmsg(nick, rule['reason'])
+            return
+        reason = self.flood.check(channel, nick, msg)
+        if reason is not None:
+            self.logger.info('%s was caught by %s detection in %s', nick, reason, channel)
+            self.chanServ.kick(channel, nick, self.flood.reasons.get(reason))
+
+    def __loadModerationRules(self):
+        """
+        Loads the rules file of the config (moderation_rules), keeps the current rules if it can not be loaded
+        """
+        path = self.bot.config.get('moderation_rules', None)
+        if not path:
+            return "There is no rules file configured."
+        try:
+            self.rules, self.flood = loadRules(path)
+        except (OSError, ValueError) as e:
+            self.logger.warning('Failed loading the moderation rules from %s: %s', path, str(e))
+            return "Failed loading the rules: " + str(e)
+        return "Loaded " + str(len(self.rules)) + " rules."
+
+    @command(permission='admin', public=False)
+    @asyncio.coroutine
+    def moderation(self, mask, target, args):
+        """Reload the moderation rules, or show what the moderation is doing
+
+            %%moderation reload
+            %%moderation stats
+        """
+        if not (yield from self.__isNickservIdentified(mask.nick)):
+            return
+        if args.get('reload'):
+            return self.__loadModerationRules()
+        return "{rules} rules, {users} users watched for flooding, {pending} ChanServ commands waiting, {sent} sent.".format(**{
+                'rules': len(self.rules),
+                'users': len(self.flood),
+                'pending': len(self.chanServ),
+                'sent': self.chanServ.sent,
+            })
 
     @command
     @asyncio.coroutine
@@ -152,72 +217,104 @@ class Plugin(object):
                 'name' : nick
             }))
 
-    def __handleNickservMessage(self, message):
-        if message.startswith('STATUS'):
-            words = message.split(" ")
-            global NICKSERVIDENTIFIEDRESPONSES, NICKSERVIDENTIFIEDRESPONSESLOCK
-            NICKSERVIDENTIFIEDRESPONSESLOCK.acquire()
-            NICKSERVIDENTIFIEDRESPONSES[words[1]] = words[2]
-            NICKSERVIDENTIFIEDRESPONSESLOCK.release()
-
     @asyncio.coroutine
     def __isNickservIdentified(self, nick):
-        self.bot.privmsg('nickserv', "status {}".format(nick))
-        remainingTries = 20
-        while remainingTries > 0:
-            if NICKSERVIDENTIFIEDRESPONSES.get(nick):
-                value = NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVIDENTIFIEDRESPONSESLOCK.acquire()
-                del NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVIDENTIFIEDRESPONSESLOCK.release()
-                if int(value) == 3:
-                    return True
-                return False
-            remainingTries -= 1
-            yield from asyncio.sleep(0.1)
-        return False
+        return (yield from self.bot.get_plugin(NickServIdentification).is_identified(nick))
 
     @command(permission='admin', public=False)
     def clan(self, mask, target, args):
-        """Adds/removes a user to/from the clanlist 
+        """Adds/removes a user to/from the clanlist, imports (syncs) it from or exports it to a file of the clan
+        directory, or syncs it now with the configured source
 
             %%clan get
             %%clan add <name>
             %%clan del <name>
+            %%clan import <filename>
+            %%clan export
+            %%clan sync
         """
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
-        global CLANMEMBER
-        if 'clan' not in self.bot.db:
-            self.bot.db['clan'] = {'names': {}}
         add, delete, get, name = args.get('add'), args.get('del'), args.get('get'), args.get('<name>')
         if add:
-            try:
-                allUser = self.bot.db['clan'].get('names', {})
-                allUser[name] = True
-                self.bot.db.set('clan', names=allUser)
-                CLANMEMBER = allUser
-                return 'Added "{name}" to clan members'.format(**{
+            if not self.roster.add([name]):
+                return '"{name}" already is a clan member'.format(**{
                         "name": name,
                     })
-            except:
-                return "Failed adding the user. What did you do?!"
+            return 'Added "{name}" to clan members'.format(**{
+                    "name": name,
+                })
         elif delete:
-            allUser = self.bot.db['clan'].get('names', {})
-            if allUser.get(name):
-                del self.bot.db['clan']['names'][name]
-                CLANMEMBER = self.bot.db['clan'].get('names', {})
+            if self.roster.remove([name]):
                 return 'Removed "{name}" from clan members'.format(**{
                         "name": name,
                     })
             else:
                 return 'Name not found in the list.'
         elif get:
-            self.bot.privmsg(mask.nick, str(len(CLANMEMBER)) + " members listed:")
-            self.bot.privmsg(mask.nick, 'names: ' + ', '.join(CLANMEMBER.keys()))
+            self.bot.privmsg(mask.nick, str(len(self.roster)) + " members listed:")
+            for line in pack_lines(self.roster.names()):
+                self.bot.privmsg(mask.nick, line)
+        elif args.get('export'):
+            path = self.__clanFile('roster.json')
+            self.roster.export(path)
+            return 'Exported {count} members to {file}'.format(count=len(self.roster), file=os.path.basename(path))
+        elif args.get('import'):
+            filename = args.get('<filename>')
+            if not re.match(r'^[\w\-]+\.(txt|json)$', filename):
+                return "Only the names of .txt or .json files in the clan directory are accepted."
+            return (yield from self.syncRoster(clanFileSource(self.__clanFile(filename))))
+        elif args.get('sync'):
+            source = self.__syncSource()
+            if source is None:
+                return "There is no roster source configured."
+            return (yield from self.syncRoster(source))
+
+    def __clanFile(self, filename):
+        return os.path.join(os.path.abspath(self.bot.config.get('clan_dir', 'clan')), filename)
+
+    def __syncSource(self):
+        """
+        clan_sync_source is "api" (the FAF api, for the clan clan_tag) or the path of a file
+        """
+        source = self.bot.config.get('clan_sync_source', None)
+        if not source:
+            return None
+        if source == 'api':
+            return clanApiSource(self.bot.config['clan_tag'], baseUrl=self.bot.config.get('faf_api_url', FAF_API_URL),
+                                 timeout=self.bot.config.get('faf_api_timeout', 10))
+        return clanFileSource(source)
+
+    @asyncio.coroutine
+    def syncRoster(self, source):
+        try:
+            found = yield from source.fetch()
+        except (IOError, OSError, ValueError, KeyError, asyncio.TimeoutError) as e:
+            self.logger.warning('Failed syncing the clan roster: %s', str(e))
+            return 'Failed syncing the clan roster: ' + str(e)
+        added, removed, renamed = self.roster.sync(found)
+        self.logger.info('Synced the clan roster, added: %s, removed: %s, renamed: %s', added, removed, renamed)
+        return 'Synced {count} members: {added} added, {removed} removed, {renamed} renamed.'.format(**{
+                'count': len(self.roster),
+                'added': len(added),
+                'removed': len(removed),
+                'renamed': len(renamed),
+            })
+
+    def __scheduleSync(self, delay=None):
+        interval = self.bot.config.get('clan_sync_interval', 0)
+        if not interval or self.__syncSource() is None:
+            return
+        self.syncHandle = self.bot.loop.call_later(interval if delay is None else delay, self.__periodicSync)
+
+    def __periodicSync(self):
+        source = self.__syncSource()
+        if source is not None:
+            asyncio.ensure_future(self.syncRoster(source), loop=self.bot.loop)
+        self.__scheduleSync()
 
     def __isClanMember(self, nick):
-        return nick in CLANMEMBER
+        return self.roster.isMember(nick)
 
     def __handledNonMember(self, nick, channel=None, tauntTable=TALKING_REACTION, kick=True):
         if self.__isClanMember(nick):
@@ -230,10 +327,7 @@ class Plugin(object):
         return True
 
     def __kickFromChannel(self, nick, channel):
-        self.bot.privmsg("ChanServ", "kick {channel} {nick}".format(**{
-                'channel': channel,
-                'nick': nick,
-            }))
+        self.chanServ.kick(channel, nick)
 
     @command
     def kick(self, mask, target, args):
@@ -0,0 +1,160 @@
+import json
+import os
+from botcore.rest import RestRequester
+from botcore.shared import registry
+
+
+DEFAULT_URL = 'https://api.faforever.com'
+
+
+def readMembers(data):
+    """
+    (id, name) of the members in a clan answer of the FAF api (players included), or in a plain list of names.
+    Names of a plain list have no id.
+    """
+    if isinstance(data, list):
+        return [(None, str(name)) for name in data if name]
+    if 'included' not in data and 'names' in data:
+        # an exported roster
+        return [(str(id) if id not in (True, None) else None, name) for name, id in data['names'].items()]
+    return [(str(p['id']), p['attributes']['login']) for p in data.get('included', None) or []
+            if p.get('type') == 'player' and p.get('attributes', {}).get('login')]
+
+
+class clanApiSource():
+    """
+    The members of a clan from the FAF api. The base url can point to any server that answers like the api,
+    e.g. a local stub.
+    """
+
+    def __init__(self, tag, baseUrl=DEFAULT_URL, timeout=10):
+        self.tag = tag
+        self.rest = registry.get(('rest', baseUrl), RestRequester, baseUrl, timeout=timeout)
+
+    async def fetch(self):
+        response = await self.rest.get('/data/clan', args={
+            'filter': 'tag=="%s"' % self.tag.replace('"', '\\"'),
+            'include': 'memberships.player',
+            'fields[clan]': 'tag,memberships',
+            'fields[clanMembership]': 'player',
+            'fields[player]': 'login',
+        })
+        if not response.ok:
+            raise IOError('FAF api answered %d for clan %s' % (response.status, self.tag))
+        return readMembers(response.json)
+
+
+class clanFileSource():
+    """
+    The members of a clan from a file: a clan answer of the api saved as .json, an exported roster,
+    or a .txt file with one name per line. Can stand in for the api.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    async def fetch(self):
+        with open(self.path, encoding='utf-8') as fd:
+            if self.path.endswith('.txt'):
+                return readMembers([line.strip() for line in fd])
+            return readMembers(json.load(fd))
+
+
+class clanRoster():
+    """
+    The clan members, stored in the db at clan/names as {name: faf id or True (added by hand)}.
+    Membership checks use an index of the lowercase names, built on first use and kept up to date by every change.
+    Every change is stored with one db write.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.index = None  # lowercase name -> name
+
+    def __len__(self):
+        return len(self.__ensureIndex())
+
+    def __members(self):
+        return self.db.get(['clan', 'names'])
+
+    def __ensureIndex(self):
+        if self.index is None:
+            self.index = {name.lower(): name for name in self.__members().keys()}
+        return self.index
+
+    def __set(self, name, id):
+        old = self.__ensureIndex().get(name.lower(), None)
+        if old is not None and old != name:
+            self.db.delete(['clan', 'names'], old, save=False)
+        self.db.add(['clan', 'names'], name, id, save=False)
+        self.index[name.lower()] = name
+
+    def __unset(self, name):
+        old = self.__ensureIndex().pop(name.lower(), None)
+        if old is not None:
+            self.db.delete(['clan', 'names'], old, save=False)
+        return old
+
+    def isMember(self, nick):
+        return nick.lower() in self.__ensureIndex()
+
+    def names(self):
+        return list(self.__members().keys())
+
+    def add(self, names):
+        """
+        Adds the names by hand, returns how many were new
+        """
+        added = 0
+        for name in names:
+            if not self.isMember(name):
+                self.__set(name, True)
+                added += 1
+        self.db.save()
+        return added
+
+    def remove(self, names):
+        """
+        Removes the names (case insensitive), returns how many were members
+        """
+        removed = len([name for name in names if self.__unset(name) is not None])
+        self.db.save()
+        return removed
+
+    def sync(self, found):
+        """
+        Updates the roster to the (id, name) found by a source. Members added by hand stay, synced members that were
+        not found are removed, a member whose id now has another name is renamed. Names without id are only added,
+        and nothing is removed if the source found nobody with an id (e.g. an empty answer).
+        Returns the added and removed names and the renamed (old, new) names.
+        """
+        byId = {str(id): name for name, id in self.__members().items() if id is not True}
+        foundIds = {str(id) for id, _ in found if id is not None}
+        added, removed, renamed = [], [], []
+        if foundIds:
+            for id, name in list(byId.items()):
+                if id not in foundIds:
+                    self.__unset(name)
+                    removed.append(name)
+        for id, name in found:
+            if id is None:
+                if not self.isMember(name):
+                    self.__set(name, True)
+                    added.append(name)
+                continue
+            old = byId.get(str(id), None)
+            if old is None:
+                if not self.isMember(name):
+                    added.append(name)
+                self.__set(name, str(id))
+            elif old != name:
+                self.__unset(old)
+                self.__set(name, str(id))
+                renamed.append((old, name))
+        self.db.save()
+        return added, removed, renamed
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fd:
+            json.dump({'names': self.__members()}, fd, indent=2, sort_keys=True)
@@ -1,8 +1,4 @@
 from __future__ import print_function
-from keras.models import Sequential
-from keras.layers import Dense, Activation
-from keras.layers import LSTM
-from keras.optimizers import RMSprop
 import numpy as np
 import random
 import sys
@@ -10,25 +6,48 @@ import json
 
 MAXLEN = 40
 
+
+def sample(preds, temperature=1.0):
+    # helper function to sample an index from a probability array
+    preds = np.asarray(preds).astype('float64') + 0.00001
+    preds = np.log(preds) / temperature
+    exp_preds = np.exp(preds)
+    preds = exp_preds / np.sum(exp_preds)
+    probas = np.random.multinomial(1, preds, 1)
+    return np.argmax(probas)
+
+
+def loadChars(config):
+    charfile = config.get('lstm_chars', False)
+    if not charfile:
+        return False
+    with open(charfile, 'r') as file:
+        return sorted(json.load(file))
+
+
 class LSTMGen():
 
-    def __init__(self, bot):
-        self.bot = bot
+    def __init__(self, config):
+        # keras is only imported for this backend, it takes forever to load
+        from keras.models import Sequential
+        from keras.layers import Dense, Activation
+        from keras.layers import LSTM
+        from keras.optimizers import RMSprop
+
+        self.config = config
         self.canGenerate = False
-        weightsfile = self.bot.config.get('lstm_weights', False)
-        charfile = self.bot.config.get('lstm_chars', False)
+        weightsfile = self.config.get('lstm_weights', False)
+        charfile = self.config.get('lstm_chars', False)
         if not (weightsfile and charfile):
             print('Failed getting LSTM file paths')
             return
 
-        with open(charfile, 'r') as file:
-            self.chars = json.load(file)
-            self.chars = sorted(self.chars)
+        self.chars = loadChars(self.config)
 
         self.char_indices = dict((c, i) for i, c in enumerate(self.chars))
         self.indices_char = dict((i, c) for i, c in enumerate(self.chars))
 
-        self.bot.config.get('spam_protect_time', 600)
+        self.config.get('spam_protect_time', 600)
         self.ready = False
         print('Building LSTM model...')
         self.model = Sequential()
@@ -36,7 +55,7 @@ class LSTMGen():
         self.model.add(Dense(len(self.chars)))
         self.model.add(Activation('softmax'))
         try:
-            self.model.set_weights(np.load(weightsfile))
+            self.model.set_weights(np.load(weightsfile, allow_pickle=True))
         except Exception:
             print('Failed building LSTM model!')
             return
@@ -45,13 +64,7 @@ class LSTMGen():
         self.canGenerate = True
 
     def sample(self, preds, temperature=1.0):
-        # helper function to sample an index from a probability array
-        preds = np.asarray(preds).astype('float64') + 0.00001
-        preds = np.log(preds) / temperature
-        exp_preds = np.exp(preds)
-        preds = exp_preds / np.sum(exp_preds)
-        probas = np.random.multinomial(1, preds, 1)
-        return np.argmax(probas)
+        return sample(preds, temperature)
 
     def generate(self, start, diversity, size):
         if not self.canGenerate:
@@ -65,7 +78,7 @@ class LSTMGen():
         for i in range(size+200):
             x = np.zeros((1, MAXLEN, len(self.chars)))
             for t, char in enumerate(sentence):
-                x[0, t, self.char_indices.get(char, " ")] = 1.
+                x[0, t, self.char_indices.get(char, self.char_indices.get(" ", 0))] = 1.
 
             preds = self.model.predict(x, verbose=0)[0]
             next_index = self.sample(preds, diversity)
@@ -81,3 +94,111 @@ class LSTMGen():
             generated += next_char
             sentence = sentence[1:] + next_char
         return generated
+
+
+def hardSigmoid(x):
+    # what keras (before tf 2) uses as default recurrent activation
+    return np.clip(0.2 * x + 0.5, 0., 1.)
+
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+class NumpyLSTMGen():
+    """
+    Same model as LSTMGen, using the same weights file, but running the LSTM + Dense + softmax layers in numpy.
+    The hidden state is carried along, so every generated char costs one cell step instead of running the
+    whole 40 char window through the model again. Does not import keras/tensorflow at all.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.canGenerate = False
+        weightsfile = self.config.get('lstm_weights', False)
+        charfile = self.config.get('lstm_chars', False)
+        if not (weightsfile and charfile):
+            print('Failed getting LSTM file paths')
+            return
+
+        self.chars = loadChars(self.config)
+
+        self.char_indices = dict((c, i) for i, c in enumerate(self.chars))
+        self.indices_char = dict((i, c) for i, c in enumerate(self.chars))
+        self.unknownIndex = self.char_indices.get(" ", 0)
+
+        if self.config.get('lstm_recurrent_activation', 'hard_sigmoid') == 'sigmoid':
+            self.recurrentActivation = sigmoid
+        else:
+            self.recurrentActivation = hardSigmoid
+
+        try:
+            # keras weight order: lstm kernel, lstm recurrent kernel, lstm bias, dense kernel, dense bias
+            kernel, recurrentKernel, bias, denseKernel, denseBias = np.load(weightsfile, allow_pickle=True)
+        except Exception:
+            print('Failed loading LSTM weights!')
+            return
+        self.units = recurrentKernel.shape[0]
+        if kernel.shape != (len(self.chars), 4*self.units) or denseKernel.shape != (self.units, len(self.chars)):
+            print('LSTM weights do not match the chars file!')
+            return
+        # the input is one-hot, so input x kernel is just picking a row; the bias is added right away
+        self.inputRows = (kernel + bias).astype('float64')
+        self.recurrentKernel = recurrentKernel.astype('float64')
+        self.denseKernel = denseKernel.astype('float64')
+        self.denseBias = denseBias.astype('float64')
+        self.canGenerate = True
+
+    def sample(self, preds, temperature=1.0):
+        return sample(preds, temperature)
+
+    def initialState(self):
+        return np.zeros(self.units), np.zeros(self.units)
+
+    def step(self, char, state):
+        """
+        one LSTM cell step, gates are ordered i, f, c, o (keras)
+        :return: new (h, c) state
+        """
+        h, c = state
+        u = self.units
+        z = self.inputRows[self.char_indices.get(char, self.unknownIndex)] + h.dot(self.recurrentKernel)
+        i = self.recurrentActivation(z[:u])
+        f = self.recurrentActivation(z[u:2*u])
+        c = f * c + i * np.tanh(z[2*u:3*u])
+        o = self.recurrentActivation(z[3*u:])
+        return o * np.tanh(c), c
+
+    def predict(self, state):
+        logits = state[0].dot(self.denseKernel) + self.denseBias
+        exp = np.exp(logits - np.max(logits))
+        return exp / np.sum(exp)
+
+    def generate(self, start, diversity, size):
+        if not self.canGenerate:
+            return start
+        sentence = start.lower()[-MAXLEN:]
+        generated = ''
+        if not len(sentence) == 40:
+            print('cancel gen', len(sentence))
+            return
+
+        state = self.initialState()
+        for char in sentence:
+            state = self.step(char, state)
+
+        for i in range(size+200):
+            preds = self.predict(state)
+            next_index = self.sample(preds, diversity)
+            next_char = self.indices_char[next_index]
+
+            if next_char == ' ' and i >= size:
+                next_char = '\n'
+            if next_char == '\n':
+                if random.random()*size < i:
+                    break
+                next_char = ' '
+
+            generated += next_char
+            state = self.step(next_char, state)
+        return generated
@@ -0,0 +1,151 @@
+import time
+from botcore.rest import RestRequester
+from botcore.shared import registry
+
+
+DEFAULT_URL = 'https://api.faforever.com'
+
+
+class ttlCache():
+    """
+    Values expire ttl seconds after they were set, None is a valid (cached) value.
+    Expired entries are dropped when the cache grows past maxSize.
+    """
+
+    def __init__(self, ttl=3600, maxSize=10000):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.entries = {}
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key, None)
+        if entry is None or entry[0] < time.time():
+            return default
+        return entry[1]
+
+    def has(self, key):
+        entry = self.entries.get(key, None)
+        return entry is not None and entry[0] >= time.time()
+
+    def set(self, key, value):
+        if len(self.entries) >= self.maxSize:
+            self.prune()
+        self.entries[key] = (time.time() + self.ttl, value)
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def prune(self):
+        now = time.time()
+        for key in [k for k, v in self.entries.items() if v[0] < now]:
+            del self.entries[key]
+        if len(self.entries) >= self.maxSize:
+            # still full of valid entries, drop the ones that expire first
+            for key, _ in sorted(self.entries.items(), key=lambda kv: kv[1][0])[:len(self.entries) // 4 + 1]:
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class fafApi():
+    """
+    Asynchronous client of the FAF json api, for use on the irc3 loop.
+    Requests go through the shared RestRequester, which keeps the connections alive, limits how many are open
+    and revalidates unchanged responses. Every request times out.
+    Player id <-> name lookups are cached (including misses), several players are queried in one request.
+    The base url can point to any server that answers like the api, e.g. a local stub.
+    """
+
+    def __init__(self, baseUrl=DEFAULT_URL, timeout=10, cacheTtl=3600, maxConnections=8, batchSize=50):
+        # bots in the same process share the connections to the api
+        self.rest = registry.get(('rest', baseUrl), RestRequester, baseUrl, timeout=timeout, max_per_host=maxConnections)
+        self.batchSize = max(int(batchSize), 1)
+        self.names = ttlCache(float(cacheTtl))  # id -> list of previous names, oldest first
+        self.ids = ttlCache(float(cacheTtl))    # lowercase login -> id
+
+    async def close(self):
+        # other bots may still use the requester, it opens a new session when needed
+        await self.rest.close()
+
+    async def getJson(self, path, params):
+        response = await self.rest.get(path, args=params)
+        if not response.ok:
+            raise IOError('FAF api answered %d for %s' % (response.status, path))
+        return response.json
+
+    @staticmethod
+    def chunks(items, size):
+        items = list(items)
+        for i in range(0, len(items), size):
+            yield items[i:i+size]
+
+    @staticmethod
+    def quote(value):
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    async def getNameHistories(self, ids):
+        """
+        Previous names of several players, {id: [names, oldest first]}, an empty list for unknown ids.
+        Raises on network errors or timeouts, results fetched before that stay cached.
+        """
+        ids = [str(i) for i in ids]
+        missing = [i for i in dict.fromkeys(ids) if not self.names.has(i)]
+        for chunk in self.chunks(missing, self.batchSize):
+            ans = await self.getJson('/data/player', {
+                'filter': 'id=in=(%s)' % ','.join(chunk),
+                'include': 'names',
+                'fields[player]': 'login,names',
+                'fields[nameRecord]': 'name',
+                'page[size]': str(len(chunk)),
+            })
+            records = {r['id']: r['attributes']['name'] for r in (ans.get('included', None) or [])
+                       if r.get('type') == 'nameRecord'}
+            found = {}
+            for player in ans.get('data', None) or []:
+                names = player.get('relationships', {}).get('names', {}).get('data', None) or []
+                found[str(player['id'])] = [records[n['id']] for n in names if n['id'] in records]
+                login = player.get('attributes', {}).get('login', None)
+                if login is not None:
+                    self.ids.set(login.lower(), str(player['id']))
+            for i in chunk:
+                self.names.set(i, found.get(i, []))
+        return {i: self.names.get(i, []) for i in ids}
+
+    async def getNameHistory(self, id):
+        return (await self.getNameHistories([id]))[str(id)]
+
+    async def getPlayerIds(self, names):
+        """
+        Ids of the players currently named so, {name: id}, None if nobody has that name.
+        """
+        missing = [n for n in dict.fromkeys(names) if not self.ids.has(n.lower())]
+        for chunk in self.chunks(missing, self.batchSize):
+            ans = await self.getJson('/data/player', {
+                'filter': 'login=in=(%s)' % ','.join(self.quote(n) for n in chunk),
+                'fields[player]': 'login',
+                'page[size]': str(len(chunk)),
+            })
+            found = {p['attributes']['login'].lower(): str(p['id']) for p in ans.get('data', None) or []}
+            for n in chunk:
+                self.ids.set(n.lower(), found.get(n.lower(), None))
+        return {n: self.ids.get(n.lower(), None) for n in names}
+
+    async def getPlayerId(self, name):
+        return (await self.getPlayerIds([name]))[name]
+
+    def forget(self, id=None, name=None):
+        """
+        Drops cached lookups, e.g. after someone renamed
+        """
+        if id is not None:
+            self.names.remove(str(id))
+        if name is not None:
+            self.ids.remove(name.lower())
+
+    def getStats(self):
+        return {
+            'requests': self.rest.requests,
+            'cachedNames': len(self.names.entries),
+            'cachedIds': len(self.ids.entries),
+        }
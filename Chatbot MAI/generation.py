@@ -0,0 +1,122 @@
+import asyncio
+import concurrent.futures
+import traceback
+
+
+# generator objects of this process, in the workers these are the only copies
+GENERATORS = {}
+
+
+def initGenerator(name, factory, args):
+    try:
+        GENERATORS[name] = factory(*args)
+    except Exception:
+        print('Failed creating generator', name)
+        print(traceback.format_exc())
+
+
+def runGenerator(name, method, args, kwargs):
+    generator = GENERATORS.get(name, None)
+    if generator is None:
+        raise KeyError('No generator named ' + name)
+    return getattr(generator, method)(*args, **kwargs)
+
+
+def markovFactory(path):
+    from markov import Markov
+    return Markov(None, path)
+
+
+def lstmFactory(config):
+    if config.get('lstm_backend', 'numpy') == 'keras':
+        from LSTMGen import LSTMGen
+    else:
+        from LSTMGen import NumpyLSTMGen as LSTMGen
+    return LSTMGen(config)
+
+
+class generationService():
+    """
+    Runs the text generators (markov chains, LSTM) off the irc3 loop.
+    Every generator gets its own single worker, so its state (e.g. parsed files) stays consistent,
+    while different generators work in parallel. With processes the main process holds none of their memory.
+    Identical pending requests are only computed once, every request can time out or be cancelled.
+    """
+
+    def __init__(self, loop, useProcesses=True, timeout=10):
+        self.loop = loop
+        self.useProcesses = useProcesses
+        self.timeout = timeout
+        self.executors = {}
+        self.pending = {}
+
+    def add(self, name, factory, *args):
+        self.remove(name)
+        if self.useProcesses:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        executor.submit(initGenerator, name, factory, args)
+        self.executors[name] = executor
+
+    def remove(self, name):
+        executor = self.executors.pop(name, None)
+        if executor is not None:
+            self.cancel(name)
+            executor.shutdown(wait=False)
+
+    def stop(self):
+        for name in list(self.executors.keys()):
+            self.remove(name)
+
+    def submit(self, name, method, *args, **kwargs):
+        return self.executors[name].submit(runGenerator, name, method, args, kwargs)
+
+    def callSync(self, name, method, *args, timeout=None, **kwargs):
+        """
+        For threads and blocking code, waits for the result
+        """
+        return self.submit(name, method, *args, **kwargs).result(timeout=timeout or self.timeout)
+
+    @asyncio.coroutine
+    def call(self, name, method, *args, timeout=None, dedup=True, default=None, **kwargs):
+        """
+        Awaits the result of generator.method(*args, **kwargs) without blocking the loop.
+        Returns default if the request timed out, was cancelled or failed.
+        Requests that change the generator must not be deduplicated.
+        """
+        key = (name, method, args, tuple(sorted(kwargs.items())))
+        if not dedup:
+            key += (object(),)
+        entry = self.pending.get(key, None)
+        if entry is None:
+            future = asyncio.wrap_future(self.submit(name, method, *args, **kwargs), loop=self.loop)
+            entry = [future, 0]
+            self.pending[key] = entry
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        entry[1] += 1
+        try:
+            return (yield from asyncio.wait_for(asyncio.shield(entry[0]), timeout or self.timeout))
+        except asyncio.TimeoutError:
+            print('Generation timed out:', name, method)
+        except asyncio.CancelledError:
+            if not entry[0].cancelled():
+                # the awaiting command itself got cancelled
+                raise
+            print('Generation cancelled:', name, method)
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                # nobody is waiting for it anymore, does nothing if the worker already started on it
+                entry[0].cancel()
+        return default
+
+    def cancel(self, name=None):
+        """
+        Cancels all pending requests (for the given generator)
+        """
+        for key, entry in list(self.pending.items()):
+            if name is None or key[0] == name:
+                entry[0].cancel()
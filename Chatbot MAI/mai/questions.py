@@ -16,15 +16,30 @@ class Questions():
         self.chateventsObj = chateventsObj
         self.jsonpath = jsonpath
         self.lock = threading.Lock()
-        self.questions = {}
+        self.questions = []
+        self.tag_index = {}
+        self.tag_counts = {}
         self.current_question = None
         self.current_answers = {}
+        self.load()
+
+    def load(self):
+        """ (re)loads the questions file and rebuilds the tag index """
         try:
             with open(self.jsonpath, 'r+') as file:
-                self.questions = json.load(file)
+                questions = json.load(file)
         except:
-            print('Questions could not be loaded! From: ' + jsonpath)
-            pass
+            print('Questions could not be loaded! From: ' + self.jsonpath)
+            return False
+        tag_index = {}
+        for i, q in enumerate(questions):
+            for t in q.get('tags', []):
+                tag_index.setdefault(t, set()).add(i)
+        with self.lock:
+            self.questions = questions
+            self.tag_index = tag_index
+            self.tag_counts = {t: len(ids) for t, ids in tag_index.items()}
+        return True
 
     def __output_to_chat(self, channel, msg):
         self.bot.privmsg(channel, msg)
@@ -50,13 +65,9 @@ class Questions():
         self.current_answers = {}
 
     def get_tags(self, id, channel):
-        tags = {}
-        for q in self.questions:
-            for t in q.get('tags'):
-                tags[t] = tags.get(t, 0) + 1
         self.__output_to_chat(channel, "There are {n} questions in total, by tags: {t}".format(**{
             "n": len(self.questions),
-            "t": repr(tags),
+            "t": repr(self.tag_counts),
         }))
 
     def question(self, id, channel, tags=[]):
@@ -66,19 +77,20 @@ class Questions():
             self.__output_to_chat(channel, "There is already a question to solve!")
             self.__output_to_chat(channel, self.__question_as_str(self.current_question))
             return False
-        questions = self.questions
         if tags:
-            for tag in tags:
-                questions = [q for q in self.questions if tag in q.get("tags", [])]
-                if len(questions) == 0:
-                    self.lock.release()
-                    self.__output_to_chat(channel, "No question satisfies all tags!")
-                    return False
-        i = random.randint(0, len(questions)-1)
-        q = questions[i]
+            # smallest sets first, so the intersection stays small
+            ids = sorted([self.tag_index.get(tag, set()) for tag in tags], key=len)
+            ids = set.intersection(*ids)
+            if len(ids) == 0:
+                self.lock.release()
+                self.__output_to_chat(channel, "No question satisfies all tags!")
+                return False
+            i = random.choice(tuple(ids))
+        else:
+            i = random.randint(0, len(self.questions)-1)
+        q = self.questions[i]
         correct = q.get("a")[random.randint(0, len(q.get("a"))-1)]
-        all_correct = q.get('a')
-        all_correct.extend(q.get('ha', []))
+        all_correct = q.get('a') + q.get('ha', [])
         self.current_question = {
             'by': id,
             'req_tag': tags,
@@ -10,8 +10,19 @@ MAXCHAINLENGTH = 20
 CHAINLENGTHCHANCE = 0.92
 
 
+def pickWeightedRandom(dct):
+    total = sum(dct.values())
+    v = random.random() * total
+    for key in dct.keys():
+        v -= dct[key]
+        if v <= 0:
+            return key, total
+    return list(dct.keys())[len(dct)-1], total
+
+
 class Markov():
     def __init__(self, plugin, wordfilepath):
+        # plugin can be None (e.g. in generation workers), targetChannel then has to be a collection of nicks
         self.plugin = plugin
         self.wordfilepath = wordfilepath
         self.markovwords = {}
@@ -104,7 +115,7 @@ class Markov():
             if wordGroup and len(wordGroup['wordsF']) > 0:
                 word, stop = False, True
                 for _ in range(10):
-                    word, _ = self.plugin.pickWeightedRandom(wordGroup['wordsF'])
+                    word, _ = pickWeightedRandom(wordGroup['wordsF'])
                     if self.__isSuitableChainWord(word, targetChannel):
                         stop = False
                         break
@@ -126,7 +137,7 @@ class Markov():
             if wordGroup and len(wordGroup['wordsB']) > 0:
                 word, stop = False, True
                 for _ in range(10):
-                    word, _ = self.plugin.pickWeightedRandom(wordGroup['wordsB'])
+                    word, _ = pickWeightedRandom(wordGroup['wordsB'])
                     if self.__isSuitableChainWord(word, targetChannel):
                         stop = False
                         break
@@ -181,7 +192,10 @@ class Markov():
         return 1
 
     def __isSuitableChainWord(self, word, channel):
-        if self.plugin.isInChannel(word, channel):
+        if self.plugin:
+            if self.plugin.isInChannel(word, channel):
+                return False
+        elif channel and word in channel:
             return False
         if "http://" in word or "https://" in word:
             return False
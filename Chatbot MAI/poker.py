@@ -3,6 +3,7 @@ import random
 import asyncio
 
 from timed_input_accumulator import timedInputAccumulatorThread
+import pokereval
 import time
 
 useDebugPrint = False
@@ -147,6 +148,7 @@ class Poker:
             for v in range(2, 15):
                 self.remainingCards.append((t, v))
         self.knownCards = 1
+        self.revealedCards = 0
         _, self.midCards = self.__pickRandomCards(5)
         self.currentStake = 0
         self.starttime = 0 # changed when first round begins
@@ -184,122 +186,9 @@ class Poker:
         #self.debugPrint(channel + ': ' + msg)
         self.bot.privmsg(channel, msg)
 
-    def __cardsIsFlush(self, playercards):
-        # return true/false, subset (at least 5), remaining
-        cards = playercards + []
-        for type in range(4):
-            if sum([1 if t==type else 0 for t,v in cards]) >= 5:
-                subset, remaining = [], []
-                for t,v in cards:
-                    if t==type: subset.append((t,v))
-                    else: remaining.append((t,v))
-                return True, subset, remaining
-        return False, [], playercards
-
-    def __cardsIsStraight(self, playercards):
-        # return true/false, subset (at least 5), remaining
-        cards = playercards + []
-        cards = sorted(cards, key=lambda v: v[1], reverse=True)
-        for number in range(14, 4, -1):
-            used = [False for i in range(len(cards))]
-            usedAce = [False for i in range(len(cards))]
-            for n in range(number, number-5, -1):
-                for i in range(len(cards)):
-                    t,v = cards[i]
-                    if v==n:
-                        used[i] = True
-                        break
-                    if v==14 and n==1: # ace also counts as 1
-                        usedAce[i] = True
-                        break
-            if sum(used)+sum(usedAce) >= 5:
-                straight, remaining = [], []
-                for i in range(len(cards)):
-                    t,v = cards[i]
-                    if used[i]: straight.append((t,v))
-                    elif usedAce[i]: straight.append((t,1))
-                    else: remaining.append((t,v))
-                straight = sorted(straight, key=lambda v: v[1], reverse=True)
-                return True, straight, remaining
-        return False, [], playercards
-
-    def __cardsIsMultiple(self, playercards, count=2):
-        # return true/false, subset (at least count), remaining
-        cards = playercards + []
-        for number in range(14, 1, -1):
-            multiple, remaining = [], []
-            for t,v in cards:
-                if v==number: multiple.append((t,v))
-                else: remaining.append((t,v))
-            if len(multiple) >= count:
-                return True, multiple, remaining
-        return False, [], playercards
-
-    def __cardsHighest(self, playercards):
-        # returns highest card, remaining
-        cards = playercards+[]
-        hv, index = -1, -1
-        for i in range(len(cards)):
-            t, v = cards[i]
-            if v > hv:
-                hv = v
-                index = i
-        if index >= 0:
-            card = cards.pop(index)
-            return card, cards
-        return (-1,-1), playercards
-
-    def __evaluateHelper(self, mv, cardgroups):
-        v, highest, rem = [mv], False, []
-        for cg in cardgroups:
-            rem = cg
-            while (len(rem) > 0) and (len(v) < 6):
-                highest, rem = self.__cardsHighest(rem)
-                v.append(highest[1])
-        return v
-
     def __evaluateCardsValue(self, playercards):
-        # returns [value of match, value1 of match card, value2 of match card, value of highest card]
-        cards = playercards + self.midCards
-        isFlush, flushcards, _ = self.__cardsIsFlush(cards)
-        isStraightFlush, sflushcards, _ = self.__cardsIsStraight(flushcards)
-        highestSFlushCard, _ = self.__cardsHighest(sflushcards)
-        isRoyalFlush = (highestSFlushCard[1] == 14)
-        if isRoyalFlush and isStraightFlush:
-            # royal straight flush
-            return self.__evaluateHelper(10, [sflushcards])
-        if isStraightFlush:
-            # straight flush
-            return self.__evaluateHelper(9, [sflushcards])
-        isMultiple4, mult4cards, remaining = self.__cardsIsMultiple(cards, count=4)
-        if isMultiple4:
-            # four of a kind
-            return self.__evaluateHelper(8, [mult4cards, remaining])
-        isMultiple3, mult3cards, mult3remaining = self.__cardsIsMultiple(cards, count=3)
-        if isMultiple3:
-            isMultiple2, mult2cards, remaining = self.__cardsIsMultiple(mult3remaining, count=2)
-            if isMultiple2:
-                # full house
-                return self.__evaluateHelper(7, [mult3cards, mult2cards])
-        if isFlush:
-            # regular flush
-            return self.__evaluateHelper(6, [flushcards])
-        isStraight, straightcards, remaining = self.__cardsIsStraight(cards)
-        if isStraight:
-            # regular straight
-            return self.__evaluateHelper(5, [straightcards])
-        if isMultiple3:
-            # three of a kind
-            return self.__evaluateHelper(4, [mult3cards, mult3remaining])
-        isMultiple2, mult2cards, remaining = self.__cardsIsMultiple(cards, count=2)
-        if isMultiple2:
-            isMultiple2second, mult2secondCards, mult2secondremaining = self.__cardsIsMultiple(remaining, count=2)
-            if isMultiple2second:
-                # two pairs
-                return self.__evaluateHelper(3, [mult2cards, mult2secondCards, mult2secondremaining])
-            # one pair
-            return self.__evaluateHelper(2, [mult2cards, remaining])
-        return self.__evaluateHelper(1, [cards])
+        # returns a comparable int, the match type (key of cardEvalToStringType) is pokereval.category(value)
+        return pokereval.evaluate(playercards + self.midCards)
 
     def __gameEndComment(self, matchvalue, winnercount):
         if winnercount > 1:
@@ -330,23 +219,11 @@ class Poker:
             # evaluate, find highest
             for name in self.playerOrder:
                 self.players[name]['cardvalues'] = self.__evaluateCardsValue(self.players[name]['cards'])
-            highestUsers = self.playerOrder+[]
-            for i in range(len(self.players[self.playerOrder[0]]['cardvalues'])):
-                if len(highestUsers) <= 1:
-                    break
-                nextHighestUsers = []
-                highestValue = -1
-                for name in highestUsers:
-                    v = self.players[name]['cardvalues'][i]
-                    if v > highestValue:
-                        highestValue = v
-                        nextHighestUsers = [name]
-                    elif v == highestValue:
-                        nextHighestUsers.append(name)
-                highestUsers = nextHighestUsers
+            highestValue = max([self.players[name]['cardvalues'] for name in self.playerOrder])
+            highestUsers = [name for name in self.playerOrder if self.players[name]['cardvalues'] == highestValue]
             winners = highestUsers
             winnername = highestUsers[0]
-            winningtype = self.players[highestUsers[0]]['cardvalues'][0]
+            winningtype = pokereval.category(highestValue)
             stringFormat = {
                 'name' : winnername,
                 'stake' : str(stake),
@@ -426,6 +303,7 @@ class Poker:
         pot = sum([v.get('totalpoints', 0) for v in self.players.values()])
         cardString = "No revealed cards this turn, "
         if revealCards:
+            self.revealedCards = self.knownCards
             cardString = "Known cards: [{}], ".format(self.__readableCardList(self.midCards[:self.knownCards]))
         self.__outputToChat(self.channel, "Beginning new round! {pot} points in the pot! {cardstring}Order is: [{order}]".format(**{
             "cardstring" : cardString,
@@ -631,6 +509,38 @@ class Poker:
             }))
         return True
 
+    def oddsSnapshot(self, name):
+        """
+        (cards, board, opponents) of the player, copied under the game lock so the estimate can run in another thread,
+        None (and the player is told) if the player is not playing
+        """
+        self.lock.acquire()
+        try:
+            if not (self.gameIsRunning and name in self.playerOrder):
+                self.__outputToChat(name, "You are not playing in {}!".format(self.channel))
+                return None
+            opponents = max([len(self.playerOrder) - 1, 1])
+            return list(self.players[name]['cards']), list(self.midCards[:self.revealedCards]), opponents
+        finally:
+            self.lock.release()
+
+    def estimateOdds(self, snapshot, timeBudget=0.25):
+        """ the slow part of the odds command, touches no game state """
+        cards, board, opponents = snapshot
+        return pokereval.estimateEquity(cards, board, opponents, timeBudget=timeBudget)
+
+    def tellOdds(self, name, snapshot, result):
+        # only tells the player, by pm
+        cards, board, opponents = snapshot
+        self.__outputToChat(name, "Your cards: [{cards}], table: [{board}], {opponents} opponent(s): you win {win}% and split {tie}% of the games (estimated from {samples} games)".format(**{
+            'cards' : self.__readableCardList(cards),
+            'board' : self.__readableCardList(board),
+            'opponents' : opponents,
+            'win' : format(100 * result['win'], '.1f'),
+            'tie' : format(100 * result['tie'], '.1f'),
+            'samples' : result['samples'],
+        }))
+
     def isRunning(self):
         return self.gameIsRunning
 
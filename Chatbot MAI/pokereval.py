@@ -0,0 +1,242 @@
+"""
+Table driven poker hand evaluation.
+
+Cards are (type, value) tuples as used by poker.py, value 2-14 (ace high).
+A hand (any 5-7 cards) is evaluated to a single int, a higher int is a better hand.
+The category (see poker.cardEvalToStringType) is stored in the highest bits, the ranks deciding ties below.
+
+evaluateBatch does the same for many 7 card hands at once in numpy, which estimateEquity uses to simulate
+thousands of possible game outcomes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+CATEGORY_SHIFT = 20
+ALLRANKS = (1 << 13) - 1
+WHEEL = (1 << 12) | 0b1111  # A, 2, 3, 4, 5
+
+
+def _straightHigh(mask):
+    for high in range(14, 5, -1):
+        window = 0b11111 << (high - 6)
+        if mask & window == window:
+            return high
+    if mask & WHEEL == WHEEL:
+        return 5
+    return 0
+
+
+# indexed by a 13 bit rank mask (bit 0 = card value 2, bit 12 = ace)
+POPCOUNT = [bin(m).count('1') for m in range(ALLRANKS + 1)]
+STRAIGHTHIGH = [_straightHigh(m) for m in range(ALLRANKS + 1)]
+RANKSDESC = [tuple(v for v in range(14, 1, -1) if m & (1 << (v - 2))) for m in range(ALLRANKS + 1)]
+
+
+def _value(category, ranks):
+    v = category
+    for i in range(5):
+        v = (v << 4) | (ranks[i] if i < len(ranks) else 0)
+    return v
+
+
+def category(value):
+    return value >> CATEGORY_SHIFT
+
+
+def evaluate(cards):
+    """
+    :param cards: list of (type, value) tuples
+    :return: comparable int, category(int) is the key of cardEvalToStringType
+    """
+    suits = [0, 0, 0, 0]
+    seen1, seen2, seen3, seen4 = 0, 0, 0, 0
+    for t, v in cards:
+        b = 1 << (v - 2)
+        suits[t] |= b
+        seen4 |= seen3 & b
+        seen3 |= seen2 & b
+        seen2 |= seen1 & b
+        seen1 |= b
+
+    flush = 0
+    for mask in suits:
+        if POPCOUNT[mask] >= 5:
+            flush = mask
+            high = STRAIGHTHIGH[mask]
+            if high == 14:
+                return _value(10, (14,))
+            if high:
+                return _value(9, (high,))
+            break
+
+    if seen4:
+        quad = RANKSDESC[seen4][0]
+        return _value(8, (quad, RANKSDESC[seen1 & ~(1 << (quad - 2))][0]))
+
+    if seen3:
+        trips = RANKSDESC[seen3][0]
+        pairs = seen2 & ~(1 << (trips - 2))
+        if pairs:
+            return _value(7, (trips, RANKSDESC[pairs][0]))
+
+    if flush:
+        return _value(6, RANKSDESC[flush][:5])
+
+    high = STRAIGHTHIGH[seen1]
+    if high:
+        return _value(5, (high,))
+
+    if seen3:
+        return _value(4, (trips,) + RANKSDESC[seen1 & ~(1 << (trips - 2))][:2])
+
+    if seen2:
+        pairs = RANKSDESC[seen2]
+        if len(pairs) >= 2:
+            used = (1 << (pairs[0] - 2)) | (1 << (pairs[1] - 2))
+            return _value(3, pairs[:2] + RANKSDESC[seen1 & ~used][:1])
+        return _value(2, pairs[:1] + RANKSDESC[seen1 & ~(1 << (pairs[0] - 2))][:3])
+
+    return _value(1, RANKSDESC[seen1][:5])
+
+
+# numpy versions of the tables, the ranks of a mask are packed into nibbles (highest first)
+def _packed(mask, n):
+    ranks = RANKSDESC[mask][:n]
+    v = 0
+    for i in range(n):
+        v = (v << 4) | (ranks[i] if i < len(ranks) else 0)
+    return v
+
+
+def _topBits(mask, n):
+    bits = 0
+    for v in RANKSDESC[mask][:n]:
+        bits |= 1 << (v - 2)
+    return bits
+
+
+NP_POPCOUNT = np.array(POPCOUNT, dtype=np.int64)
+NP_STRAIGHTHIGH = np.array(STRAIGHTHIGH, dtype=np.int64)
+NP_PACKED = {n: np.array([_packed(m, n) for m in range(ALLRANKS + 1)], dtype=np.int64) for n in [1, 2, 3, 5]}
+NP_TOPBITS = {n: np.array([_topBits(m, n) for m in range(ALLRANKS + 1)], dtype=np.int64) for n in [1, 2]}
+NP_RANKBITS = 1 << np.arange(13, dtype=np.int64)
+
+
+def cardToIndex(card):
+    t, v = card
+    return t * 13 + v - 2
+
+
+def evaluateBatch(cards):
+    """
+    :param cards: int array of shape (n, 7), cards as cardToIndex
+    :return: int64 array of shape (n,), same values as evaluate()
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    suits, ranks = cards // 13, cards % 13
+    bits = NP_RANKBITS[ranks]
+    counts = np.zeros((cards.shape[0], 13), dtype=np.int64)
+    for i in range(cards.shape[1]):
+        counts[np.arange(cards.shape[0]), ranks[:, i]] += 1
+    seen1, seen2, seen3, seen4 = [(counts >= k).dot(NP_RANKBITS) for k in range(1, 5)]
+
+    # at most one suit can have 5 or more of 7 cards
+    flush = np.zeros(cards.shape[0], dtype=np.int64)
+    for t in range(4):
+        mask = np.where(suits == t, bits, 0).sum(axis=1)
+        flush = np.where(NP_POPCOUNT[mask] >= 5, mask, flush)
+    sflushHigh = NP_STRAIGHTHIGH[flush]
+    straightHigh = NP_STRAIGHTHIGH[seen1]
+    tripsBit = NP_TOPBITS[1][seen3]
+    fhPairs = seen2 & ~tripsBit
+    pairsBits = NP_TOPBITS[2][seen2]
+
+    c = CATEGORY_SHIFT
+    conditions = [
+        sflushHigh == 14,
+        sflushHigh > 0,
+        seen4 > 0,
+        (seen3 > 0) & (fhPairs > 0),
+        flush > 0,
+        straightHigh > 0,
+        seen3 > 0,
+        NP_POPCOUNT[seen2] >= 2,
+        seen2 > 0,
+    ]
+    values = [
+        (10 << c) | (14 << 16),
+        (9 << c) | (sflushHigh << 16),
+        (8 << c) | (NP_PACKED[1][seen4] << 16) | (NP_PACKED[1][seen1 & ~seen4] << 12),
+        (7 << c) | (NP_PACKED[1][seen3] << 16) | (NP_PACKED[1][fhPairs] << 12),
+        (6 << c) | NP_PACKED[5][flush],
+        (5 << c) | (straightHigh << 16),
+        (4 << c) | (NP_PACKED[1][seen3] << 16) | (NP_PACKED[2][seen1 & ~tripsBit] << 8),
+        (3 << c) | (NP_PACKED[2][seen2] << 12) | (NP_PACKED[1][seen1 & ~pairsBits] << 8),
+        (2 << c) | (NP_PACKED[1][seen2] << 16) | (NP_PACKED[3][seen1 & ~NP_TOPBITS[1][seen2]] << 4),
+    ]
+    return np.select(conditions, values, default=(1 << c) | NP_PACKED[5][seen1])
+
+
+EQUITYCACHE = OrderedDict()
+EQUITYCACHE_SIZE = 500
+EQUITYCACHE_LOCK = threading.Lock()
+
+
+def estimateEquity(hand, board, opponents, timeBudget=0.25, batchSize=2000, maxSamples=100000):
+    """
+    Monte Carlo estimate of how likely the hand wins against the given number of opponents,
+    the not yet revealed board cards and the opponents cards are sampled from the remaining deck.
+    Stops after timeBudget seconds or maxSamples samples, results are cached.
+    Can run in several threads at once (e.g. in an executor, off the irc3 loop).
+    :param hand: the players (two) cards
+    :param board: the revealed table cards
+    :return: dict with win, tie (chance to split the pot) and equity (pot share) in [0, 1], and the sample count
+    """
+    key = (tuple(sorted(hand)), tuple(sorted(board)), opponents)
+    with EQUITYCACHE_LOCK:
+        if key in EQUITYCACHE:
+            EQUITYCACHE.move_to_end(key)
+            return EQUITYCACHE[key]
+
+    known = [cardToIndex(c) for c in hand + board]
+    deck = np.array([i for i in range(52) if i not in known], dtype=np.int64)
+    missing = 5 - len(board)
+    draw = missing + 2 * opponents
+    fixed = np.array(known, dtype=np.int64)
+
+    wins, ties, equity, samples = 0., 0., 0., 0
+    t0 = time.time()
+    while samples < maxSamples and (samples == 0 or time.time() - t0 < timeBudget):
+        n = min(batchSize, maxSamples - samples)
+        # a random permutation of the deck per sample, only the first cards are used
+        drawn = deck[np.argsort(np.random.random((n, len(deck))), axis=1)[:, :draw]]
+        boards = np.concatenate([np.broadcast_to(fixed[len(hand):], (n, len(board))), drawn[:, :missing]], axis=1)
+        own = evaluateBatch(np.concatenate([np.broadcast_to(fixed[:len(hand)], (n, len(hand))), boards], axis=1))
+        best = np.zeros(n, dtype=np.int64)
+        bestCount = np.zeros(n, dtype=np.int64)
+        for o in range(opponents):
+            holes = drawn[:, missing + 2 * o:missing + 2 * o + 2]
+            other = evaluateBatch(np.concatenate([holes, boards], axis=1))
+            bestCount = np.where(other > best, 1, np.where(other == best, bestCount + 1, bestCount))
+            best = np.maximum(best, other)
+        won = own > best
+        tied = own == best
+        wins += won.sum()
+        ties += tied.sum()
+        equity += won.sum() + (tied / (bestCount + 1)).sum()
+        samples += n
+
+    result = {
+        'win': float(wins / samples),
+        'tie': float(ties / samples),
+        'equity': float(equity / samples),
+        'samples': samples,
+    }
+    with EQUITYCACHE_LOCK:
+        EQUITYCACHE[key] = result
+        while len(EQUITYCACHE) > EQUITYCACHE_SIZE:
+            EQUITYCACHE.popitem(last=False)
+    return result
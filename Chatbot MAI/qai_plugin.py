@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 import random
 import asyncio
-import urllib
 import re
 
 import irc3
@@ -10,16 +9,29 @@ from irc3.plugins.command import command
 from irc3.plugins.async import Whois
 import time
 import threading
+import functools
 import os
 import codecs
 import traceback
 import json
 import shutil
+import sys
+
+# the shared bot code in botcore/ lives in the repository root
+if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from twitch import twitchThread
 from timed_input_accumulator import timedInputAccumulatorThread
 from periodic_callback import periodicCallback
-from markov import Markov
+from generation import generationService, markovFactory, lstmFactory
+from markov import pickWeightedRandom
+from fafapi import fafApi, DEFAULT_URL as FAF_API_URL
+from botcore.identify import NickServIdentification
+from botcore.metrics import metrics
+from botcore.ratelimit import Cooldowns
+from botcore.storage import BatchedDb, manage_list
+from botcore.utils import is_in_channel, filter_in_channel
 from points import Points
 from events import Events
 from poker import Poker
@@ -33,19 +45,12 @@ MAIN_CHANNEL = "#aeolus" #   shadows
 POKER_CHANNEL = "#poker" #   shadows
 IGNOREDUSERS = {}
 CDPRIVILEDGEDUSERS = {}
-NICKSERVIDENTIFIEDRESPONSES = {}
-NICKSERVRESPONSESLOCK = None
 TIMERS = {}
 VARS = {}
 REACTION_WORDS = {}
 DEFAULTCD = False
 DEFAULTVALUE = False
 
-RENAME_API_URL = "https://api.faforever.com/data/player/{id}?include=names&fields[nameRecord]=name"
-RENAME_API_URL_NAME = "https://api.faforever.com/data/player?filter=(login=={name})"
-
-NICKSERV_WAIT_TICKS = 60
-
 CHATLVL_COMMANDLOCK = False
 CHATLVL_RESETNAME = '#reset'
 CHATLVL_NORESETNAME = '#noreset'
@@ -71,18 +76,20 @@ class Plugin(object):
 
     requires = [
         'irc3.plugins.userlist',
+        'botcore.identify',
+        'botcore.metrics',
     ]
 
     def __init__(self, bot):
         self.bot = bot
-        self.timers = {}
+        self.cooldowns = Cooldowns(max_age=self.__maxCooldown)
+        self.Db = BatchedDb.of(bot, delay=bot.config.get('db_save_delay', 5))
         self.whois = Whois(bot)
         self.loop = asyncio.new_event_loop()
         #asyncio.set_event_loop(self.loop)
         #self.oldHelp = self.help
-        global NICKSERVRESPONSESLOCK, CHATLVL_COMMANDLOCK
-        CHATLVL_COMMANDLOCK = threading.Lock()
-        NICKSERVRESPONSESLOCK = threading.Lock()
+        global CHATLVL_COMMANDLOCK
+        CHATLVL_COMMANDLOCK = metrics.instrument_lock(threading.Lock(), 'chatlvl_command')
 
     def debugPrint(self, text):
         if useDebugPrint:
@@ -131,7 +138,7 @@ class Plugin(object):
         if self.bot.config['nick'] in sender.nick:
             return
         if sender.startswith("NickServ!"):
-            self.__handleNickservMessage(msg)
+            # handled by botcore.identify
             return
         #if not msg.startswith('!'):
         #    self.__addText(msg)
@@ -183,29 +190,7 @@ class Plugin(object):
 
     @asyncio.coroutine
     def __isNickservIdentified(self, nick):
-        self.bot.privmsg('nickserv', "status {}".format(nick))
-        global NICKSERV_WAIT_TICKS
-        remainingTries = NICKSERV_WAIT_TICKS + 0
-        while remainingTries > 0:
-            if NICKSERVIDENTIFIEDRESPONSES.get(nick):
-                value = NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVRESPONSESLOCK.acquire()
-                del NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVRESPONSESLOCK.release()
-                if int(value) == 3:
-                    return True
-                return False
-            remainingTries -= 1
-            yield from asyncio.sleep(0.1)
-        return False
-
-    def __handleNickservMessage(self, message):
-        message = " ".join(message.split())
-        NICKSERVRESPONSESLOCK.acquire()
-        if message.startswith('STATUS'):
-            words = message.split(" ")
-            NICKSERVIDENTIFIEDRESPONSES[words[1]] = words[2]
-        NICKSERVRESPONSESLOCK.release()
+        return (yield from self.bot.get_plugin(NickServIdentification).is_identified(nick))
 
     """
     @command
@@ -232,8 +217,7 @@ class Plugin(object):
         return "Restarted"
 
     def on_restart(self):
-        time.clock()
-        t0 = time.clock()
+        t0 = time.perf_counter()
         global TIMERS, VARS, IGNOREDUSERS, DEFAULTC, CDPRIVILEDGEDUSERS, DEFAULTCD, DEFAULTVALUE, ADMINS, REACTION_WORDS
         global CHATLVLWORDS,  CHATLVLEVENTDATA, CHATLVL_TOPPLAYERS, CHATLVL_EPOCH
         ADMINS = [n.split('@')[0].replace('!', '').replace('*', '') for n, v in self.bot.config['irc3.plugins.command.masks'].items() if len(v) > 5]
@@ -262,12 +246,27 @@ class Plugin(object):
         CDPRIVILEDGEDUSERS = self.__dbGet(['cdprivilege'])
         CHATLVL_EPOCH = self.__dbGet(['chatlvlmisc', 'epoch'])
         REACTION_WORDS = self.__dbGet(['reactionwords', 'words'])
-        self.AeolusMarkov = Markov(self, self.bot.config.get('markovwordsstorage_chat', './dbmarkovChat.json'))
-        print('loaded aeolus markov, info:', self.AeolusMarkov.getInfo())
-        self.ChangelogMarkov = Markov(self, self.bot.config.get('markovwordsstorage_changelog', './dbmarkovChangelogs.json'))
-        print('loaded changelog markov, info:', self.ChangelogMarkov.getInfo())
-        self.GymMarkov = Markov(self, self.bot.config.get('markovwordsstorage_gym', './dbmarkovGym.json'))
-        print('loaded gym markov, info:', self.ChangelogMarkov.getInfo())
+        try:
+            self.Generators.stop()
+        except AttributeError:
+            pass
+        self.Generators = generationService(self.bot.loop,
+                                            useProcesses=self.bot.config.get('generation_processes', True) not in [False, 'false'],
+                                            timeout=float(self.bot.config.get('generation_timeout', 10)))
+        for name, key, default in [('aeolus', 'markovwordsstorage_chat', './dbmarkovChat.json'),
+                                   ('changelog', 'markovwordsstorage_changelog', './dbmarkovChangelogs.json'),
+                                   ('gym', 'markovwordsstorage_gym', './dbmarkovGym.json')]:
+            self.Generators.add(name, markovFactory, self.bot.config.get(key, default))
+            self.Generators.submit(name, 'getInfo').add_done_callback(
+                lambda f, name=name: print('loaded', name, 'markov, info:', f.exception() or f.result()))
+        try:
+            asyncio.ensure_future(self.FafApi.close(), loop=self.bot.loop)
+        except AttributeError:
+            pass
+        self.FafApi = fafApi(self.bot.config.get('faf_api_url', FAF_API_URL),
+                             timeout=self.bot.config.get('faf_api_timeout', 10),
+                             cacheTtl=self.bot.config.get('faf_api_cache_ttl', 3600))
+        self.useFafIds = self.bot.config.get('use_faf_ids', False) not in [False, 'false']
         self.Chatpoints = Points(self.bot.config.get('chatlevelstorage', './chatlevel.json'))
         self.Chatevents = Events(self.bot.config.get('chateventstorage', './chatevents.json'))
         self.Chatbets = Bets(self.bot, self.Chatpoints, self.Chatevents, self.bot.config.get('chatmiscstorage', './chatmisc.json'))
@@ -295,11 +294,11 @@ class Plugin(object):
         self.twitchthread = False
 
         if useLSTM:
-            from LSTMGen import LSTMGen
-            self.LSTMGen = LSTMGen(self.bot)
+            self.Generators.add('lstm', lstmFactory, {k: v for k, v in self.bot.config.items() if k.startswith('lstm_')})
         self.TEXT = ""
 
-        t1 = time.clock()
+        t1 = time.perf_counter()
+        metrics.observe('startup', '%s/on_restart' % self.bot.nick, t1 - t0)
         print("Startup time: {t}".format(**{"t" : format(t1-t0, '.4f')}))
 
     @command(permission='admin', show_in_help_list=False)
@@ -490,7 +489,7 @@ class Plugin(object):
 
     def createTwitchConIfNecessary(self):
         if not self.twitchthread:
-            self.twitchthread = twitchThread(self.bot, self, self.AeolusMarkov)
+            self.twitchthread = twitchThread(self.bot, self, self.Generators)
             self.twitchthread.start()
 
     @command(permission='admin', show_in_help_list=False, public=False)
@@ -515,14 +514,15 @@ class Plugin(object):
                 filetype = "LOG"
                 if raw:
                     filetype = "RAW"
-                if chatchangelog == "chat":
-                    self.AeolusMarkov.addFile(filename, filetype=filetype)
-                elif chatchangelog == "changelog":
-                    self.ChangelogMarkov.addFile(filename, filetype=filetype)
-                elif chatchangelog == "gym":
-                    self.GymMarkov.addFile(filename, filetype=filetype)
-                else:
+                generator = {"chat": 'aeolus', "changelog": 'changelog', "gym": 'gym'}.get(chatchangelog, False)
+                if not generator:
                     self.bot.privmsg(mask.nick, '<chat/changelog/gym> needs to be either "chat" or "changelog" or "gym".')
+                    return
+                done = yield from self.Generators.call(generator, 'addFile', filename, filetype=filetype,
+                                                       dedup=False, timeout=3600, default=False)
+                if done is False:
+                    self.bot.privmsg(mask.nick, 'Failed parsing.')
+                    return
                 self.bot.privmsg(mask.nick, 'Succeeded parsing. Use !savedb to save progress.')
             except Exception:
                 print(traceback.format_exc())
@@ -587,7 +587,7 @@ class Plugin(object):
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
         all = args.get('all')
-        t0 = time.clock()
+        t0 = time.perf_counter()
         args = {
             'saveAeolusMarkov' : all,
             'saveChangelogMarkov' : all,
@@ -596,7 +596,8 @@ class Plugin(object):
             'keep' : 5,
         }
         self.save(args)
-        t1 = time.clock()
+        t1 = time.perf_counter()
+        metrics.observe('commit', 'savedb', t1 - t0)
         self.bot.privmsg(mask.nick, "Saving completed. ({t} seconds)".format(**{"t" : format(t1-t0, '.4f')}))
 
     def save(self, args={}):
@@ -610,12 +611,9 @@ class Plugin(object):
         allRelevantBackups = [d[0] for d in os.walk(path)]
         for i in range(1, len(allRelevantBackups) - args.get('keep', 10)):
             shutil.rmtree(allRelevantBackups[i])
-        if args.get('saveAeolusMarkov', False):
-            self.AeolusMarkov.save()
-        if args.get('saveChangelogMarkov', False):
-            self.ChangelogMarkov.save()
-        if args.get('saveGymMarkov', False):
-            self.GymMarkov.save()
+        for name, key in [('aeolus', 'saveAeolusMarkov'), ('changelog', 'saveChangelogMarkov'), ('gym', 'saveGymMarkov')]:
+            if args.get(key, False):
+                self.Generators.callSync(name, 'save', timeout=600)
         return True
 
     def chatreset(self):
@@ -825,6 +823,19 @@ class Plugin(object):
                 if self.Questions.question(mask.nick, target, tags=tags):
                     self.spam_protect('question', mask, target, args, specialSpamProtect='question')
 
+    @command(permission='admin', public=False, show_in_help_list=False)
+    @asyncio.coroutine
+    def questionreload(self, mask, target, args):
+        """ Reloads the questions file
+
+            %%questionreload
+        """
+        if not (yield from self.__isNickservIdentified(mask.nick)):
+            return
+        if self.Questions.load():
+            return "Reloaded {} questions.".format(len(self.Questions.questions))
+        return "Failed reloading the questions."
+
     @command()
     @asyncio.coroutine
     def answer(self, mask, target, args):
@@ -931,7 +942,9 @@ class Plugin(object):
         """
         if self.spam_protect('changelog', mask, target, args, specialSpamProtect='changelog'):
             return
-        self.bot.privmsg(target, self.ChangelogMarkov.forwardSentence(False, 30, target, includeWord=True))
+        sentence = yield from self.Generators.call('changelog', 'forwardSentence', False, 30, self.__channelNicks(target), includeWord=True)
+        if sentence:
+            self.bot.privmsg(target, sentence)
 
     @command()
     @asyncio.coroutine
@@ -948,7 +961,9 @@ class Plugin(object):
                                      any=[('bot_admin', 0), ('is_in_top5', 0)])
         if not hp:
             return
-        self.bot.privmsg(target, self.GymMarkov.forwardSentence(False, 30, target, includeWord=True))
+        sentence = yield from self.Generators.call('gym', 'forwardSentence', False, 30, self.__channelNicks(target), includeWord=True)
+        if sentence:
+            self.bot.privmsg(target, sentence)
 
     @command(permission='admin', public=False, show_in_help_list=False)
     @asyncio.coroutine
@@ -961,11 +976,11 @@ class Plugin(object):
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
         if args.get("del"):
-            done = self.AeolusMarkov.delWord(args.get("<word>", ""))
+            done = yield from self.Generators.call('aeolus', 'delWord', args.get("<word>", ""), dedup=False)
             if done: return "Deleted"
             return "Failed to delete"
         if args.get("disable"):
-            self.AeolusMarkov.disableWord(args.get("<word>", ""))
+            yield from self.Generators.call('aeolus', 'disableWord', args.get("<word>", ""), dedup=False)
             return "Disabled the word."
 
     @command()
@@ -987,9 +1002,12 @@ class Plugin(object):
         #lf = random.randint(MINCHAINLENGTH/2, l - MINCHAINLENGTH/2)
         #lb = l - lf
         word = args.get('<word>', False)
-        forward = self.AeolusMarkov.forwardSentence(word, 20, target, includeWord=False)
-        backward = self.AeolusMarkov.backwardSentence(word, 20, target, includeWord=True)
-        self.bot.privmsg(target, backward + forward)
+        nicks = self.__channelNicks(target)
+        forward, backward = yield from asyncio.gather(
+            self.Generators.call('aeolus', 'forwardSentence', word, 20, nicks, includeWord=False, default=""),
+            self.Generators.call('aeolus', 'backwardSentence', word, 20, nicks, includeWord=True, default=""))
+        if backward + forward:
+            self.bot.privmsg(target, backward + forward)
 
     if useLSTM:
         @command(public=False)
@@ -1005,8 +1023,9 @@ class Plugin(object):
             text =  " ".join(args.get('TEXT'))
             if text:
                 self.__addText(text)
-            gen = self.LSTMGen.generate(self.TEXT, 0.4, 100)
-            self.bot.privmsg(target, gen)
+            gen = yield from self.Generators.call('lstm', 'generate', self.TEXT, 0.4, 100)
+            if gen:
+                self.bot.privmsg(target, gen)
 
     @command()
     @asyncio.coroutine
@@ -1024,7 +1043,9 @@ class Plugin(object):
         if self.spam_protect('chain', mask, target, args, specialSpamProtect='chain'):
             return
         word = args.get('<word>', False)
-        self.bot.privmsg(target, self.AeolusMarkov.forwardSentence(word, 30, target, includeWord=True))
+        sentence = yield from self.Generators.call('aeolus', 'forwardSentence', word, 30, self.__channelNicks(target), includeWord=True)
+        if sentence:
+            self.bot.privmsg(target, sentence)
 
     @command()
     @asyncio.coroutine
@@ -1042,7 +1063,9 @@ class Plugin(object):
         if self.spam_protect('chain', mask, target, args, specialSpamProtect='chain'):
             return
         word = args.get('<word>', False)
-        self.bot.privmsg(target, self.AeolusMarkov.backwardSentence(word, 30, target, includeWord=True))
+        sentence = yield from self.Generators.call('aeolus', 'backwardSentence', word, 30, self.__channelNicks(target), includeWord=True)
+        if sentence:
+            self.bot.privmsg(target, sentence)
 
     @command()
     @asyncio.coroutine
@@ -1054,7 +1077,9 @@ class Plugin(object):
         if self.spam_protect('chainprob', mask, target, args, specialSpamProtect='chainprob'):
             return
         w1, w2 = args.get('<word1>'), args.get('<word2>')
-        self.bot.privmsg(target, self.AeolusMarkov.chainprob(w1, w2))
+        probs = yield from self.Generators.call('aeolus', 'chainprob', w1, w2)
+        if probs:
+            self.bot.privmsg(target, probs)
 
     def update_chatlevels(self, mask, channel, msg):
         if msg.startswith('!'):
@@ -1219,26 +1244,27 @@ class Plugin(object):
 
     @asyncio.coroutine
     def __maskToFafId(self, mask):
-        return mask.nick, True #TODO
-        try:
-            return str(mask.host.split('@')[0]), True
-        except:
-            return "-1", False
+        """
+        Points etc are still stored by nick, the faf id is only used if use_faf_ids is set
+        """
+        if not self.useFafIds:
+            return mask.nick, True
+        # the irc username is the faf id
+        user = str(mask).split('@')[0].split('!')[-1]
+        if user.isdigit():
+            return user, True
+        return (yield from self.__nameToFafId(mask.nick))
 
     @asyncio.coroutine
     def __nameToFafId(self, name):
-        return name, True #TODO
-        global MAIN_CHANNEL, CHATLVLS
-        if name.startswith('#'):
+        if not self.useFafIds or name.startswith('#'):
             return name, True
-        if not self.isInChannel(name, MAIN_CHANNEL):
-            for v in CHATLVLS.keys():
-                if CHATLVLS[v].get('n', False) == name:
-                    #print('not in main, but v:', v)
-                    return v, True
+        try:
+            id = yield from self.FafApi.getPlayerId(name)
+        except Exception:
+            print(traceback.format_exc())
             return "-1", False
-        whois = yield from self.whois(nick=name)
-        return whois.get('username', False), whois.get('timeout', True) == False
+        return (id, True) if id is not None else ("-1", False)
 
     @command()
     @asyncio.coroutine
@@ -1726,6 +1752,7 @@ class Plugin(object):
             %%cp raise <points>
             %%cp start
             %%cp reveal
+            %%cp odds
             %%cp TEXT ...
         """
         return (yield from self.cpoker(mask, target, args))
@@ -1740,9 +1767,26 @@ class Plugin(object):
             %%cpoker raise <points>
             %%cpoker start
             %%cpoker reveal
+            %%cpoker odds
             %%cpoker TEXT ...
         """
         global CHATLVL_COMMANDLOCK, MAIN_CHANNEL, POKER_CHANNEL
+        if args.get('odds'):
+            game = self.Chatpoker.get(target, False)
+            if not game:
+                self.bot.privmsg(mask.nick, "There is no poker game running in {}!".format(target))
+                return
+            # per player, in every channel
+            if self.spam_protect('cpoker-odds-' + mask.nick, mask, target, args, specialSpamProtect='poker_odds_cooldown', ircSpamProtect=False):
+                return
+            snapshot = game.oddsSnapshot(mask.nick)
+            if snapshot is None:
+                return
+            # the monte carlo estimate takes up to poker_odds_time seconds, off the loop
+            result = yield from self.bot.loop.run_in_executor(None, functools.partial(game.estimateOdds, snapshot,
+                                                              timeBudget=float(self.bot.config.get('poker_odds_time', 0.25))))
+            game.tellOdds(mask.nick, snapshot, result)
+            return
         """
         if (target == MAIN_CHANNEL):
             self.bot.privmsg(mask.nick, "Poker is heavily limited in {main} atm, due to the spam! ''!join {channel}'' to play with others!".format(**{
@@ -1917,7 +1961,7 @@ class Plugin(object):
         totalpoints = sum(result.values())
         maibet = 0.5 + int(totalpoints/50)
         result[self.bot.config['nick']] = maibet
-        winner, _ = self.pickWeightedRandom(result)
+        winner, _ = pickWeightedRandom(result)
         print('- roulette done!', winner, args.get('channel'), totalpoints)
         print('- result: ', result)
         # winner print
@@ -2032,46 +2076,34 @@ class Plugin(object):
 
             %%helpirenamed
         """
-        global RENAME_API_URL, RENAME_API_URL_NAME
-        past_names = []
         try:
             user_id = int(str(mask).split('@')[0].split('!')[1])
-            with urllib.request.urlopen(RENAME_API_URL.format(**{
-                'id': user_id
-            })) as response:
-                ans = json.loads(response.read().decode())
-                for name in ans['included']:
-                    if name['type'] == 'nameRecord':
-                        past_names.append(name['attributes']['name'])
-        except:
-            pass
+            past_names = yield from self.FafApi.getNameHistory(user_id)
+        except Exception:
+            past_names = []
         if len(past_names) < 1:
             self.bot.privmsg(mask.nick, 'You have not changed your name, or FAF does not know about you.')
             return
         previous_name = past_names[-1]
         try:
-            # check if the name is taken by someone
-            with urllib.request.urlopen(RENAME_API_URL_NAME.format(**{
-                'name': previous_name
-            })) as response:
-                ans = json.loads(response.read().decode())
-                if ans is None or (not ans.get('data', False)):
-                    self.bot.privmsg(mask.nick, 'Confirmed! Merging with data of ' + previous_name + '!')
-                    self.Chatpoints.merge(mask.nick, previous_name)
-                else:
-                    self.bot.privmsg(mask.nick, 'Your previous name "{}" is currently taken!'.format(previous_name))
-        except:
+            # check if the name is taken by someone, always ask the api about the current state
+            self.FafApi.forget(name=previous_name)
+            taken_by = yield from self.FafApi.getPlayerId(previous_name)
+        except Exception:
             self.bot.privmsg(mask.nick, 'Something went wrong :(')
             return
+        if taken_by is None:
+            self.bot.privmsg(mask.nick, 'Confirmed! Merging with data of ' + previous_name + '!')
+            self.Chatpoints.merge(mask.nick, previous_name)
+        else:
+            self.bot.privmsg(mask.nick, 'Your previous name "{}" is currently taken!'.format(previous_name))
 
     def getUnpingableName(self, name):
         return name[0:len(name)-1] + '.' + name[len(name)-1]
 
     def spam_protect(self, cmd, mask, target, args, updateTimer=True, specialSpamProtect=None, ircSpamProtect=True, setToNow=False):
         if setToNow:
-            if not cmd in self.timers:
-                self.timers[cmd] = {}
-            self.timers[cmd][target] = time.time()
+            self.cooldowns.set((cmd, target))
             return
         nick = mask
         if type(mask) is not str:
@@ -2083,23 +2115,21 @@ class Plugin(object):
         if ircSpamProtect:
             if not target == MAIN_CHANNEL:
                 return False
-        if not cmd in self.timers:
-            self.timers[cmd] = {}
-        if not target in self.timers[cmd]:
-            self.timers[cmd][target] = 0
         global TIMERS, DEFAULTCD, CDPRIVILEDGEDUSERS
         timer = TIMERS.get(specialSpamProtect,
                            self.bot.config.get(specialSpamProtect,
                                                DEFAULTCD))
-        remTime = timer - (time.time() - self.timers[cmd][target]) - CDPRIVILEDGEDUSERS.get(nick, 0)
+        remTime = self.cooldowns.check((cmd, target), timer - CDPRIVILEDGEDUSERS.get(nick, 0), update=updateTimer)
         if remTime > 0:
             if ircSpamProtect:
                 self.bot.privmsg(nick, "Wait another " + str(int(remTime)+1) + " seconds before trying again.")
             return True
-        if updateTimer:
-            self.timers[cmd][target] = time.time()
         return False
 
+    def __maxCooldown(self):
+        # cooldowns older than this are over, see Cooldowns
+        return max([v for v in TIMERS.values() if isinstance(v, (int, float))] + [DEFAULTCD or 0, 3600])
+
     def is_main_channel(self, mask, target, irc_pm_if_channel=True):
         global MAIN_CHANNEL
         if target == MAIN_CHANNEL:
@@ -2159,16 +2189,6 @@ class Plugin(object):
                                              ('is_in_top5', 0)],
                                         any=[('bot_admin', 0)])
 
-
-    def pickWeightedRandom(self, dct):
-        total = sum(dct.values())
-        v = random.random() * total
-        for key in dct.keys():
-            v -= dct[key]
-            if v <= 0:
-                return key, total
-        return dct.keys()[len(dct)-1], total
-
     @command(permission='admin', public=False, show_in_help_list=False)
     @asyncio.coroutine
     def chatlvlchannels(self, mask, target, args):
@@ -2213,59 +2233,22 @@ class Plugin(object):
         """
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
-        add, delete, get, id, text = args.get('add'), args.get('del'), args.get('get'), args.get('<ID>'), " ".join(
-            args.get('TEXT'))
-        dict = self.__dbGet(path)
-        if add:
-            if not allowSameValue:
-                entries = self.__dbGet(path)
-                for e in entries.values():
-                    if e == text:
-                        return "This already exists, so it won't be added."
-            try:
-                id = self.__getNextDictIncremental(dict)
-                self.__dbAdd(path, id, text, save=True)
-                return 'Added to the list.'
-            except:
-                return "Failed adding."
-        elif delete:
-            try:
-                if dict.get(id):
-                    dict = self.__dbDel(path, id, save=True)
-                    return 'Removed element of ID "{id}".'.format(**{
-                        "id": id,
-                    })
-                else:
-                    return 'ID not found in the list.'
-            except:
-                return "Failed deleting."
-        elif get:
-            self.bot.privmsg(mask.nick, str(len(dict)) + " elements:")
-            for id in dict.keys():
-                self.bot.privmsg(mask.nick, '<%s>: %s' % (id, dict[id]))
+        reply, lines = manage_list(self.Db, path, args, allow_same_value=allowSameValue)
+        for line in lines:
+            self.bot.privmsg(mask.nick, line)
+        return reply
+
+    def __channelNicks(self, channelname):
+        # what the generators need to know of a channel, so they do not ping anyone
+        if not channelname in self.bot.channels:
+            return frozenset()
+        return frozenset(self.bot.channels[channelname])
 
     def isInChannel(self, player, channel):
-        if isinstance(channel, str):
-            channel = self.bot.channels[channel]
-        if player in channel:
-            return True
-        return False
+        return is_in_channel(self.bot, player, channel)
 
     def __filterForPlayersInChannel(self, playerlist, channelname):
-        players = {}
-        if not channelname in self.bot.channels:
-            return players
-        channel = self.bot.channels[channelname]
-        for p in playerlist.keys():
-            if self.isInChannel(p, channel):
-                players[p] = True
-        return players
-
-    def __getNextDictIncremental(self, dict):
-        for i in range(0, 99999999):
-            if not dict.get(str(i), False):
-                return str(i)
-        return "-1"
+        return filter_in_channel(self.bot, playerlist.keys(), channelname)
 
     @command(permission='admin', public=False)
     @asyncio.coroutine
@@ -2283,41 +2266,13 @@ class Plugin(object):
         self.bot.privmsg(mask.nick, ", ".join(words))
 
     def __dbAdd(self, path, key, value, overwriteIfExists=True, trySavingWithNewKey=False, save=True):
-        cur = self.bot.db
-        for p in path:
-            if p not in cur:
-                cur[p] = {}
-            cur = cur[p]
-        exists, addedWithNewKey = cur.get(key), False
-        if overwriteIfExists:
-            cur[key] = value
-        elif not exists:
-            cur[key] = value
-        elif exists and trySavingWithNewKey:
-            for i in range(0, 1000):
-                if not cur.get(key+str(i)):
-                    cur[key+str(i)] = value
-                    addedWithNewKey = True
-                    break
-        if save:
-            self.__dbSave()
-        return cur, exists, addedWithNewKey
+        return self.Db.add(path, key, value, overwrite=overwriteIfExists, try_new_key=trySavingWithNewKey, save=save)
 
     def __dbDel(self, path, key, save=True):
-        cur = self.bot.db
-        for p in path:
-            cur = cur.get(p, {})
-        if not cur.get(key) is None:
-            del cur[key]
-            if save:
-                self.__dbSave()
-        return cur
+        return self.Db.delete(path, key, save=save)
 
     def __dbGet(self, path):
-        reply = self.bot.db
-        for p in path:
-            reply = reply.get(p, {})
-        return reply
+        return self.Db.get(path)
 
     def __dbSave(self):
-        self.bot.db.set('misc', lastSaved=time.time())
\ No newline at end of file
+        self.Db.flush(everything=True)
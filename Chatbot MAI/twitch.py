@@ -5,13 +5,13 @@ import re
 import random
 
 class twitchThread(threading.Thread):
-    def __init__(self, bot, plugin, markov):
+    def __init__(self, bot, plugin, generators):
         threading.Thread.__init__(self)
         self.daemon = True
         self.bot = bot
         self.plugin = plugin
         self.channels = {}
-        self.markov = markov
+        self.generators = generators
         self.sock = socket.socket()
         self.sock.connect((self.bot.config['twitchhost'], self.bot.config['twitchport']))
         self.sock.send("PASS {}\r\n".format(self.bot.config['twitchoauth']).encode("utf-8"))
@@ -75,8 +75,8 @@ class twitchThread(threading.Thread):
         if self.plugin.spam_protect('twitchchain', nick, channel, {}, specialSpamProtect='twitchchain', ircSpamProtect=False):
             return
         word = args[1]
-        forward = self.markov.forwardSentence(word, 20, channel, includeWord=False)
-        backward = self.markov.backwardSentence(word, 20, channel, includeWord=True)
+        forward = self.generators.callSync('aeolus', 'forwardSentence', word, 20, frozenset(), includeWord=False)
+        backward = self.generators.callSync('aeolus', 'backwardSentence', word, 20, frozenset(), includeWord=True)
         s = backward + forward
         self.message(channel, s)
 
@@ -86,7 +86,7 @@ class twitchThread(threading.Thread):
         if self.plugin.spam_protect('twitchchain', nick, channel, {}, specialSpamProtect='twitchchain', ircSpamProtect=False):
             return
         word = args[1]
-        s = self.markov.forwardSentence(word, 10, channel, includeWord=True)
+        s = self.generators.callSync('aeolus', 'forwardSentence', word, 10, frozenset(), includeWord=True)
         self.message(channel, s)
 
     def commandChainb(self, nick, channel, args):
@@ -95,5 +95,5 @@ class twitchThread(threading.Thread):
         if self.plugin.spam_protect('twitchchain', nick, channel, {}, specialSpamProtect='twitchchain', ircSpamProtect=False):
             return
         word = args[1]
-        s = self.markov.backwardSentence(word, 10, channel, includeWord=True)
+        s = self.generators.callSync('aeolus', 'backwardSentence', word, 10, frozenset(), includeWord=True)
         self.message(channel, s)
\ No newline at end of file
@@ -1,14 +1,11 @@
 from functools import wraps
 import asyncio
-import configparser
 
-config = configparser.ConfigParser()
-# Disable conversion of config data_chat to lowercase
-config.optionxform = str
-config.read('config.ini')
 
-ADMINS = [n.split('@')[0].replace('!', '').replace('*', '')
-          for n, v in config['irc3.plugins.command.masks'].items() if len(v) > 5]
+def admin_nicks(config) -> list:
+    """ nicks with all permissions in the config the bot was loaded with """
+    return [n.split('@')[0].replace('!', '').replace('*', '')
+            for n, v in config.get('irc3.plugins.command.masks', {}).items() if len(v) > 5]
 
 
 def nickserv_identified(func):
@@ -50,9 +47,10 @@ def channel_only(*args, admin_chan_only=False):
             nonlocal channels
             try:
                 self, nick, target = args[0], args[1].nick, args[2]
-                if (nick not in ADMINS) and channels and (target not in channels):
+                admins = admin_nicks(self.bot.config)
+                if (nick not in admins) and channels and (target not in channels):
                     return 'You can only use this command in {0}.'.format(channels)
-                if (nick not in ADMINS or admin_chan_only) and not self._is_a_channel(target):
+                if (nick not in admins or admin_chan_only) and not self._is_a_channel(target):
                     return 'You can only use this command in channels.'
             except Exception:
                 pass
@@ -63,9 +61,10 @@ def channel_only(*args, admin_chan_only=False):
             nonlocal channels
             try:
                 self, nick, target = args[0], args[1].nick, args[2]
-                if (nick not in ADMINS) and channels and (target not in channels):
+                admins = admin_nicks(self.bot.config)
+                if (nick not in admins) and channels and (target not in channels):
                     return 'You can only use this command in {0}.'.format(channels)
-                if (nick not in ADMINS or admin_chan_only) and not self._is_a_channel(target):
+                if (nick not in admins or admin_chan_only) and not self._is_a_channel(target):
                     return 'You can only use this command in channels.'
             except Exception:
                 pass
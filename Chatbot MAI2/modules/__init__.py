@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the shared bot code in botcore/ lives in the repository root
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _root not in sys.path:
+    sys.path.append(_root)
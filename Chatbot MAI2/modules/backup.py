@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import ZODB.FileStorage
+from ZODB.utils import tid_repr
+from modules.maintenance import storage_file_lock
+from modules.utils import get_logger
+
+logger = get_logger('backup')
+
+CHUNK_SIZE = 1 << 20
+
+
+def file_md5(path: str, start=0, end=None) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = file.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            md5.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return md5.hexdigest()
+
+
+def scan_transactions(path: str, pos=4, stop: bytes = None) -> (int, int, str):
+    """
+    reads the complete transactions from pos on, up to and including the stop tid
+    :return: their count, the position after the last one and the last tid
+    """
+    iterator = ZODB.FileStorage.FileIterator(path, pos=pos)
+    count, end, last_tid = 0, pos, None
+    try:
+        for record in iterator:
+            if stop is not None and record.tid > stop:
+                break
+            count += 1
+            end = iterator._pos
+            last_tid = tid_repr(record.tid)
+        return count, end, last_tid
+    finally:
+        iterator.close()
+
+
+class IncrementalBackup:
+    """
+    repozo style backups of a FileStorage: the file only grows (unless packed), so after a full copy,
+    every backup only copies the transactions that were appended since the last one (a delta file).
+    A full copy + its deltas form a chain; a new chain begins when the storage was packed (the already
+    backed up bytes changed) or after full_every deltas.
+    All files and their md5 are listed in index.json in the backup dir, restoring concatenates a chain.
+    """
+
+    def __init__(self, storage_path: str, backup_dir: str, keep_count=5, keep_days=30, full_every=50):
+        """
+        :param keep_count: chains to keep
+        :param keep_days: chains with no backup in that time are deleted, the newest chain is always kept
+        """
+        self.storage_path = storage_path
+        self.backup_dir = backup_dir
+        self.index_path = os.path.join(backup_dir, 'index.json')
+        self.keep_count = max(int(keep_count), 1)
+        self.keep_days = max(float(keep_days), 0)
+        self.full_every = max(int(full_every), 1)
+        self.lock = threading.Lock()
+        self.thread = None
+        os.makedirs(backup_dir, exist_ok=True)
+
+    def load_index(self) -> list:
+        if not os.path.isfile(self.index_path):
+            return []
+        with open(self.index_path, 'r') as file:
+            return json.load(file)
+
+    def __save_index(self, index: list):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def chains(index: list) -> [list]:
+        chains = []
+        for entry in index:
+            if entry['full'] or not chains:
+                chains.append([])
+            chains[-1].append(entry)
+        return chains
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, name='backup', full=False, stop: bytes = None, on_done=None) -> bool:
+        """
+        back up in a background thread, returns False if a backup is already running
+        :param stop: back up to this tid, e.g. db.lastTransaction() before changing things
+        :param on_done: called in the backup thread with the new index entry, or the exception
+        """
+        if self.is_running():
+            return False
+
+        def run():
+            try:
+                result = self.backup(name, full=full, stop=stop)
+            except Exception as e:
+                logger.warning('Backup failed: %s' % repr(e))
+                result = e
+            if on_done is not None:
+                on_done(result)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        return True
+
+    def backup(self, name='backup', full=False, stop: bytes = None) -> dict:
+        with self.lock, storage_file_lock:
+            t0 = time.time()
+            index = self.load_index()
+            chains = self.chains(index)
+            last = index[-1] if index else None
+            if last is not None and not full:
+                full = len(chains[-1]) > self.full_every or os.path.getsize(self.storage_path) < last['end'] or \
+                       file_md5(self.storage_path, last['start'], last['end']) != last['md5']
+            start = 4 if (full or last is None) else last['end']
+            count, end, last_tid = scan_transactions(self.storage_path, pos=start, stop=stop)
+            if not full and last is not None and count == 0:
+                logger.info('Backup "%s": nothing new to back up' % name)
+                return last
+            full = full or last is None
+            file_name = '%d_%d_%s.%s' % (int(t0), len(index), name, 'fs' if full else 'deltafs')
+            path = os.path.join(self.backup_dir, file_name)
+            self.__copy(path, start=0 if full else start, end=end)
+            entry = {
+                'file': file_name,
+                'name': name,
+                'full': full,
+                'start': 0 if full else start,
+                'end': end,
+                'md5': file_md5(path),
+                'transactions': count + (0 if full else last['transactions']),
+                'tid': last_tid if last_tid is not None else last['tid'],
+                'time': t0,
+            }
+            index.append(entry)
+            index = self.__apply_retention(index)
+            self.__save_index(index)
+            logger.info('Backup "%s": %s %s, %d bytes, %d transactions in %.2fs'
+                        % (name, 'full' if full else 'incremental', file_name, end - entry['start'], count,
+                           time.time() - t0))
+            return entry
+
+    def __copy(self, path: str, start: int, end: int):
+        with open(self.storage_path, 'rb') as src, open(path, 'wb') as dst:
+            src.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = src.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise IOError('Storage file ended at %d, expected %d bytes' % (src.tell(), end))
+                dst.write(data)
+                remaining -= len(data)
+
+    def __apply_retention(self, index: list) -> list:
+        chains = self.chains(index)
+        min_time = time.time() - self.keep_days * 86400
+        keep = [c for c in chains[-self.keep_count:] if c[-1]['time'] >= min_time or c is chains[-1]]
+        for chain in chains:
+            if any(chain is k for k in keep):
+                continue
+            for entry in chain:
+                try:
+                    os.remove(os.path.join(self.backup_dir, entry['file']))
+                except OSError as e:
+                    logger.warning('Failed removing old backup %s: %s' % (entry['file'], str(e)))
+            logger.info('Removed backup chain of %d files from %s' % (len(chain), time.ctime(chain[0]['time'])))
+        return [entry for chain in keep for entry in chain]
+
+    def __chain_until(self, t: float = None) -> list:
+        """ the files needed to restore the last backup made at or before t """
+        entries = []
+        for chain in self.chains(self.load_index()):
+            for i, entry in enumerate(chain):
+                if t is None or entry['time'] <= t:
+                    entries = chain[:i + 1]
+        if not entries:
+            raise ValueError('No backup found')
+        return entries
+
+    def verify(self, t: float = None) -> str:
+        """ checks the md5 of all files of a backup, then reads all its transactions, raises ValueError """
+        entries = self.__chain_until(t)
+        for entry in entries:
+            path = os.path.join(self.backup_dir, entry['file'])
+            if not os.path.isfile(path):
+                raise ValueError('Missing backup file %s' % entry['file'])
+            if file_md5(path) != entry['md5']:
+                raise ValueError('Backup file %s is corrupted (md5 mismatch)' % entry['file'])
+        tmp_path = os.path.join(self.backup_dir, 'verify.fs.tmp')
+        try:
+            self.__concat(entries, tmp_path)
+            count, end, last_tid = scan_transactions(tmp_path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        last = entries[-1]
+        if (count, end, last_tid) != (last['transactions'], last['end'], last['tid']):
+            raise ValueError('Backup %s does not contain the expected transactions' % last['file'])
+        return 'Backup %s is fine, %d files, %d transactions, last tid %s' % \
+               (last['file'], len(entries), count, last_tid)
+
+    def __concat(self, entries: list, path: str):
+        with open(path, 'wb') as dst:
+            for entry in entries:
+                with open(os.path.join(self.backup_dir, entry['file']), 'rb') as src:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    def restore(self, target_path: str, t: float = None) -> str:
+        """ restores the last backup made at or before t to target_path, which must not be the live storage """
+        if os.path.abspath(target_path) == os.path.abspath(self.storage_path):
+            raise ValueError('Restore to a different path than the running storage')
+        self.verify(t)
+        entries = self.__chain_until(t)
+        os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+        self.__concat(entries, target_path)
+        logger.info('Restored backup %s to %s' % (entries[-1]['file'], target_path))
+        return target_path
+
+    def list_str(self, n=10) -> [str]:
+        index = self.load_index()
+        return ['%s: %s %s, %d transactions' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['time'])),
+                                                 'full' if e['full'] else 'delta', e['file'], e['transactions'])
+                for e in index[-n:]]
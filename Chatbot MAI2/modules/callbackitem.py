@@ -1,7 +1,7 @@
-import transaction
 import time
 import persistent
 import functools
+from modules.commits import commit
 from modules.utils import get_logger
 
 logger = get_logger('callbackitem')
@@ -27,14 +27,14 @@ class CallbackItem(persistent.Persistent):
             return None
         r = self.fun(*self.args, **self.kwargs)
         self.done = True
-        transaction.commit()
+        commit()
         self.save()
         logger.debug('using CallbackItem, %s, %s' % (self.args, self.kwargs))
         return r
 
     def save(self):
         self._p_changed = True
-        transaction.commit()
+        commit()
 
     def rem_time(self) -> float:
         return self.time - time.time()
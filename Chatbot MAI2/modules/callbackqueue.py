@@ -1,25 +1,40 @@
 import transaction
 import time
+import random
 import persistent
-import persistent.list
-import heapq
+import queue
 import threading
+import BTrees.OOBTree
 from modules.callbackitem import CallbackItem
-from modules.utils import get_logger, get_lock
+from modules.commits import atomic, commit
+from modules.utils import get_logger, get_lock, time_to_str
 
 logger = get_logger('callbackqueue')
-lock = get_lock('callbackqueue')  # necessary external lock...
+lock = get_lock('callbackqueue')
+
+# worker threads that want to know when an item was added, see CallbackQueueWorkerThread.notify
+listeners = []
+
+
+def _notify_listeners(success: bool, due: float):
+    if not success:
+        return
+    for listener in listeners:
+        listener.notify(due)
 
 
 class CallbackQueue(persistent.Persistent):
     """
     The queue containing the CallbackItems.
     Has to be wrapped by a CallbackQueueWorkerThread that works it, due to pickle limitations.
+    The worker loads the queue (and everything the callbacks touch) through its own connection.
+    Items are kept in a BTree keyed by (due time, random tie breaker), so adding or popping an item
+    only writes the changed bucket, not the whole queue.
     """
 
     def __init__(self):
         super(CallbackQueue, self).__init__()
-        self.items = []
+        self.items = BTrees.OOBTree.OOBTree()
         logger.info('Created new CallbackQueue')
 
     def reset(self):
@@ -32,67 +47,223 @@ class CallbackQueue(persistent.Persistent):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            if isinstance(self.items, list):
+                items = self.items
+                self.items = BTrees.OOBTree.OOBTree()
+                for item in items:
+                    self.items[self.__key(item)] = item
+                self.save()
+                logger.info('Migrated %d CallbackQueue items to a BTree' % len(items))
 
     def print(self):
         with lock:
             logger.info('Callbackqueue has %i queued items' % len(self.items))
 
+    @staticmethod
+    def __key(item: CallbackItem) -> tuple:
+        return item.time, random.getrandbits(48)
+
     def add(self, item: CallbackItem):
         with lock:
-            heapq.heappush(self.items, item)
-            self.save()
-            logger.debug('Callbackqueue, added to queue, %d, %s'
-                         % (len(self.items), ['%3.0f' % (i.time-time.time()) for i in self.items]))
+            self.items[self.__key(item)] = item
+            # wake up the worker once this is committed, if it is due before whatever it waits for
+            transaction.get().addAfterCommitHook(_notify_listeners, (item.time,))
+            commit()
+            logger.debug('Callbackqueue, added to queue, due in %.1fs' % item.rem_time())
 
-    def pop(self):
+    def pop(self, key=None):
+        """ removes the item with key (the next one by default), None if there is none """
         with lock:
-            if len(self.items) == 0:
+            if key is None:
+                if len(self.items) == 0:
+                    return None
+                key = self.items.minKey()
+            item = self.items.pop(key, None)
+            if item is None:
                 return None
-            item = heapq.heappop(self.items)
-            self.save()
-            transaction.commit()
-            logger.debug('Callbackqueue, removed an item from queue, %d remaining' % len(self.items))
+            commit()
+            logger.debug('Callbackqueue, removed an item from queue')
             return item
 
+    def next_due(self):
+        """ due time of the next item, None if there is none """
+        with lock:
+            if len(self.items) == 0:
+                return None
+            return self.items.minKey()[0]
+
     def should_pop(self):
+        return self.due_key() is not None
+
+    def due_key(self):
+        """ key of the next item if it is due, None otherwise """
         with lock:
             if len(self.items) == 0:
-                return False
-            return self.items[0].ended()
+                return None
+            key = self.items.minKey()
+            return key if key[0] <= time.time() else None
 
     def save(self):
         with lock:
-            transaction.begin()
             self._p_changed = True
-            transaction.commit()
+            commit()
 
 
 class CallbackQueueWorkerThread(threading.Thread):
-    def __init__(self, queue: CallbackQueue):
+    """
+    Works the queue with its own db connection (and thus transactions), so the callbacks run in parallel
+    to everything using the main connection. Popping an item and running its callback is one transaction,
+    which is retried on conflicts. An item whose callback fails is dropped in a transaction of its own,
+    so it is not run again and again.
+    Nothing polls: a timer on the loop is armed for the next due item and wakes the worker up, added items
+    re-arm it after they are committed. Items that became due while the bot was offline run right at start.
+    Its connection is only used by this thread, minimize() asks it to minimize the connection's cache between runs.
+    """
+
+    def __init__(self, db, loop, root_name='queue'):
         super(CallbackQueueWorkerThread, self).__init__()
         self.keep_running = True
         self.daemon = True
-        self.queue = queue
+        self.db = db
+        self.loop = loop
+        self.root_name = root_name
+        self.queue = None
+        self.wakeups = queue.Queue()
+        self.minimize_requested = False
+        self.handle = None
+        self.armed_at = None
+        # metrics
+        self.pending = 0
+        self.next_due = None
+        self.fired = 0
+        self.failed = 0
+        self.lag_last = 0.
+        self.lag_max = 0.
+        self.lag_sum = 0.
         logger.info('Created new CallbackQueueWorkerThread')
 
+    def start(self):
+        listeners.append(self)
+        super(CallbackQueueWorkerThread, self).start()
+
     def stop(self):
         self.keep_running = False
+        if self in listeners:
+            listeners.remove(self)
+        self.loop.call_soon_threadsafe(self.__disarm)
+        self.wakeups.put(False)
 
-    def run(self):
+    def minimize(self):
+        """ thread safe, the worker minimizes its object cache before it runs the next due items """
+        self.minimize_requested = True
+        self.wakeups.put(True)
+
+    def notify(self, due: float):
+        """ thread safe, makes sure the worker wakes up at due """
+        if self.keep_running and due is not None:
+            self.loop.call_soon_threadsafe(self.__arm, due)
+
+    def __arm(self, due: float):
+        if self.armed_at is not None and self.armed_at <= due:
+            return
+        self.__disarm()
+        self.armed_at = due
+        self.handle = self.loop.call_later(max(due - time.time(), 0), self.__on_due)
+
+    def __disarm(self):
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle, self.armed_at = None, None
+
+    def __on_due(self):
+        self.handle, self.armed_at = None, None
+        self.wakeups.put(True)
+
+    @atomic
+    def __run_next(self, key):
+        item = self.queue.pop(key)
+        if item is None:
+            return
+        lag = time.time() - item.time
+        item.callback()
+        return lag
+
+    @atomic
+    def __drop(self, key):
+        return self.queue.pop(key)
+
+    def __run_due(self):
+        # start a new transaction, to see what other connections committed
+        transaction.begin()
         while self.keep_running:
-            while self.queue.should_pop():
-                item = self.queue.pop()
-                item.callback()
-            time.sleep(0.5)
+            key = self.queue.due_key()
+            if key is None:
+                break
+            try:
+                lag = self.__run_next(key)
+            except Exception as e:
+                self.failed += 1
+                logger.warning('Callback failed, dropping it: %s' % str(e))
+                try:
+                    self.__drop(key)
+                except Exception as e:
+                    # try again on the next wakeup instead of right away
+                    logger.warning('Failed dropping a failed callback: %s' % str(e))
+                    break
+                continue
+            if lag is not None:
+                self.fired += 1
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self.lag_sum += lag
+        self.pending = len(self.queue.items)
+        self.next_due = self.queue.next_due()
+        self.notify(self.next_due)
+
+    def run(self):
+        connection = self.db.open()
+        try:
+            self.queue = getattr(connection.root, self.root_name)
+            self.__run_due()
+            while self.wakeups.get() and self.keep_running:
+                if self.minimize_requested:
+                    self.minimize_requested = False
+                    connection.cacheMinimize()
+                self.__run_due()
+        finally:
+            transaction.abort()
+            connection.close()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending,
+            'next_due': None if self.next_due is None else self.next_due - time.time(),
+            'fired': self.fired,
+            'failed': self.failed,
+            'lag_last': self.lag_last,
+            'lag_max': self.lag_max,
+            'lag_avg': self.lag_sum / max(self.fired, 1),
+        }
+
+    def stats_str(self) -> str:
+        s = self.stats()
+        next_due = 'none' if s['next_due'] is None else 'in %s' % time_to_str(max(int(s['next_due']), 0))
+        return 'Queue: %d pending, next %s, %d fired, %d failed, lag %.3fs (avg %.3fs, max %.3fs)' % \
+               (s['pending'], next_due, s['fired'], s['failed'], s['lag_last'], s['lag_avg'], s['lag_max'])
 
 
 if __name__ == '__main__':
-    q = CallbackQueue()
-    w = CallbackQueueWorkerThread(q)
-    import random
+    import asyncio
+    import ZODB
+    db = ZODB.DB(None)
+    root = db.open().root
+    root.queue = q = CallbackQueue()
+    q.save()
+    loop = asyncio.new_event_loop()
+    w = CallbackQueueWorkerThread(db, loop)
+    w.start()
     for j in range(10):
         r = random.randint(0, 2+j)
         q.add(CallbackItem(r, int, r))
-    w.start()
-    w.join()
+    loop.run_until_complete(asyncio.sleep(15))
+    logger.info(w.stats_str())
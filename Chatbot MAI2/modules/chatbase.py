@@ -1,8 +1,7 @@
 import BTrees.OOBTree
 import persistent.dict
-import transaction
 import time
-from heapq import nlargest, nsmallest
+from modules.commits import atomic, chat_commits, commit
 from modules.utils import get_logger, not_pinging_name, get_lock, time_to_str
 from modules.utils import get_msg_fun as gmf
 from modules.chatentity import ChatEntity
@@ -12,6 +11,7 @@ from modules.eventbase import Eventbase
 from modules.timer import SpamProtect
 from modules.types import PointType, ChatType
 from modules.effectbase import EffectBase
+from modules.ranking import RankingIndex
 
 logger = get_logger('chatbase')
 lock = get_lock('chatbase')
@@ -26,6 +26,7 @@ class Chatbase(persistent.Persistent):
         self.chat_channels = persistent.dict.PersistentDict()    # in these one can get points from chatting
         self.game_channels = persistent.dict.PersistentDict()    # in these one can play chat games
         self.join_messages = persistent.dict.PersistentDict()    # {name: msg} when special users join channels
+        self.rankings = RankingIndex()                           # entity ids ordered by points
         self.eventbase = eventbase
         self.effectbase = effectbase
         self.spam_protect = spam_protect
@@ -47,6 +48,7 @@ class Chatbase(persistent.Persistent):
     def reset(self):
         with lock:
             self.entities.clear()
+            self.rankings.reset()
             self.save()
             logger.info('Reset Chatbase')
 
@@ -57,6 +59,12 @@ class Chatbase(persistent.Persistent):
             # migrate all chatentities
             for ce in self.entities.itervalues():
                 ce.migrate()
+            if self.__dict__.get('rankings', None) is None:
+                self.rankings = RankingIndex()
+                for ce in self.entities.itervalues():
+                    ce.rankings = self.rankings
+                self.rankings.rebuild(self.entities.itervalues())
+                self.save()
 
     def update_vars(self, points_cost_on_kick=None, points_cost_on_ban=None, **_):
         with lock:
@@ -70,7 +78,7 @@ class Chatbase(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
     def add(self, id_: str, nick: str):
         with lock:
@@ -82,7 +90,8 @@ class Chatbase(persistent.Persistent):
         with lock:
             id_ = id_ if not is_nick else self.nick_to_id.get(id_, id_)
             if id_ not in self.entities:
-                self.entities[id_] = ChatEntity(id_)
+                self.entities[id_] = ChatEntity(id_, rankings=self.rankings)
+                self.rankings.add_entity(self.entities[id_])
             return self.entities[id_]
 
     def get_id(self, nick: str):
@@ -95,16 +104,9 @@ class Chatbase(persistent.Persistent):
     def get_k(self, k=5, largest=True, incl_players=True, incl_channels=True, point_type: PointType=None) -> list:
         """ get k of a group, filtered by """
         with lock:
-            fun, default = (nlargest, -999999999) if largest else (nsmallest, 99999999999)
-
-            def _cond(e):
-                if e is None:
-                    return False
-                if e.id is None:
-                    return False
-                return e.is_player == incl_players or e.is_channel == incl_channels
-
-            return fun(k, self.entities.values(), key=lambda e: e.get_points(point_type) if _cond(e) else default)
+            ids = self.rankings.get_k(k=k, largest=largest, incl_players=incl_players, incl_channels=incl_channels,
+                                      point_type=point_type)
+            return [self.entities[id_] for id_ in ids]
 
     def get_k_points_str(self, point_type: PointType=None, **kwargs) -> str:
         with lock:
@@ -158,6 +160,7 @@ class Chatbase(persistent.Persistent):
             self.get(player_id).update_points(points*chat_mult, player_nick, type_=point_type, partial=partial)
             self.nick_to_id[player_nick] = player_id
 
+    @atomic(batcher=chat_commits)
     def on_chat(self, msg: str, player_id: str, player_nick=None, channel_id=None):
         with lock:
             if channel_id not in self.chat_channels:
@@ -175,6 +178,7 @@ class Chatbase(persistent.Persistent):
             return
         gmf(medium)(channel_id, msg.format(name=player_nick))
 
+    @atomic
     def on_kick(self, by: str, target: str, channel: str, msg: str):
         with lock:
             id1, id2, cid = self.get_id(by), self.get_id(target), self.get_id(channel)
@@ -204,6 +208,7 @@ class Chatbase(persistent.Persistent):
             logger.debug('transfer %d/%d, partial %s' % (amount, p, partial))
             return -p
 
+    @atomic
     def tip(self, nick1, nick2, amount: int, partial=True) -> (int, str):
         """ chattip, nick1 tips amount points to nick2 """
         with lock:
@@ -222,6 +227,7 @@ class Chatbase(persistent.Persistent):
         with lock:
             self.get(id_).add_points_effect(self.effectbase.test_effect())
 
+    @atomic
     def apply_effect(self, entity_id: str, effect_id: str, is_player_nick=False, is_effect_name=False) -> str:
         """ Applies an effect to a chatentity """
         with lock:
@@ -234,6 +240,7 @@ class Chatbase(persistent.Persistent):
             entity.add_points_effect(effect)
             return '%s received effect: [%s]' % (entity.nick, effect.to_str())
 
+    @atomic
     def use_item(self, item_id: str, user_id: str, target_id: str=None,
                  is_item_name=False, is_user_nick=False, is_target_nick=False) -> str:
         with lock:
@@ -246,6 +253,7 @@ class Chatbase(persistent.Persistent):
                 target = self.get(target_id, is_nick=is_target_nick)
             return item.use(user, target)
 
+    @atomic
     def add_to_ignore(self, id_: str, is_nick=False, duration=None) -> str:
         """ add a player to the ignore list """
         with lock:
@@ -270,6 +278,7 @@ class Chatbase(persistent.Persistent):
                 items.append(part.format(**{'n': self.get(id_).nick, 'd': time_to_str(d - time.time())}))
             return 'Ignored players: %s' % ', '.join(items)
 
+    @atomic
     def remove_from_ignore(self, id_: str, is_nick=False) -> str:
         """ remove a player to the ignore list """
         with lock:
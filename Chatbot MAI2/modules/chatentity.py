@@ -1,9 +1,9 @@
 import persistent
 import persistent.dict
 import persistent.list
-import transaction
 from modules.effectbase import EffectBase
 from modules.utils import get_logger, points_to_level
+from modules.commits import chat_commits, commit
 from modules.utils import get_msg_fun as gmf
 from modules.types import PointType, ChatType
 from modules.effects import PointsEffect
@@ -14,9 +14,10 @@ logger = get_logger('chatentity')
 
 class ChatEntity(persistent.Persistent):
 
-    def __init__(self, id_):
+    def __init__(self, id_, rankings=None):
         super(ChatEntity, self).__init__()
         self.id = id_
+        self.rankings = rankings
         self.nick = '_unknown_'
         self.points = persistent.dict.PersistentDict()
         self.point_sum = 0
@@ -28,13 +29,18 @@ class ChatEntity(persistent.Persistent):
     def migrate(self):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         # self.x = self.__dict__.get('x', 'oh a new self.x!')
+        # a ghost has an empty __dict__, load it first
+        self._p_activate()
+        if 'rankings' not in self.__dict__:
+            # assigning marks the entity changed, which rewrites it with the next commit
+            self.rankings = None
         # migrate existing effects
         for effect in self.points_effects:
             effect.migrate()
 
     def save(self):
         self._p_changed = True
-        transaction.commit()
+        commit()
 
     def add_usable_item(self, item: UsableItem):
         item.merge(self.useable_items.pop(item.item_id) if item.item_id in self.useable_items else None)
@@ -65,30 +71,46 @@ class ChatEntity(persistent.Persistent):
             logger.warn('Chatentity id:%s, nick:%s, tried applying None effect' % (self.id, self.nick))
             return
         self.points_effects.append(effect)
-        effect.begin(self.update_points_effects, effect, begins=False)
+        effect.start(self)
         logger.debug('ChatEntity id:%s adding new effect, has %d' % (self.id, len(self.points_effects)))
         self.update_points_effects(effect, begins=True)
 
     def update_points_effects(self, effect: PointsEffect, begins=True):
-        """ updates effects list and multipliers """
-        self.points_mults.clear()
-        self.points_effects, to_apply = EffectBase.get_updated_effects(self.points_effects)
+        """ updates effects list and multipliers, still the expiry callback of effects without an EffectBase """
+        self.__update_mults()
+        self.__message_effects([effect], begins)
+
+    def expire_points_effects(self, effects: list):
+        """ called by the EffectBase once for all effects of this entity that expired """
+        self.__update_mults()
+        self.__message_effects(effects, begins=False)
+
+    def __update_mults(self):
+        """ the multipliers only change when effects begin or expire, so get_mult is just a lookup """
+        _, to_apply = EffectBase.get_updated_effects(self.points_effects)
+        mults = {}
         for e in to_apply:
             for k, v in e.get_adds().items():
-                self.points_mults[k] = self.points_mults.get(k, 1) + v
+                mults[k] = mults.get(k, 1) + v
         for e in to_apply:
             for k, v in e.get_mults().items():
-                self.points_mults[k] = self.points_mults.get(k, 1) * v
+                mults[k] = mults.get(k, 1) * v
+        if mults != dict(self.points_mults):
+            self.points_mults.clear()
+            self.points_mults.update(mults)
         self.save()
+        logger.debug('ChatEntity id:%s updating effects: %s' % (self.id, [str(e) for e in self.points_effects]))
+        logger.debug('ChatEntity id:%s has mults: %s' % (self.id, self.points_mults))
+
+    def __message_effects(self, effects: list, begins: bool):
         mults = self.__get_mults_strs()
-        msg = 'A chat-effect {state}! [{effect}], changing your multipliers to {mults}!'.format(**{
-            'state': 'begins' if begins else 'ended',
-            'effect': effect.to_str(),
+        msg = '{what} {state}! [{effects}], changing your multipliers to {mults}!'.format(**{
+            'what': 'A chat-effect' if len(effects) == 1 else 'Chat-effects',
+            'state': ('begins' if begins else 'ended') if len(effects) == 1 else ('begin' if begins else 'ended'),
+            'effects': '], ['.join(e.to_str() for e in effects),
             'mults': '[%s]' % ', '.join(mults) if len(mults) > 0 else 'default',
         })
         gmf(ChatType.IRC)(self.nick, msg)
-        logger.debug('ChatEntity id:%s updating effects: %s' % (self.id, [str(e) for e in self.points_effects]))
-        logger.debug('ChatEntity id:%s has mults: %s' % (self.id, self.points_mults))
 
     def update_points(self, delta, nick=None, type_=PointType.CHAT, partial=False, mult_enabled=True) -> (int, bool):
         """
@@ -102,9 +124,14 @@ class ChatEntity(persistent.Persistent):
                 points = -self.point_sum
             else:
                 return 0, False
-        self.points[type_] = self.points.get(type_, 0) + points
+        old_points = self.points.get(type_, 0)
+        self.points[type_] = old_points + points
         self.point_sum += points
-        self.save()
+        if self.rankings is not None:
+            self.rankings.update(self.id, self.is_channel, type_, old_points, self.points[type_])
+            self.rankings.update(self.id, self.is_channel, None, self.point_sum - points, self.point_sum)
+        # the most frequent write by far, inside batched calls (on_chat) it is committed together with others
+        chat_commits.commit()
         logger.debug('updated {id}:{nick} by d:{delta}/p:{points} points of type "{type}", total is {p}'.format(**{
             'id': self.id,
             'nick': nick,
@@ -131,9 +158,13 @@ class ChatEntity(persistent.Persistent):
             if p != 0:
                 msg_parts.append('%i from %s' % (p, PointType.as_str(type_)))
         level, rem_points = points_to_level(self.point_sum)
-        return "{nick} is level {lvl} with {p} points ({rp} to next level, {parts})".format(**{
+        rank = ''
+        if self.rankings is not None:
+            rank = ' (rank %d)' % self.rankings.get_rank(self.id, self.is_channel, self.point_sum)
+        return "{nick} is level {lvl}{rank} with {p} points ({rp} to next level, {parts})".format(**{
             'nick': self.nick,
             'lvl': level,
+            'rank': rank,
             'p': self.point_sum,
             'rp': rem_points,
             'parts': ", ".join(msg_parts)
@@ -0,0 +1,243 @@
+import atexit
+import functools
+import random
+import threading
+import time
+import transaction
+from ZODB.POSException import ConflictError
+from modules.utils import get_logger
+from botcore.metrics import metrics
+
+logger = get_logger('commits')
+
+# every thread works with its own db connection and transaction, see atomic()
+_local = threading.local()
+batchers = []
+conflicts = {'retried': 0, 'failed': 0}
+
+
+def in_atomic() -> bool:
+    return getattr(_local, 'depth', 0) > 0
+
+
+def commit():
+    """ commit the transaction of this thread, inside atomic() the commit happens once at its end """
+    if in_atomic():
+        return
+    with metrics.timer('commit', 'commit'):
+        transaction.commit()
+
+
+def atomic(fun=None, retries=5, batcher=None):
+    """
+    Decorator, runs fun as one transaction of the calling thread.
+    If committing fails because another thread (connection) changed the same objects, the changes are
+    aborted, the connection sees the other commit, and fun is run again (up to retries times).
+    Nested calls just run as part of the outer transaction. Anything fun does besides changing persistent
+    objects (e.g. sending messages) may happen again on a retry.
+    :param batcher: in the thread of this CommitBatcher, commit together with other batched calls instead,
+        conflicts then only show up when it flushes (and the batched calls are run again)
+    """
+    if fun is None:
+        return functools.partial(atomic, retries=retries, batcher=batcher)
+
+    @functools.wraps(fun)
+    def wrapped(*args, **kwargs):
+        if in_atomic():
+            return fun(*args, **kwargs)
+        if batcher is not None and batcher.batching():
+            return batcher.run(fun, args, kwargs)
+        # do not risk losing pending batched changes if this one conflicts
+        for b in batchers:
+            b.flush()
+        for attempt in range(retries + 1):
+            _local.depth = 1
+            try:
+                result = fun(*args, **kwargs)
+                _local.depth = 0
+                with metrics.timer('commit', 'atomic/' + fun.__name__):
+                    transaction.commit()
+                return result
+            except ConflictError as e:
+                transaction.abort()
+                if attempt >= retries:
+                    conflicts['failed'] += 1
+                    metrics.count('commit_conflicts_failed')
+                    logger.warning('Giving up on %s after %d conflicts: %s' % (fun.__name__, attempt + 1, str(e)))
+                    raise
+                conflicts['retried'] += 1
+                metrics.count('commit_conflicts_retried')
+                logger.debug('Conflict in %s, retrying: %s' % (fun.__name__, str(e)))
+                time.sleep(random.random() * 0.01 * (attempt + 1))
+                # see the latest commits only after waiting
+                transaction.begin()
+            except Exception:
+                transaction.abort()
+                raise
+            finally:
+                _local.depth = 0
+    return wrapped
+
+
+class CommitBatcher:
+    """
+    Groups frequent small transactions (e.g. points for every chat line) into fewer commits.
+    Calls of functions decorated with atomic(batcher=...) in the loop thread keep their changes in the connection
+    until max_updates calls were made or max_delay_ms passed, then everything is committed at once.
+    Any other commit in that thread (or flush()) also writes the pending changes.
+    The batched calls are remembered until they are committed: if the commit conflicts with another thread,
+    they are run again on top of the other commit, and if one of them fails, only its own changes are lost.
+    """
+
+    def __init__(self, name: str, retries=5):
+        self.name = name
+        self.retries = retries
+        self.loop = None
+        self.thread_id = None
+        self.max_updates = 1
+        self.max_delay = 0
+        self.calls = []  # (fun, args, kwargs) whose changes are not committed yet
+        self.txn = None  # the transaction they were made in
+        self.handle = None
+        self.commits = 0
+        self.requests = 0
+        batchers.append(self)
+
+    def enable(self, loop, max_updates=100, max_delay_ms=2000):
+        """ batch the commits made in the thread running loop """
+        self.flush()
+        self.loop = loop
+        self.thread_id = threading.get_ident()
+        self.max_updates = max(int(max_updates), 1)
+        self.max_delay = max(int(max_delay_ms), 0) / 1000
+        logger.info('Batching %s commits, every %d updates or %d ms' % (self.name, self.max_updates, max_delay_ms))
+
+    def disable(self):
+        self.flush()
+        self.loop, self.thread_id = None, None
+
+    @property
+    def enabled(self) -> bool:
+        return self.loop is not None and self.max_updates > 1
+
+    @property
+    def pending(self) -> int:
+        return len(self.calls)
+
+    def batching(self) -> bool:
+        """ whether calls of the current thread are batched """
+        return self.enabled and threading.get_ident() == self.thread_id
+
+    def commit(self):
+        """ commit now, with the pending batched changes """
+        if in_atomic():
+            return
+        self.requests += 1
+        with metrics.timer('commit', 'batch/' + self.name):
+            transaction.commit()
+        self.commits += 1
+
+    def run(self, fun, args, kwargs):
+        """ runs fun as part of the batch, see atomic """
+        self.__restore()
+        _local.depth = 1
+        try:
+            result = fun(*args, **kwargs)
+        except Exception:
+            _local.depth = 0
+            # throw away the changes of this call only
+            self.__replay(abort=True)
+            raise
+        finally:
+            _local.depth = 0
+        self.requests += 1
+        self.calls.append((fun, args, kwargs))
+        self.__track()
+        if len(self.calls) >= self.max_updates:
+            self.flush()
+        elif self.handle is None:
+            self.handle = self.loop.call_later(self.max_delay, self.flush)
+        return result
+
+    def __track(self):
+        txn = transaction.get()
+        if self.txn is not txn:
+            self.txn = txn
+            txn.addAfterCommitHook(self.__after_commit)
+
+    def __after_commit(self, success: bool):
+        if success:
+            self.calls, self.txn = [], None
+
+    def __restore(self):
+        """ the pending changes are gone if their transaction was aborted elsewhere, make them again """
+        if self.calls and self.txn is not transaction.get():
+            self.__replay(abort=False)
+
+    def __replay(self, abort=True):
+        """ runs the pending calls again, after aborting the current transaction """
+        if abort:
+            transaction.abort()
+        calls, self.calls, self.txn = self.calls, [], None
+        _local.depth = 1
+        try:
+            for call in calls:
+                fun, args, kwargs = call
+                try:
+                    fun(*args, **kwargs)
+                    self.calls.append(call)
+                except Exception as e:
+                    logger.warning('Dropped a batched %s update that failed when running it again: %s' %
+                                   (self.name, str(e)))
+        finally:
+            _local.depth = 0
+        if self.calls:
+            self.__track()
+
+    def flush(self):
+        """ commit all pending changes now, does nothing outside the loop thread """
+        if threading.get_ident() != self.thread_id:
+            return
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.__restore()
+        if not self.calls:
+            return
+        for attempt in range(self.retries + 1):
+            amount = len(self.calls)
+            t0 = time.perf_counter()
+            try:
+                transaction.commit()
+                self.commits += 1
+                metrics.observe('commit', 'batch/' + self.name, time.perf_counter() - t0)
+                logger.debug('Committed %d batched %s updates in %.4fs' % (amount, self.name, time.perf_counter() - t0))
+                return
+            except ConflictError as e:
+                if attempt >= self.retries:
+                    transaction.abort()
+                    self.calls, self.txn = [], None
+                    conflicts['failed'] += 1
+                    metrics.count('commit_conflicts_failed')
+                    logger.warning('Lost %d batched %s updates after %d conflicts: %s' %
+                                   (amount, self.name, attempt + 1, str(e)))
+                    return
+                conflicts['retried'] += 1
+                metrics.count('commit_conflicts_retried')
+                logger.debug('Conflict committing %d batched %s updates, running them again: %s' %
+                             (amount, self.name, str(e)))
+                # the aborted connection sees the other commit, the updates are made again on top of it
+                self.__replay(abort=True)
+                if not self.calls:
+                    return
+
+
+chat_commits = CommitBatcher('chat')
+
+
+@atexit.register
+def __flush_on_exit():
+    try:
+        chat_commits.flush()
+    except Exception as e:
+        logger.warning('Failed flushing batched commits on exit: %s' % str(e))
@@ -1,18 +1,26 @@
 import persistent.dict
-import transaction
 import json
+import random
+import time
+import BTrees.OOBTree
+from modules.commits import commit
 from modules.effects import PointsEffect
 from modules.types import *
+from modules.callbackitem import CallbackItem
 from modules.callbackqueue import CallbackQueue
 from modules.utils import get_logger, get_lock
 
 logger = get_logger('effectbase')
 lock = get_lock('effectbase')
 
+EXPIRY_BATCH_DELAY = 1  # seconds the expiry job waits, so effects that expire about the same time are batched
+
 
 class EffectBase(persistent.Persistent):
     """
-    Loads effect configuations from a json file, creates Effect objects
+    Loads effect configuations from a json file, creates Effect objects.
+    Also expires the running effects of all entities: they are indexed by expiry time, and a single queued
+    job at a time processes everything that is due.
     """
 
     def __init__(self, queue: CallbackQueue):
@@ -20,6 +28,8 @@ class EffectBase(persistent.Persistent):
         self.queue = queue
         self.effects = persistent.dict.PersistentDict()
         self.effectname_to_effectid = persistent.dict.PersistentDict()
+        self.expiries = BTrees.OOBTree.OOBTree()  # (time, tie breaker) -> (entity, effect)
+        self.next_expiry_job = None               # when the queued expiry job runs
         logger.info('Creating new EffectBase')
 
     def set(self, queue: CallbackQueue):
@@ -27,7 +37,8 @@ class EffectBase(persistent.Persistent):
 
     def reset(self):
         with lock:
-            # actually nothing to be done, as effects are in the queue
+            self.expiries.clear()
+            self.next_expiry_job = None
             self.save()
             logger.info('Reset EffectBase')
 
@@ -35,7 +46,10 @@ class EffectBase(persistent.Persistent):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            if self.__dict__.get('expiries', None) is None:
+                self.expiries = BTrees.OOBTree.OOBTree()
+                self.next_expiry_job = None
+                self.save()
 
     def __next_id(self):
         with lock:
@@ -47,7 +61,7 @@ class EffectBase(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
     def update_effects_list(self, json_path):
         with lock:
@@ -83,24 +97,53 @@ class EffectBase(persistent.Persistent):
             pt_mult = {PointType.from_str(k): v for k, v in cfg.get('multipliers').items()}
             logger.debug('EffectBase geteffect for %s, pt_mult: %s' % (id_, str(pt_mult)))
             return PointsEffect(self.__next_id(), name=cfg.get('name'), queue=self.queue, duration=cfg.get('duration'),
-                                adds=pt_add, mults=pt_mult, group=cfg.get('group', 'unknown'))
+                                adds=pt_add, mults=pt_mult, group=cfg.get('group', 'unknown'), effectbase=self)
 
     def test_effect(self):
         with lock:
             return PointsEffect(self.__next_id(), name='test1', queue=self.queue, duration=30, mults={
                 PointType.CHAT: 2.0,
-            })
+            }, effectbase=self)
+
+    def add_expiry(self, effect: PointsEffect, entity):
+        """ expire effect (on entity) at effect.time, does not commit """
+        with lock:
+            self.expiries[(effect.time, random.getrandbits(48))] = (entity, effect)
+            self.__schedule_expiries()
+
+    def __schedule_expiries(self):
+        """ makes sure a job is queued for the next expiry """
+        if len(self.expiries) == 0:
+            return
+        due = self.expiries.minKey()[0]
+        # a job that should have run already is lost (queue reset, dropped or aborted), queue a new one
+        if self.next_expiry_job is not None and time.time() <= self.next_expiry_job <= due:
+            return
+        self.queue.add(CallbackItem(max(due - time.time(), 0) + EXPIRY_BATCH_DELAY, self.process_expiries))
+        self.next_expiry_job = due
+
+    def process_expiries(self):
+        """ expires all due effects, each entity updates its multipliers once """
+        with lock:
+            now = time.time()
+            if self.next_expiry_job is not None and self.next_expiry_job <= now:
+                self.next_expiry_job = None
+            by_entity = {}
+            for key in list(self.expiries.keys(max=(now, float('inf')))):
+                entity, effect = self.expiries.pop(key)
+                by_entity.setdefault(entity.id, (entity, []))[1].append(effect)
+            for entity, effects in by_entity.values():
+                entity.expire_points_effects(effects)
+            self.__schedule_expiries()
+            self.save()
+            logger.debug('EffectBase expired effects of %d entities' % len(by_entity))
 
     @staticmethod
     def get_updated_effects(effects: list) -> (list, list):
         # clear effects that have run out
-        j = 0
-        while j < len(effects):
-            e = effects[j]
-            if e.is_expired():
-                effects.pop(j)
-            else:
-                j += 1
+        remaining = [e for e in effects if not e.is_expired()]
+        if len(remaining) < len(effects):
+            effects[:] = remaining
         # group remaining effects into groups, effects within groups can not stack
         groups = {}
         for e in effects:
@@ -1,8 +1,8 @@
 import persistent
 import persistent.dict
-import transaction
 import time
 import functools
+from modules.commits import commit
 from modules.types import PointType
 from modules.callbackitem import CallbackItem
 from modules.callbackqueue import CallbackQueue
@@ -15,12 +15,14 @@ logger = get_logger('effects')
 class PointsEffect(persistent.Persistent):
     """ An effect, given to a ChatEntity, which calls the begin method. """
 
-    def __init__(self, id_, name, duration: int, queue: CallbackQueue, group='not_set', adds=None, mults=None):
+    def __init__(self, id_, name, duration: int, queue: CallbackQueue, group='not_set', adds=None, mults=None,
+                 effectbase=None):
         super(PointsEffect, self).__init__()
         self.id = id_
         self.name = name
         self.duration = duration
         self.queue = queue
+        self.effectbase = effectbase
         self.time = None
         self.adds = persistent.dict.PersistentDict()   # will stack additively, then multiplied with base
         self.mults = persistent.dict.PersistentDict()  # will be multiplied with each other and base
@@ -34,7 +36,10 @@ class PointsEffect(persistent.Persistent):
     def migrate(self):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         # self.x = self.__dict__.get('x', 'oh a new self.x!')
-        pass
+        # a ghost has an empty __dict__, and assigning marks the effect changed, which rewrites it
+        self._p_activate()
+        if 'effectbase' not in self.__dict__:
+            self.effectbase = None
 
     def add_add(self, type_: PointType, add: float):
         self.adds[type_] = self.adds.get(type_, 0) + add
@@ -56,9 +61,18 @@ class PointsEffect(persistent.Persistent):
         self.time = time.time() + self.duration
         self.save()
 
+    def start(self, entity):
+        """ starts the effect on entity, the EffectBase expires it (effects without one get their own callback) """
+        if self.effectbase is None:
+            self.begin(entity.update_points_effects, self, begins=False)
+            return
+        self.time = time.time() + self.duration
+        self.effectbase.add_expiry(self, entity)
+        self.save()
+
     def save(self):
         self._p_changed = True
-        transaction.commit()
+        commit()
 
     def rem_time(self) -> float:
         return self.time - time.time()
@@ -109,3 +109,19 @@ class OnKickEvent(Event):
             'msg': self.msg,
             'p': self.points
         })
+
+
+class MarketRefillEvent(Event):
+    def __init__(self, market: str, changes: dict, stock: dict):
+        super(MarketRefillEvent, self).__init__(EventType.MARKETREFILL, market)
+        self.changes = changes
+        self.stock = stock
+
+    def __str__(self):
+        return 'Event id:{id}, type:{type}, by:{by}, changes:{changes}, stock:{stock}'.format(**{
+            'id': self.id,
+            'type': self.type,
+            'by': self.by,
+            'changes': self.changes,
+            'stock': self.stock,
+        })
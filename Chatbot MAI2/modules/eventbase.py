@@ -1,5 +1,10 @@
 import persistent.list
-import transaction
+import time
+import BTrees.LLBTree
+import BTrees.LOBTree
+import BTrees.OLBTree
+import BTrees.OOBTree
+from modules.commits import atomic, commit
 from modules.event import *
 from modules.types import CommandType, EventType
 from modules.utils import get_logger, get_lock, time_to_str
@@ -11,13 +16,20 @@ lock = get_lock('eventbase')
 class Eventbase(persistent.Persistent):
     def __init__(self, ):
         super(Eventbase, self).__init__()
-        self.events = persistent.list.PersistentList()
+        # events by id, ids are increasing with time
+        self.events = BTrees.LOBTree.LOBTree()
+        # indexes: time -> first id at that time, type/command type/by -> set of ids
+        self.time_index = BTrees.OLBTree.OLBTree()
+        self.type_index = BTrees.OOBTree.OOBTree()
+        self.command_index = BTrees.OOBTree.OOBTree()
+        self.by_index = BTrees.OOBTree.OOBTree()
         self.next_id = 0
         logger.info('Created new Eventbase')
 
     def reset(self):
         with lock:
-            self.events.clear()
+            for tree in [self.events, self.time_index, self.type_index, self.command_index, self.by_index]:
+                tree.clear()
             self.save()
             logger.info('Reset Eventbase')
 
@@ -25,7 +37,20 @@ class Eventbase(persistent.Persistent):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            if isinstance(self.events, persistent.list.PersistentList):
+                # events used to be a list, move them into the trees
+                events = self.events
+                self.events = BTrees.LOBTree.LOBTree()
+                self.time_index = BTrees.OLBTree.OLBTree()
+                self.type_index = BTrees.OOBTree.OOBTree()
+                self.command_index = BTrees.OOBTree.OOBTree()
+                self.by_index = BTrees.OOBTree.OOBTree()
+                for e in events:
+                    self.__index_event(e)
+                if len(self.events) > 0:
+                    self.next_id = max(self.next_id, self.events.maxKey() + 1)
+                self.save()
+                logger.info('Migrated %d events into the Eventbase trees' % len(self.events))
 
     def update_vars(self, **_):
         # function to set misc vars
@@ -36,14 +61,31 @@ class Eventbase(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
+    @staticmethod
+    def __add_to_index(index, key, id_):
+        ids = index.get(key)
+        if ids is None:
+            ids = index[key] = BTrees.LLBTree.LLTreeSet()
+        ids.insert(id_)
+
+    def __index_event(self, e):
+        """ adds the event to the trees, only touches the last bucket of each """
+        self.events[e.id] = e
+        self.time_index.insert(e.get_time(), e.id)
+        self.__add_to_index(self.type_index, e.type.value, e.id)
+        self.__add_to_index(self.by_index, e.by, e.id)
+        if e.type == EventType.COMMAND:
+            self.__add_to_index(self.command_index, e.command_type.value, e.id)
+
+    @atomic
     def add_event(self, e):
         with lock:
             e.id = self.next_id
-            self.events.append(e)
             self.next_id += 1
-            self.save()
+            self.__index_event(e)
+            commit()
             logger.debug('added new event: %s' % e)
 
     def add_command_event(self, type_: CommandType, by_, target=None, args=None, spam_protect_time=None):
@@ -66,78 +108,63 @@ class Eventbase(persistent.Persistent):
             event = OnKickEvent(by, target, channel, msg, points)
             self.add_event(event)
 
+    def add_market_refill_event(self, market: str, changes: dict, stock: dict):
+        with lock:
+            event = MarketRefillEvent(market, changes, stock)
+            self.add_event(event)
+
     def print(self):
         with lock:
             logger.info('Eventbase has {n} entities'.format(**{
                 'n': len(self.events),
             }))
 
-    @staticmethod
-    def filter_events(events, filter_fun):
-        with lock:
-            filtered = []
-            for e in events:
-                if filter_fun(e):
-                    filtered.append(e)
-            return filtered
-
-    def filter_type(self, types: [EventType], events=None):
-        """ types is a list, can be [None] to include all """
+    def __id_range(self, t0d=None, t1d=0) -> (int, int):
+        """ first and last event id between t0d and t1d, relative to current time """
+        now = time.time()
+        first = 0 if t0d is None else next(iter(self.time_index.values(min=now-t0d)), self.next_id)
+        last = self.next_id - 1
+        if t1d is not None and t1d > 0:
+            last = next(iter(self.time_index.values(min=now-t1d, excludemin=True)), self.next_id) - 1
+        return first, last
+
+    def query(self, types: [EventType]=None, by=None, command_type: CommandType=None, t0d=None, t1d=0) -> list:
+        """ events of any of the types (None for all), by someone, of a command type,
+            happening between t0d and t1d, relative to current time
+            e.g. t0d=60, t1d=30, are the events in the past minute - those in the past 30 seconds
+            only the matching events are loaded """
         with lock:
-            events = events if events is not None else self.events
-            if types.count(None) == len(types):
-                return events
-
-            def has_type(e):
-                return e.type in types
-
-            return Eventbase.filter_events(events, has_type)
-
-    def filter_time(self, t0d=None, t1d=0, events=None):
-        """ events happening between t0d and t1d, relative to current time
-            e.g. t0d=60, t1d=30, are the events in the past minute - those in the past 30 seconds """
-        with lock:
-            events = events if events is not None else self.events
-            t0d = t0d if t0d is not None else time.time()
-            t1d = t1d if t1d is not None else 0
-            t0, t1 = time.time()-t0d, time.time()-t1d
-
-            def in_time(e):
-                return t0 <= e.get_time() <= t1
-
-            return Eventbase.filter_events(events, in_time)
-
-    def filter_by(self, by, events=None):
-        """ events happening between t0d and t1d, relative to current time
-            e.g. t0d=60, t1d=30, are the events in the past minute - those in the past 30 seconds """
-        with lock:
-            events = events if events is not None else self.events
-            if by is None:
-                return events
-
-            def is_by(e):
-                return e.is_by(by)
-
-            return Eventbase.filter_events(events, is_by)
+            first, last = self.__id_range(t0d, t1d)
+            if first > last:
+                return []
+            ids = None
+            if types is not None and types.count(None) < len(types) and EventType.ANY not in types:
+                ids = BTrees.LLBTree.LLTreeSet()
+                for type_ in types:
+                    ids = BTrees.LLBTree.union(ids, self.type_index.get(type_.value))
+            for index, key in [(self.by_index, by),
+                               (self.command_index, None if command_type is None else command_type.value)]:
+                if key is not None:
+                    key_ids = index.get(key, BTrees.LLBTree.LLTreeSet())
+                    ids = key_ids if ids is None else BTrees.LLBTree.intersection(ids, key_ids)
+            if ids is None:
+                return list(self.events.values(first, last))
+            return [self.events[id_] for id_ in ids.keys(first, last)]
 
     def recent_events_str(self, event_type_str: str, user_id: str, user_nick: str, time_after: int=None,
                           command_events=False) -> str:
-        events = self.filter_time(t0d=time_after)
-        events = self.filter_by(user_id, events=events)
         misc_str, event_type_msg = '', ''
         if command_events:
             # filter for command-events of command-type...
             type_, event_type_msg = CommandType.from_str(event_type_str), 'command-'
-            events = self.filter_type([EventType.COMMAND], events=events)
-            if type_ is not None:
-                events = self.filter_events(events, lambda e: e.command_type == type_)
+            events = self.query(types=[EventType.COMMAND], by=user_id, command_type=type_, t0d=time_after)
             spam_sum = sum([e.get_spam_protect_time() for e in events])
             if len(events) > 0 and spam_sum > 0:
                 misc_str += ', with an average spam protect time of %.1fs' % (spam_sum / len(events))
         else:
             # filter for events of event-type...
             type_ = EventType.from_str(event_type_str)
-            events = self.filter_type([type_], events=events)
+            events = self.query(types=[type_], by=user_id, t0d=time_after)
         return '{n} {ty}events{tp} were logged{user}{time}{misc}'.format(**{
             'n': len(events),
             'ty': event_type_msg,
@@ -149,6 +176,6 @@ class Eventbase(persistent.Persistent):
 
     def print_events(self, events=None):
         with lock:
-            events = events if events is not None else self.events
+            events = events if events is not None else self.events.values()
             for e in events:
                 logger.info(e)
@@ -1,5 +1,5 @@
 import persistent.dict
-import transaction
+from modules.commits import atomic, commit
 from modules.utils import get_logger, get_lock, time_to_str
 from modules.callbackqueue import CallbackQueue
 from modules.eventbase import Eventbase
@@ -77,7 +77,7 @@ class Gamebase(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
     def __get_game(self, channel: str, game_type: GameType, prev=False) -> Game:
         """ returns None if there is no current game, an exception if there is another game or games are disabled,
@@ -97,6 +97,7 @@ class Gamebase(persistent.Persistent):
                 return game
             raise ValueError('Another game is already running in channel %s!' % channel)
 
+    @atomic
     def get_roulette_game(self, chat_type: ChatType, channel: str, requested_by: str) -> RouletteGame:
         with lock:
             game = self.__get_game(channel, GameType.ROULETTE)
@@ -1,5 +1,5 @@
 import persistent.dict
-import transaction
+from modules.commits import commit
 from modules.types import ChatType, GameType, PointType
 from modules.utils import get_msg_fun as gmf
 from modules.callbackqueue import CallbackQueue
@@ -38,7 +38,7 @@ class Game(persistent.Persistent):
     def save(self):
         # should be locked by the child classes
         self._p_changed = True
-        transaction.commit()
+        commit()
 
     def end(self):
         logger.debug('Game: end')
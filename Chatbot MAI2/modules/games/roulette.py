@@ -6,6 +6,7 @@ from modules.callbackqueue import CallbackQueue
 from modules.callbackitem import CallbackItem
 from modules.chatbase import Chatbase
 from modules.eventbase import Eventbase
+from modules.commits import atomic
 from modules.utils import get_logger, get_lock
 
 logger = get_logger('roulette_game')
@@ -30,6 +31,7 @@ class RouletteGame(Game):
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
             pass
 
+    @atomic
     def join(self, id_: str, name: str, points: int):
         with lock:
             logger.debug('RouletteGame join: %s, %s/%s, %s' % (self.channel, id_, name, points))
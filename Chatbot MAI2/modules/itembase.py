@@ -1,6 +1,6 @@
 import persistent.dict
-import transaction
 import json
+from modules.commits import atomic, commit
 from modules.callbackqueue import CallbackQueue
 from modules.chatbase import Chatbase
 from modules.effectbase import EffectBase
@@ -33,6 +33,8 @@ class ItemBase(persistent.Persistent):
         self.queue = queue
         self.effectbase = effectbase
         self.chatbase = chatbase
+        for market in self.markets.values():
+            market.set(chatbase.eventbase)
 
     def reset(self):
         with lock:
@@ -41,11 +43,19 @@ class ItemBase(persistent.Persistent):
             self.save()
             logger.info('Reset ItemBase')
 
+    def reset_ticks(self):
+        """ queues the ticks of the markets again, e.g. after the queue was reset """
+        with lock:
+            for market in self.markets.values():
+                market.reset_tick()
+
     def migrate(self):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            for market in self.markets.values():
+                market.migrate()
+                market.set(self.chatbase.eventbase)
 
     def print(self):
         with lock:
@@ -63,7 +73,7 @@ class ItemBase(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
     def get_item(self, id_, is_name=False):
         """ returns an Effect object of effect with given id, otherwise None """
@@ -79,6 +89,7 @@ class ItemBase(persistent.Persistent):
                                   cfg.get('visible'), cfg.get('uses'))
             return None
 
+    @atomic
     def add_item(self, player_id: str, item_id: str, is_player_nick=True, is_item_name=False) -> str:
         with lock:
             item = self.get_item(item_id, is_name=is_item_name)
@@ -152,4 +163,5 @@ class ItemBase(persistent.Persistent):
             if name in self.markets.keys():
                 self.markets[name].update(**market_config, id_to_name=self.itemid_to_itemname)
             else:
-                self.markets[name] = Market(self.queue, **market_config, id_to_name=self.itemid_to_itemname)
+                self.markets[name] = Market(self.queue, **market_config, id_to_name=self.itemid_to_itemname,
+                                            eventbase=self.chatbase.eventbase)
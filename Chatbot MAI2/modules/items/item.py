@@ -1,5 +1,5 @@
 import persistent.dict
-import transaction
+from modules.commits import commit
 
 
 class Item(persistent.Persistent):
@@ -21,7 +21,7 @@ class Item(persistent.Persistent):
 
     def save(self):
         self._p_changed = True
-        transaction.commit()
+        commit()
 
     def has_id(self, id_: str, is_name=False):
         if is_name:
@@ -1,5 +1,6 @@
+import time
 import persistent.dict
-import transaction
+from modules.commits import commit
 from modules.chatentity import ChatEntity
 from modules.callbackqueue import CallbackQueue
 from modules.callbackitem import CallbackItem
@@ -9,15 +10,20 @@ from modules.utils import get_logger, get_lock
 logger = get_logger('market')
 lock = get_lock('market')
 
+TICK_BATCH_DELAY = 1  # seconds the tick waits, so refills that are due about the same time are batched
+
 
 class Market(persistent.Persistent):
     """
-    A market to buy items from
+    A market to buy items from.
+    Items refill after sampled durations, a single queued tick job at a time applies all due refills
+    in one transaction and records them as one MarketRefillEvent.
     """
 
     def __init__(self, queue: CallbackQueue, name: str=None, description: str=None,
-                 items_config: dict=None, requirements: dict=None, id_to_name: dict=None):
+                 items_config: dict=None, requirements: dict=None, id_to_name: dict=None, eventbase=None):
         self.queue = queue
+        self.eventbase = eventbase
         self.name = None
         self.description = None
         self.items_config = None                            # info how often they stock up etc
@@ -25,6 +31,8 @@ class Market(persistent.Persistent):
         self.id_to_name = None
         self.update(name, description, items_config, requirements, id_to_name)
         self.stock = persistent.dict.PersistentDict()       # currently available items
+        self.next_refills = persistent.dict.PersistentDict()  # item id -> time of its next refill
+        self.next_tick_job = None                           # when the queued tick job runs
         self.set_stocks_init()
         self.start_refills()
         logger.info('Creating new Market: %s' % self.name)
@@ -37,6 +45,13 @@ class Market(persistent.Persistent):
             self.requirements = requirements if requirements is not None else self.requirements
             self.items_config = items_config if items_config is not None else self.items_config
             self.id_to_name = id_to_name if id_to_name is not None else self.id_to_name
+            if items_config is not None and self.__dict__.get('next_refills', None) is not None:
+                # new items start refilling right away, removed ones are dropped by the next tick
+                for id_, cfg in items_config.items():
+                    if id_ not in self.next_refills:
+                        self.stock.setdefault(id_, cfg.get('init_stock'))
+                        self.next_refills[id_] = time.time() + sample(**cfg.get('refill'))
+                self.__schedule_tick()
 
     def reset(self):
         with lock:
@@ -45,11 +60,23 @@ class Market(persistent.Persistent):
             self.start_refills()
             logger.info('Reset Market %s' % self.name)
 
+    def reset_tick(self):
+        """ queues the tick again, e.g. after the queue was reset """
+        with lock:
+            self.next_tick_job = None
+            self.__schedule_tick()
+            self.save()
+
     def migrate(self):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            if self.__dict__.get('next_refills', None) is None:
+                # refills queued per item still run once via on_refill, which hands them to the tick
+                self.eventbase = self.__dict__.get('eventbase', None)
+                self.next_refills = persistent.dict.PersistentDict()
+                self.next_tick_job = None
+                self.save()
 
     def print(self):
         with lock:
@@ -61,7 +88,10 @@ class Market(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
+
+    def set(self, eventbase):
+        self.eventbase = eventbase
 
     def set_stocks_init(self):
         with lock:
@@ -71,21 +101,66 @@ class Market(persistent.Persistent):
                 self.stock[id_] = v.get('init_stock')
 
     def start_refills(self):
+        """ samples the next refill of every item, any previously scheduled ones are replaced """
         with lock:
+            self.next_refills.clear()
+            self.next_tick_job = None
+            now = time.time()
             for id_, cfg in self.items_config.items():
-                duration = sample(**cfg.get('refill'))
-                self.queue.add(CallbackItem(duration, self.on_refill, item_id=id_, count=1))
+                self.next_refills[id_] = now + sample(**cfg.get('refill'))
+            self.__schedule_tick()
+            self.save()
+
+    def __schedule_tick(self):
+        """ makes sure a tick job is queued for the next refill """
+        if len(self.next_refills) == 0:
+            return
+        due = min(self.next_refills.values())
+        # a job that should have run already is lost (queue reset, dropped or aborted), queue a new one
+        if self.next_tick_job is not None and time.time() <= self.next_tick_job <= due:
+            return
+        self.queue.add(CallbackItem(max(due - time.time(), 0) + TICK_BATCH_DELAY, self.tick))
+        self.next_tick_job = due
+
+    def __refill(self, item_id, count: int) -> int:
+        """ adds count of item_id (up to its max stock), returns how many were added, does not commit """
+        cfg = self.items_config.get(item_id)
+        before = self.stock.get(item_id, 0)
+        self.stock[item_id] = min([before + count, cfg.get('max_stock')])
+        return self.stock[item_id] - before
+
+    def tick(self):
+        """ applies all due refills and samples the next ones """
+        with lock:
+            now = time.time()
+            if self.next_tick_job is not None and self.next_tick_job <= now:
+                self.next_tick_job = None
+            changes = {}
+            for id_, cfg in self.items_config.items():
+                due = self.next_refills.get(id_, None)
+                if due is not None and due > now:
+                    continue
+                if due is not None:
+                    changes[id_] = self.__refill(id_, 1)
+                # items added to the config since the last tick only get a refill time
+                self.next_refills[id_] = now + sample(**cfg.get('refill'))
+            for id_ in [id_ for id_ in self.next_refills.keys() if id_ not in self.items_config]:
+                del self.next_refills[id_]
+            self.__schedule_tick()
+            self.save()
+            if changes and self.eventbase is not None:
+                self.eventbase.add_market_refill_event(self.name, changes, dict(self.stock))
+            logger.info('market %s, refilled %s' % (self.name, str(changes)))
 
     def on_refill(self, item_id=None, count=1):
+        """ refills that were queued per item before the tick existed, the tick takes over afterwards """
         with lock:
             cfg = self.items_config.get(item_id, None)
             if cfg is not None:
-                self.stock[item_id] = min([self.stock.get(item_id) + count, cfg.get('max_stock')])
-                duration = sample(**cfg.get('refill'))
-                logger.info('market %s, refilling %s to %d (by %d), next one in %.2f'
-                            % (self.name, item_id, self.stock[item_id], count, duration))
+                self.__refill(item_id, count)
+                self.next_refills[item_id] = time.time() + sample(**cfg.get('refill'))
+                self.__schedule_tick()
                 self.save()
-                self.queue.add(CallbackItem(duration, self.on_refill, item_id=item_id, count=1))
 
     def get_stock(self) -> dict:
         return self.stock
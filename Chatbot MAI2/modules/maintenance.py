@@ -0,0 +1,163 @@
+import threading
+import time
+import ZODB
+from modules.utils import get_logger, time_to_str
+
+logger = get_logger('maintenance')
+
+# held while the storage file is rewritten (pack) or copied (backup)
+storage_file_lock = threading.Lock()
+
+
+def bytes_to_str(size: int) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return '%.1f%s' % (size, unit)
+        size /= 1024
+
+
+class DBMaintenance:
+    """
+    Keeps the ZODB in shape while the bot runs:
+        - the object cache is limited by cache_size (objects) / cache_size_bytes, and minimized every now and then;
+          connections are not thread safe, so only the loop thread's connection is minimized here, the
+          connections of other threads are asked to minimize themselves (see on_minimize)
+        - the storage is packed on a schedule in a background thread, keeping pack_keep_days of history
+        - stats about storage and cache, loads/stores are the transfer counts of the open connections
+    Every load is a cache miss, the pickle cache does not count its hits, so the stats show loads instead.
+    """
+
+    def __init__(self, db: ZODB.DB, connection, loop, minimize_interval=3600, pack_interval=24, pack_keep_days=7):
+        """
+        :param connection: the connection of the loop thread
+        :param minimize_interval: seconds between cacheMinimize calls, 0 to disable
+        :param pack_interval: hours between packs, 0 to disable
+        :param pack_keep_days: history to keep when packing
+        """
+        self.db = db
+        self.connection = connection
+        self.loop = loop
+        # thread safe functions, called to have the connections of other threads minimized by their thread
+        self.on_minimize = []
+        self.minimize_interval = max(int(minimize_interval), 0)
+        self.pack_interval = max(float(pack_interval), 0) * 3600
+        self.pack_keep_days = max(float(pack_keep_days), 0)
+        self.handles = {}
+        self.pack_thread = None
+        self.last_pack = None
+        self.last_pack_duration = None
+        self.last_minimize = None
+        self.loads, self.stores, self.counted_since = 0, 0, time.time()
+
+    @staticmethod
+    def create_db(storage, cache_size=5000, cache_size_bytes=0) -> ZODB.DB:
+        """ a db with the given cache budget per connection """
+        return ZODB.DB(storage, cache_size=int(cache_size), cache_size_bytes=int(cache_size_bytes))
+
+    def start(self):
+        self.stop()
+        if self.minimize_interval > 0:
+            self.__schedule('minimize', self.minimize_interval, self.__on_minimize)
+        if self.pack_interval > 0:
+            self.__schedule('pack', self.pack_interval, self.__on_pack)
+        logger.info('DB maintenance: minimize every %s, pack every %s keeping %.1f days, cache size %d / %s'
+                    % (time_to_str(self.minimize_interval), time_to_str(self.pack_interval), self.pack_keep_days,
+                       self.db.getCacheSize(), bytes_to_str(self.db.getCacheSizeBytes())))
+
+    def stop(self):
+        for handle in self.handles.values():
+            handle.cancel()
+        self.handles.clear()
+
+    def __schedule(self, name, delay, fun):
+        self.handles[name] = self.loop.call_later(delay, fun)
+
+    def __on_minimize(self):
+        self.__schedule('minimize', self.minimize_interval, self.__on_minimize)
+        self.minimize()
+
+    def __on_pack(self):
+        self.__schedule('pack', self.pack_interval, self.__on_pack)
+        self.pack()
+
+    def minimize(self):
+        """ ghost all unmodified objects of the loop thread's connection, pending changes stay """
+        t0 = time.time()
+        before = self.db.cacheSize()
+        self.connection.cacheMinimize()
+        for fun in self.on_minimize:
+            fun()
+        self.last_minimize = time.time()
+        logger.info('Minimized the object cache, %d -> %d objects in %.4fs'
+                    % (before, self.db.cacheSize(), self.last_minimize - t0))
+
+    def is_packing(self) -> bool:
+        return self.pack_thread is not None and self.pack_thread.is_alive()
+
+    def pack(self, keep_days=None) -> bool:
+        """ pack in a background thread, returns False if a pack is already running """
+        if self.is_packing():
+            return False
+        keep_days = self.pack_keep_days if keep_days is None else max(float(keep_days), 0)
+        self.pack_thread = threading.Thread(target=self.__pack, args=(keep_days,), daemon=True)
+        self.pack_thread.start()
+        return True
+
+    def __pack(self, keep_days: float):
+        with storage_file_lock:
+            t0 = time.time()
+            size = self.db.getSize()
+            try:
+                self.db.pack(t=t0 - keep_days * 86400)
+            except Exception as e:
+                logger.warning('Failed packing the db: %s' % str(e))
+                return
+            self.last_pack = time.time()
+            self.last_pack_duration = self.last_pack - t0
+            logger.info('Packed the db, keeping %.1f days: %s -> %s in %.2fs'
+                        % (keep_days, bytes_to_str(size), bytes_to_str(self.db.getSize()), self.last_pack_duration))
+
+    def __count_transfers(self, connection):
+        loads, stores = connection.getTransferCounts(clear=True)
+        self.loads += loads
+        self.stores += stores
+
+    def stats(self) -> dict:
+        """ loads/stores are counted since the last stats() call """
+        self.db._connectionMap(self.__count_transfers)
+        period = max(time.time() - self.counted_since, 1)
+        cache_detail = self.db.cacheDetailSize()
+        loads, stores = self.loads, self.stores
+        self.loads, self.stores, self.counted_since = 0, 0, time.time()
+        return {
+            'storage_size': self.db.getSize(),
+            'objects': self.db.objectCount(),
+            'cache_objects': sum(c['ngsize'] for c in cache_detail),
+            'cache_entries': sum(c['size'] for c in cache_detail),
+            'cache_size': self.db.getCacheSize() * max(len(cache_detail), 1),
+            'connections': len(cache_detail),
+            'period': period,
+            'loads': loads,
+            'stores': stores,
+            'last_pack': self.last_pack,
+            'last_pack_duration': self.last_pack_duration,
+            'last_minimize': self.last_minimize,
+            'packing': self.is_packing(),
+        }
+
+    def stats_str(self) -> [str]:
+        s, now = self.stats(), time.time()
+        fill = 100 * s['cache_objects'] / max(s['cache_size'], 1)
+        since = lambda t: 'never' if t is None else '%s ago' % time_to_str(int(now - t))
+        return [
+            'Storage: %s, %d objects' % (bytes_to_str(s['storage_size']), s['objects']),
+            'Cache: %d/%d objects loaded (%.1f%%) in %d connections, %d ghosts'
+            % (s['cache_objects'], s['cache_size'], fill, s['connections'], s['cache_entries'] - s['cache_objects']),
+            'Last %s: %d loads (cache misses, %.2f/min), %d stores (%.2f/min)'
+            % (time_to_str(int(s['period'])), s['loads'], 60 * s['loads'] / s['period'],
+               s['stores'], 60 * s['stores'] / s['period']),
+            'Last pack: %s%s, last minimize: %s'
+            % ('running' if s['packing'] else since(s['last_pack']),
+               '' if s['last_pack_duration'] is None else ' (took %.2fs)' % s['last_pack_duration'],
+               since(s['last_minimize'])),
+        ]
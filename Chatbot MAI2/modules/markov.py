@@ -3,6 +3,8 @@ import codecs
 import random
 import traceback
 import io
+import os
+from botcore.shared import registry
 from modules.utils import get_logger
 
 logger = get_logger('markov')
@@ -17,25 +19,41 @@ CS = 'cs'   # counter start sentence with word
 CE = 'ce'   # counter end sentence with word
 
 
+def load_words(path) -> dict:
+    try:
+        with codecs.open(path, mode='r+', encoding='utf8') as file:
+            return json.load(file)
+    except Exception:
+        print(traceback.format_exc())
+        return {}
+
+
 class Markov:
     """
     create word chains, based on how likely words appear in sequence in the given sample data
     create a new wordfile based on /quick_tests/create_markov_json.py, just feed some raw text
+    the words of a file are loaded once per process, bots using the same file share them,
+    a Markov that changes its words gets its own copy first
     """
 
     def __init__(self, plugin, wordfilepath, min_chain_length=4, max_chain_length=20, chain_length_chance=0.92):
         self.plugin = plugin
         self.wordfilepath = wordfilepath
-        self.markovwords = {}
         self.min_chain_length = min_chain_length
         self.max_chain_length = max_chain_length
         self.chain_length_chance = chain_length_chance
-        try:
-            with codecs.open(self.wordfilepath, mode='r+', encoding='utf8') as file:
-                self.markovwords = json.load(file)
-        except Exception:
-            print(traceback.format_exc())
-            pass
+        self.markovwords = registry.get(self.__key(), load_words, wordfilepath)
+        self.shared = True
+
+    def __key(self):
+        return 'markov', os.path.abspath(self.wordfilepath)
+
+    def __own_words(self):
+        """ replaces the shared words with a copy of this Markov, before changing them """
+        if self.shared:
+            self.markovwords = load_words(self.wordfilepath)
+            self.shared = False
+        return self.markovwords
 
     def get_info(self):
         return "[path: " + self.wordfilepath + ", count: " + str(len(self.markovwords)) + "]"
@@ -45,6 +63,9 @@ class Markov:
         with io.open(path, 'w+', encoding='utf8') as file:
             file.write(json.dumps(self.markovwords, indent=2, ensure_ascii=False))
             file.close()
+        if os.path.abspath(path) == os.path.abspath(self.wordfilepath):
+            # the shared words are outdated now, the next Markov reads the saved file
+            registry.remove(self.__key())
 
     def add_file(self, filename, filetype="LOG"):
         """
@@ -69,6 +90,7 @@ class Markov:
         words = line.replace('\n', '').replace('\r', '').replace('\t', '').split()
         if len(words) < 2:
             return
+        self.__own_words()
         # forwards chain probs
         for i in range(0, len(words) - 1):
             wg = self.markovwords.get(words[i], Markov._get_word_template())
@@ -204,10 +226,11 @@ class Markov:
     def del_word(self, word):
         # does not prevent the word from appearing at start/end of a sentence, only to chain further
         if self.markovwords.get(word):
+            self.__own_words()
             del self.markovwords[word]
             return True
         return False
 
     def disable_word(self, word):
-        word_group = self.markovwords.get(word, False)
+        word_group = self.__own_words().get(word, False)
         word_group[WD] = True
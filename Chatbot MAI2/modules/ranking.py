@@ -0,0 +1,127 @@
+import heapq
+import persistent
+import BTrees.LLBTree
+import BTrees.LOBTree
+import BTrees.OOBTree
+from modules.commits import commit
+from modules.types import PointType
+from modules.utils import get_logger, get_lock
+
+logger = get_logger('ranking')
+lock = get_lock('ranking')
+
+
+class RankingIndex(persistent.Persistent):
+    """
+    Chat entity ids ordered by their points, one index per point type (None is the point sum),
+    separately for players and channels. For every index a tree points -> ids, and points -> number of ids,
+    so top/bottom k and ranks never need to load the entities.
+    """
+
+    def __init__(self):
+        super(RankingIndex, self).__init__()
+        self.ids = BTrees.OOBTree.OOBTree()     # (is_channel, type key) -> LOBTree {points: OOTreeSet of ids}
+        self.counts = BTrees.OOBTree.OOBTree()  # (is_channel, type key) -> LLBTree {points: number of ids}
+        logger.info('Created new RankingIndex')
+
+    def reset(self):
+        with lock:
+            self.ids.clear()
+            self.counts.clear()
+            self.save()
+            logger.info('Reset RankingIndex')
+
+    def save(self):
+        with lock:
+            self._p_changed = True
+            commit()
+
+    @staticmethod
+    def __key(is_channel: bool, type_: PointType=None) -> tuple:
+        return is_channel, 'sum' if type_ is None else type_.value
+
+    def __trees(self, key: tuple) -> (BTrees.LOBTree.LOBTree, BTrees.LLBTree.LLBTree):
+        ids = self.ids.get(key)
+        if ids is None:
+            ids = self.ids[key] = BTrees.LOBTree.LOBTree()
+            self.counts[key] = BTrees.LLBTree.LLBTree()
+        return ids, self.counts[key]
+
+    def __remove(self, key: tuple, id_: str, points: int):
+        ids, counts = self.__trees(key)
+        group = ids.get(points)
+        if group is None or id_ not in group:
+            return
+        group.remove(id_)
+        if len(group) == 0:
+            del ids[points]
+            del counts[points]
+        else:
+            counts[points] -= 1
+
+    def __add(self, key: tuple, id_: str, points: int):
+        ids, counts = self.__trees(key)
+        group = ids.get(points)
+        if group is None:
+            group = ids[points] = BTrees.OOBTree.OOTreeSet()
+        if group.insert(id_):
+            counts[points] = counts.get(points, 0) + 1
+
+    def update(self, id_: str, is_channel: bool, type_: PointType, old_points: int, new_points: int):
+        """ move an entity from old to new points, does not commit """
+        if old_points == new_points:
+            return
+        with lock:
+            key = self.__key(is_channel, type_)
+            self.__remove(key, id_, int(old_points))
+            self.__add(key, id_, int(new_points))
+
+    def add_entity(self, entity):
+        """ add an entity to all indexes, with its current points, does not commit """
+        with lock:
+            for type_ in [None] + list(PointType):
+                self.__add(self.__key(entity.is_channel, type_), entity.id, int(entity.get_points(type_)))
+
+    def rebuild(self, entities):
+        with lock:
+            self.ids.clear()
+            self.counts.clear()
+            for entity in entities:
+                self.add_entity(entity)
+            self.save()
+            logger.info('Rebuilt RankingIndex')
+
+    def __iter_ids(self, key: tuple, largest=True):
+        """ yields (points, id) in order, loading only the buckets needed """
+        ids = self.ids.get(key)
+        if ids is None or len(ids) == 0:
+            return
+        if not largest:
+            for points, group in ids.items():
+                for id_ in group:
+                    yield points, id_
+            return
+        points = ids.maxKey()
+        while True:
+            for id_ in ids[points]:
+                yield points, id_
+            try:
+                points = ids.maxKey(points - 1)
+            except ValueError:
+                return
+
+    def get_k(self, k=5, largest=True, incl_players=True, incl_channels=True, point_type: PointType=None) -> list:
+        """ ids of the top (or bottom) k entities """
+        with lock:
+            iterators = [self.__iter_ids(self.__key(is_channel, point_type), largest=largest)
+                         for is_channel, included in [(False, incl_players), (True, incl_channels)] if included]
+            merged = heapq.merge(*iterators, key=lambda p_id: p_id[0], reverse=largest)
+            return [id_ for _, (_, id_) in zip(range(k), merged)]
+
+    def get_rank(self, id_: str, is_channel: bool, points: int, point_type: PointType=None) -> int:
+        """ 1 + how many entities (of the same kind) have more points """
+        with lock:
+            counts = self.counts.get(self.__key(is_channel, point_type))
+            if counts is None:
+                return 1
+            return 1 + sum(counts.values(min=int(points), excludemin=True))
@@ -1,28 +1,66 @@
 import time
 import persistent.dict
 import persistent.list
-import transaction
+from botcore.ratelimit import Cooldowns
+from modules.commits import commit
 from modules.utils import get_logger, get_lock
 
 logger = get_logger('spam_protect')
 lock = get_lock('spam_protect')
 
 
+class TimestampTable(Cooldowns):
+    """
+    When commands were used last, by (channel, cmd), shared by all threads and only kept in memory.
+    Entries older than the longest cooldown are useless, they are dropped whenever the table doubled in size.
+    """
+
+    def __init__(self, min_sweep_size=1000):
+        super(TimestampTable, self).__init__(min_sweep_size=min_sweep_size)
+        self.flushed = time.time()
+
+    def items(self, max_age: float) -> dict:
+        """ not expired entries, as {channel: {cmd: time}} """
+        with self.lock:
+            self._sweep(max_age)
+            by_channel = {}
+            for (channel, cmd), t in self.times.items():
+                by_channel.setdefault(channel, {})[cmd] = t
+            return by_channel
+
+    def load(self, by_channel: dict):
+        with self.lock:
+            for channel, cmds in by_channel.items():
+                for cmd, t in cmds.items():
+                    self.times[(channel, cmd)] = max(t, self.times.get((channel, cmd), 0))
+
+
+timestamps = TimestampTable()
+
+
 class SpamProtect(persistent.Persistent):
+    """
+    Command cooldowns per channel. The timestamps live in memory (see TimestampTable), checking or refreshing
+    a cooldown does not commit. They are stored in self.channels every flush_interval seconds (0 = never),
+    and loaded from there again on start.
+    """
+
     def __init__(self):
         """ prefer stored protected_channels and new timer/default_cd """
-        self.channels = persistent.dict.PersistentDict()            # store of when commands were used last
+        self.channels = persistent.dict.PersistentDict()            # stored copy of when commands were used last
         self.timer = persistent.dict.PersistentDict()               # store of command dependent cooldowns
         self.protected_channels = persistent.list.PersistentList()  # which channels are protected
 
         # vars
         self.default_cd = 60
+        self.flush_interval = 600
 
         logger.info('Created new SpamProtect, watches over: %s' % str(self.protected_channels))
 
     def reset(self):
         with lock:
             self.channels.clear()
+            timestamps.clear()
             self.timer.clear()
             # self.protected_channels.clear()
             self.save()
@@ -32,14 +70,16 @@ class SpamProtect(persistent.Persistent):
         """ to migrate the db when new class elements are added - call self.save() if you do """
         with lock:
             # self.x = self.__dict__.get('x', 'oh a new self.x!')
-            pass
+            self.flush_interval = self.__dict__.get('flush_interval', 600)
+            timestamps.load(self.channels)
 
-    def update_vars(self, default_cd=None, **_):
+    def update_vars(self, default_cd=None, flush_interval=None, **_):
         # function to set misc vars
         with lock:
             self.default_cd = default_cd if default_cd is not None else self.default_cd
+            self.flush_interval = flush_interval if flush_interval is not None else self.flush_interval
             self.save()
-            logger.info('SpamProtect, updating defaultcd %s' % default_cd)
+            logger.info('SpamProtect, updating defaultcd %s, flush interval %s' % (default_cd, flush_interval))
 
     def update_timer(self, timer=None):
         with lock:
@@ -50,7 +90,7 @@ class SpamProtect(persistent.Persistent):
     def save(self):
         with lock:
             self._p_changed = True
-            transaction.commit()
+            commit()
 
     def print(self):
         with lock:
@@ -61,32 +101,33 @@ class SpamProtect(persistent.Persistent):
             return channel in self.channels
 
     def get_remaining(self, channel: str, cmd: str, include_unprotected=False) -> float:
-        with lock:
-            logger.debug('Spamprotect: get remaining: %s, %s, %s' % (channel, cmd, include_unprotected))
-            if channel not in self.channels.keys():
-                self.channels[channel] = persistent.dict.PersistentDict()
-            if channel in self.protected_channels or include_unprotected:
-                logger.debug('Spamprotect: xxxxx %s' % self.timer.get(cmd, self.default_cd))
-                logger.debug('Spamprotect: xxxxx %s' % self.timer)
-                logger.debug('Spamprotect: xxxxx %s' % self.default_cd)
-                return (self.channels[channel].get(cmd, 0) + self.timer.get(cmd, self.default_cd)) - time.time()
-            return 0.0
+        if channel in self.protected_channels or include_unprotected:
+            return (timestamps.get((channel, cmd)) + self.timer.get(cmd, self.default_cd)) - time.time()
+        return 0.0
 
     def set_now(self, channel: str, cmd: str):
-        with lock:
-            if channel not in self.channels.keys():
-                self.channels[channel] = persistent.dict.PersistentDict()
-            self.channels[channel][cmd] = time.time()
-            logger.debug('Spamprotect: set to now: %s, %s' % (channel, cmd))
-            transaction.commit()
+        timestamps.set((channel, cmd), time.time(), max_age=self.max_cd())
+        logger.debug('Spamprotect: set to now: %s, %s' % (channel, cmd))
+        if 0 < self.flush_interval <= time.time() - timestamps.flushed:
+            self.flush()
 
     def is_spam(self, channel: str, cmd: str, update=True, include_unprotected=False) -> (bool, float):
+        rem_time = self.get_remaining(channel, cmd, include_unprotected)
+        logger.debug('Spamprotect: time left: %s, %s, %s' % (channel, cmd, rem_time))
+        if update and rem_time <= 0:
+            self.set_now(channel, cmd)
+        return rem_time > 0, rem_time
+
+    def max_cd(self) -> float:
+        return max([self.default_cd] + list(self.timer.values()))
+
+    def flush(self):
+        """ store the current cooldowns, so they survive a restart """
         with lock:
-            rem_time = self.get_remaining(channel, cmd, include_unprotected)
-            logger.debug('Spamprotect: time left: %s, %s, %s' % (channel, cmd, rem_time))
-            if update and rem_time <= 0:
-                self.set_now(channel, cmd)
-            return rem_time > 0, rem_time
+            self.channels = persistent.dict.PersistentDict(timestamps.items(max_age=self.max_cd()))
+            timestamps.flushed = time.time()
+            self.save()
+            logger.debug('Spamprotect: stored %d cooldowns' % len(self.channels))
 
     def get_protected_channel(self) -> str:
         return 'List of accepted channels: %s' % ', '.join(self.protected_channels)
@@ -51,6 +51,7 @@ class CommandType(enum.Enum):
     ADMINIGNORE = 'adminignore'
     ADMINCHANNELS = 'adminchannels'
     ADMINRESET = 'adminreset'
+    ADMINDB = 'admindb'
 
     @staticmethod
     def from_str(str_):
@@ -72,6 +73,7 @@ class EventType(enum.Enum):
     COMMAND = 'command'
     CHATTIP = 'chattip'
     ROULETTEGAME = 'roulette'
+    MARKETREFILL = 'marketrefill'
 
     @staticmethod
     def from_str(str_):
@@ -83,6 +85,7 @@ class EventType(enum.Enum):
         return {
             'tip': EventType.CHATTIP,
             'chatroulette': EventType.ROULETTEGAME,
+            'refill': EventType.MARKETREFILL,
         }.get(str_.lower(), None)
 
 
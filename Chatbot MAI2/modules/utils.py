@@ -1,6 +1,7 @@
+import contextlib
 import logging
-import threading
 from modules.types import ChatType
+from botcore.metrics import metrics
 
 
 LEVEL_TO_POINTS = [0, 50]  # to be filled
@@ -26,9 +27,14 @@ def get_logger(name='bot', level='info'):
 
 
 def get_lock(name='lock'):
+    """
+    Every thread uses its own db connection, so persistent objects are never shared between threads
+    and concurrent changes are resolved by commits.atomic. The named locks are no-ops now,
+    they only record the time spent in them (see !stats).
+    """
     if name in locks:
         return locks.get(name)
-    locks[name] = threading.RLock()
+    locks[name] = metrics.instrument_lock(contextlib.nullcontext(), name)
     return locks.get(name)
 
 
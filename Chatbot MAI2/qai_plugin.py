@@ -11,7 +11,7 @@ import shutil
 import ZODB
 import ZODB.FileStorage
 
-from decorators import nickserv_identified
+from decorators import nickserv_identified, admin_nicks
 from modules.timer import SpamProtect
 from modules.chatbase import Chatbase
 from modules.eventbase import Eventbase
@@ -19,18 +19,22 @@ from modules.effectbase import EffectBase
 from modules.gamebase import Gamebase
 from modules.itembase import ItemBase
 from modules.callbackqueue import CallbackQueue, CallbackQueueWorkerThread
+from modules.commits import chat_commits
+from modules.maintenance import DBMaintenance
+from modules.backup import IncrementalBackup
 from modules.types import *
 from modules.utils import get_logger, level_to_points, try_fun, set_msg_fun
 from modules.markov import Markov
+from botcore.identify import NickServIdentification
+from botcore.metrics import metrics
+from botcore.storage import BatchedDb
+from botcore.utils import is_in_channel
 
 logger = get_logger('main')
 
 ADMINS = []  # only required until commands are available to the public
 MAIN_CHANNEL = '#aeolus'
 
-NICKSERV_WAIT_TICKS = 200
-NICKSERVIDENTIFIEDRESPONSES = {}
-NICKSERVRESPONSESLOCK = None
 
 
 @irc3.extend
@@ -55,14 +59,18 @@ class Plugin(object):
 
     requires = [
         'irc3.plugins.userlist',
+        'botcore.identify',
+        'botcore.metrics',
     ]
 
     def __init__(self, bot):
-        # TODO run connection.cacheMinimize() every once in a while
         self.bot = bot
+        self.batched_db = BatchedDb.of(bot, delay=bot.config.get('db_save_delay', 5))
         self.loop = asyncio.new_event_loop()
         storage = ZODB.FileStorage.FileStorage(self.bot.config['chat_db'])
-        self.db = ZODB.DB(storage)
+        self.db = DBMaintenance.create_db(storage,
+                                          cache_size=self.bot.config.get('db_cache_size', 5000),
+                                          cache_size_bytes=self.bot.config.get('db_cache_size_bytes', 0))
         self.db_con = self.db.open()
         self.db_root = self.db_con.root
         set_msg_fun(ChatType.IRC, self.irc_message)
@@ -74,8 +82,6 @@ class Plugin(object):
         except:
             self.db_root.queue = CallbackQueue()
         self.db_root.queue.migrate()
-        self.queue_thread = CallbackQueueWorkerThread(self.db_root.queue)
-        self.queue_thread.start()
 
         try:
             self.db_root.effectbase.set(self.db_root.queue)
@@ -124,8 +130,38 @@ class Plugin(object):
         # markov chain generators
         self.markov_aeolus = Markov(self, self.bot.config.get('markov_aeolus', './data/misc/aeolus.json'))
 
+        # commit points of chat messages in batches
+        chat_commits.enable(self.bot.loop,
+                            max_updates=self.bot.config.get('chat_commit_batch_size', 100),
+                            max_delay_ms=self.bot.config.get('chat_commit_batch_ms', 2000))
+
+        # minimize the object cache, pack the storage
+        self.maintenance = DBMaintenance(self.db, self.db_con, self.bot.loop,
+                                         minimize_interval=self.bot.config.get('db_minimize_interval', 3600),
+                                         pack_interval=self.bot.config.get('db_pack_interval', 24),
+                                         pack_keep_days=self.bot.config.get('db_pack_keep_days', 7))
+        self.maintenance.start()
+
+        # incremental backups of the db file
+        self.backups = IncrementalBackup(self.bot.config['chat_db'],
+                                         '%sdb/' % self.bot.config.get('backups_path', './backups/'),
+                                         keep_count=self.bot.config.get('backup_keep_count', 5),
+                                         keep_days=self.bot.config.get('backup_keep_days', 30),
+                                         full_every=self.bot.config.get('backup_full_every', 50))
+
+        # works the queue with its own connection, start it once everything above is committed
+        chat_commits.flush()
+        self.db_root.queue.save()
+        self.queue_thread = CallbackQueueWorkerThread(self.db, self.bot.loop)
+        self.queue_thread.start()
+        self.maintenance.on_minimize.append(self.queue_thread.minimize)
+
     @classmethod
     def reload(cls, old):
+        old.db_root.spam_protect.flush()
+        chat_commits.flush()
+        old.maintenance.stop()
+        old.queue_thread.stop()
         return cls(old.bot)
 
     @irc3.event(irc3.rfc.CONNECTED)
@@ -143,7 +179,7 @@ class Plugin(object):
         if self.bot.config['nick'] in sender.nick:
             return
         if sender.startswith("NickServ!"):
-            self.__handle_nickserv_message(msg)
+            # handled by botcore.identify
             return
         self.db_root.chatbase.on_chat(msg, player_id(sender), sender.nick, channel_id=channel)
 
@@ -168,47 +204,18 @@ class Plugin(object):
 
     def __is_in_bot_channel(self, player):
         for channel in self.bot.channels:
-            if self.__is_in_channel(player, self.bot.channels[channel]):
+            if is_in_channel(self.bot, player, self.bot.channels[channel]):
                 return True, channel
         return False, None
 
-    @staticmethod
-    def __is_in_channel(player, channel):
-        if player in channel:
-            return True
-        return False
-
     async def __is_nick_serv_identified(self, nick):
-        self.bot.privmsg('nickserv', "status {}".format(nick))
-        global NICKSERV_WAIT_TICKS
-        remaining_tries = NICKSERV_WAIT_TICKS + 0
-        while remaining_tries > 0:
-            if NICKSERVIDENTIFIEDRESPONSES.get(nick):
-                value = NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVRESPONSESLOCK.acquire()
-                del NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVRESPONSESLOCK.release()
-                if int(value) == 3:
-                    return True
-                return False
-            remaining_tries -= 1
-            await asyncio.sleep(0.1)
-        return False
-
-    def __handle_nickserv_message(self, message):
-        message = " ".join(message.split())
-        NICKSERVRESPONSESLOCK.acquire()
-        if message.startswith('STATUS'):
-            words = message.split(" ")
-            NICKSERVIDENTIFIEDRESPONSES[words[1]] = words[2]
-        NICKSERVRESPONSESLOCK.release()
+        return await self.bot.get_plugin(NickServIdentification).is_identified(nick)
 
     def on_restart(self):
-        t0 = time.clock()
+        t0 = time.perf_counter()
 
         # TODO get rid of global vars
-        global NICKSERVRESPONSESLOCK, ADMINS
-        NICKSERVRESPONSESLOCK = threading.Lock()
+        global ADMINS
 
         # default vars for cooldowns, some costs, requirements  # TODO make command to modify
         for k, v in {
@@ -230,8 +237,7 @@ class Plugin(object):
         level_to_points(500)  # cache levels up to 500
 
         # get misc vars from db.json
-        ADMINS = [n.split('@')[0].replace('!', '').replace('*', '')
-                  for n, v in self.bot.config['irc3.plugins.command.masks'].items() if len(v) > 5]
+        ADMINS = admin_nicks(self.bot.config)
 
         # update stuff
         self.db_root.effectbase.update_effects_list(self.bot.config['effects_file'])
@@ -243,9 +249,12 @@ class Plugin(object):
         self.db_root.eventbase.update_vars(**vars_)
         self.db_root.gamebase.update_vars(**vars_)
         self.db_root.spam_protect.update_vars(**vars_)
+        self.db_root.spam_protect.update_vars(flush_interval=self.bot.config.get('spam_protect_flush_interval', 600))
 
         logger.info('Admins: %s' % str(ADMINS))
-        logger.info("Startup time: {t}".format(**{"t": format(time.clock() - t0, '.4f')}))
+        t1 = time.perf_counter()
+        metrics.observe('startup', '%s/on_restart' % self.bot.nick, t1 - t0)
+        logger.info("Startup time: {t}".format(**{"t": format(t1 - t0, '.4f')}))
 
     def pm(self, mask, target, message, action_=False, nowait=True):
         """ Fixes bot PMing itself instead of the user if privmsg is called by user in PM instead of a channel. """
@@ -271,11 +280,7 @@ class Plugin(object):
                 logger.warning('Failed sending IRC message! [%s] [%s]' % (str(e1), str(e2)))
 
     def is_in_channel(self, player, channel):
-        if isinstance(channel, str):
-            channel = self.bot.channels[channel]
-        if player in channel:
-            return True
-        return False
+        return is_in_channel(self.bot, player, channel)
 
     @command(permission='admin', show_in_help_list=False)
     @nickserv_identified
@@ -620,30 +625,102 @@ class Plugin(object):
             self.db_root.itembase.update_markets(self.bot.config['markets_file'])
         self.db_root.eventbase.add_command_event(CommandType.RELOAD, by_=player_id(mask), target=target, args=args)
 
-    def backup(self, name='backup', keep=3):
-        data_path = '/'.join(self.bot.config.get('chat_db', './data/chat/data.fs').split('/')[:-1])
+    def backup(self, name='backup', keep=3, full=False, on_done=None) -> bool:
+        """ copies the small files of the data dir, the db file is backed up incrementally in the background """
+        if self.backups.is_running():
+            return False
+        db_path = self.bot.config.get('chat_db', './data/chat/data.fs')
+        db_name = db_path.split('/')[-1]
+        data_path = '/'.join(db_path.split('/')[:-1])
         backup_dir = '%s%s/' % (self.bot.config.get('backups_path', './backups/'), name)
         backup_path = '%s%s/' % (backup_dir, str(int(time.time())))
         logger.info('Backup from "%s" to "%s"' % (data_path, backup_path))
         self.__db_save()
-        shutil.copytree(data_path, backup_path, ignore=lambda _, names: [n for n in names if n.endswith('.lock')])
+        self.db_root.spam_protect.flush()
+        chat_commits.flush()
+        shutil.copytree(data_path, backup_path, ignore=lambda _, names: [n for n in names
+                                                                        if n.endswith('.lock') or n.startswith(db_name)])
         all_relevant_backups = [d[0] for d in os.walk(backup_dir)]
         for i in range(1, len(all_relevant_backups) - keep):
             shutil.rmtree(all_relevant_backups[i])
+        # only what is committed right now, even if things change while the backup runs
+        return self.backups.start(name, full=full, stop=self.db.lastTransaction(), on_done=on_done)
 
     @command(permission='admin', public=False, show_in_help_list=False)
     @nickserv_identified
     async def adminbackup(self, mask, target, args):
-        """ Back up the db
+        """ Back up the db, only new transactions are copied unless full is given;
+            restore writes the backup made at or before <time> (unix time) to a new db file
 
-            %%adminbackup
+            %%adminbackup [full]
+            %%adminbackup list
+            %%adminbackup verify
+            %%adminbackup restore [<time>]
         """
         logger.info('%d, cmd %s, %s, %s' % (time.time(), 'adminbackup', mask.nick, target))
-        self.backup('manually', keep=5)
-        self.pm(mask, target, 'Backed up the db')
+        t = try_fun(float, None, args.get('<time>'))
+
+        def reply(msg):
+            self.bot.loop.call_soon_threadsafe(self.pm, mask, mask.nick, msg)
+
+        def on_backup_done(result):
+            if isinstance(result, Exception):
+                reply('Backup failed: %s' % str(result))
+            else:
+                reply('Backed up the db: %s' % result['file'])
+
+        def verify():
+            try:
+                reply(self.backups.verify(t))
+            except Exception as e:
+                reply('Verification failed: %s' % str(e))
+
+        def restore():
+            target_path = '%srestored/%d/%s' % (self.bot.config.get('backups_path', './backups/'), time.time(),
+                                                self.bot.config['chat_db'].split('/')[-1])
+            try:
+                reply('Restored to %s, stop the bot and use it as chat_db' % self.backups.restore(target_path, t))
+            except Exception as e:
+                reply('Restore failed: %s' % str(e))
+
+        if args.get('list'):
+            for line in self.backups.list_str() or ['No backups yet']:
+                self.pm(mask, mask.nick, line)
+        elif args.get('verify'):
+            threading.Thread(target=verify, daemon=True).start()
+        elif args.get('restore'):
+            threading.Thread(target=restore, daemon=True).start()
+        elif not self.backup('manually', keep=5, full=args.get('full', False), on_done=on_backup_done):
+            self.pm(mask, mask.nick, 'A backup is already running')
         self.db_root.eventbase.add_command_event(CommandType.ADMINBACKUP, by_=player_id(mask),
                                                  target=target, args=args)
 
+    @command(permission='admin', public=False, show_in_help_list=False)
+    @nickserv_identified
+    async def admindb(self, mask, target, args):
+        """ Database maintenance
+
+            %%admindb stats
+            %%admindb pack [<days>]
+            %%admindb minimize
+        """
+        logger.info('%d, cmd %s, %s, %s' % (time.time(), 'admindb', mask.nick, target))
+        if args.get('pack'):
+            days = try_fun(float, None, args.get('<days>'))
+            chat_commits.flush()
+            if self.maintenance.pack(keep_days=days):
+                self.pm(mask, mask.nick, 'Packing the db in the background')
+            else:
+                self.pm(mask, mask.nick, 'The db is already being packed')
+        if args.get('minimize'):
+            self.maintenance.minimize()
+            self.pm(mask, mask.nick, 'Minimized the object cache (the queue worker minimizes its own soon)')
+        if args.get('stats'):
+            for line in self.maintenance.stats_str() + [self.queue_thread.stats_str()]:
+                self.pm(mask, mask.nick, line)
+        self.db_root.eventbase.add_command_event(CommandType.ADMINDB, by_=player_id(mask),
+                                                 target=target, args=args)
+
     @command(permission='admin', public=False, show_in_help_list=False)
     @nickserv_identified
     async def admineffects(self, mask, target, args):
@@ -747,16 +824,25 @@ class Plugin(object):
         chat = args.get('chat', False)
         self.db_root.eventbase.add_command_event(CommandType.ADMINRESET, by_=player_id(mask),
                                                  target=target, args=args)
-        self.reset(name='manually_reset', all_=all_, games=games, events=events, chat=chat)
-        self.pm(mask, mask.nick, "RESET STUFF")
-
-    def reset(self, name='reset', all_=False, games=False, events=False, chat=False):
+        if self.reset(name='manually_reset', all_=all_, games=games, events=events, chat=chat):
+            self.pm(mask, mask.nick, "RESET STUFF")
+        else:
+            self.pm(mask, mask.nick, "A backup is already running, try resetting again once it is done")
+
+    def reset(self, name='reset', all_=False, games=False, events=False, chat=False) -> bool:
+        """ backs up and resets, nothing is reset (False) if the backup can not be started """
+        # the backup copies what is committed when it starts, the reset does not change it anymore
+        if not self.backup(name):
+            logger.warning('Not resetting, a backup is already running')
+            return False
         epoch = self.__db_get(['chatlvlmisc', 'epoch'])
         self.__db_add(['chatlvlmisc'], 'epoch', epoch+1, overwrite_if_exists=True, save=True)
         logger.info('-'*100)
-        self.backup(name)
         if all_:
             self.db_root.queue.reset()
+            # the jobs of these were in the queue
+            self.db_root.effectbase.reset()
+            self.db_root.itembase.reset_ticks()
             self.db_root.spam_protect.reset()
         if all_ or chat:
             self.db_root.chatbase.reset()
@@ -765,6 +851,7 @@ class Plugin(object):
         if all_ or games:
             self.db_root.gamebase.reset()
         self.on_restart()
+        return True
 
     @command(permission='admin', public=False)
     async def hidden(self, mask, target, args):
@@ -773,48 +860,21 @@ class Plugin(object):
             %%hidden
         """
         logger.debug('%d, cmd %s, %s, %s' % (time.time(), 'hidden', mask.nick, target))
-        words = ["join", "leave", "cd", "reload", "adminbackup", "admineffects", "adminignore", "adminchannels",
-                 "adminreset", "test"]
+        words = ["join", "leave", "cd", "reload", "adminbackup", "admindb", "admineffects", "adminignore",
+                 "adminchannels", "adminreset", "test"]
         self.bot.privmsg(mask.nick, "Hidden commands (!help <command> for more info):")
         self.bot.privmsg(mask.nick, ", ".join(words))
         self.db_root.eventbase.add_command_event(CommandType.HIDDEN, by_=player_id(mask), target=target, args=args)
 
     def __db_add(self, path, key, value, overwrite_if_exists=True, try_saving_with_new_key=False, save=True):
-        cur = self.bot.db
-        for p in path:
-            if p not in cur:
-                cur[p] = {}
-            cur = cur[p]
-        exists, added_with_new_key = cur.get(key), False
-        if overwrite_if_exists:
-            cur[key] = value
-        elif not exists:
-            cur[key] = value
-        elif exists and try_saving_with_new_key:
-            for i in range(0, 1000):
-                if not cur.get(key + str(i)):
-                    cur[key + str(i)] = value
-                    added_with_new_key = True
-                    break
-        if save:
-            self.__db_save()
-        return cur, exists, added_with_new_key
+        return self.batched_db.add(path, key, value, overwrite=overwrite_if_exists, try_new_key=try_saving_with_new_key,
+                                   save=save)
 
     def __db_del(self, path, key, save=True):
-        cur = self.bot.db
-        for p in path:
-            cur = cur.get(p, {})
-        if not cur.get(key) is None:
-            del cur[key]
-            if save:
-                self.__db_save()
-        return cur
+        return self.batched_db.delete(path, key, save=save)
 
     def __db_get(self, path):
-        reply = self.bot.db
-        for p in path:
-            reply = reply.get(p, {})
-        return reply
+        return self.batched_db.get(path)
 
     def __db_save(self):
-        self.bot.db.set('misc', lastSaved=time.time())
+        self.batched_db.flush()
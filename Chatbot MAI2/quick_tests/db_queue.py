@@ -2,6 +2,8 @@ from modules.callbackitem import CallbackItem
 from modules.callbackqueue import CallbackQueue, CallbackQueueWorkerThread
 import ZODB
 import ZODB.FileStorage
+import asyncio
+import threading
 import os
 import time
 import random
@@ -20,7 +22,11 @@ class X:
         except:
             self.db_root.callbackqueue = CallbackQueue()
             self.db_root.callbackqueue.print()
-        self.worker = CallbackQueueWorkerThread(self.db_root.callbackqueue)
+        self.db_root.callbackqueue.migrate()
+        self.db_root.callbackqueue.save()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.worker = CallbackQueueWorkerThread(self.db, self.loop, root_name='callbackqueue')
         self.worker.start()
 
     def stop(self):
@@ -0,0 +1,219 @@
+import collections
+import random
+import time
+
+
+# ban/pick order of a draft for a best of, the captains take turns starting with the first one.
+# The draft starts with one map more than there are turns, the map that is left is the decider.
+DRAFTORDERS = {
+    1: 'bbbbbb',
+    3: 'bbppbb',
+    5: 'bbpppp',
+}
+
+
+def mapWeight(value):
+    """
+    Weight of a map as stored in a list, True (the default when adding maps) counts as 1
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 1.0 if value else 0.0
+    return max(float(value), 0.0)
+
+
+class fenwickTree():
+    """
+    Prefix sums of weights, changing a weight and finding the index of a prefix sum take O(log n)
+    """
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = [float(w) for w in weights]
+        self.tree = [0.0] + self.weights
+        for i in range(1, self.size + 1):
+            j = i + (i & -i)
+            if j <= self.size:
+                self.tree[j] += self.tree[i]
+        self.step = 1
+        while self.step * 2 <= self.size:
+            self.step *= 2
+
+    def set(self, index, weight):
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        total, i = 0.0, self.size
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value):
+        """
+        The index whose weight covers value, value in [0, total)
+        """
+        pos, step = 0, self.step
+        while step > 0:
+            if pos + step <= self.size and self.tree[pos + step] <= value:
+                pos += step
+                value -= self.tree[pos]
+            step //= 2
+        if pos >= self.size or self.weights[pos] <= 0:
+            # rounding errors at the end of the range, take the closest map that can be chosen
+            candidates = [i for i in range(self.size) if self.weights[i] > 0]
+            return min(candidates, key=lambda i: abs(i - pos))
+        return pos
+
+
+class mapPool():
+    """
+    The maps of a list and their weights, built once per list and reused until the list changes
+    """
+
+    def __init__(self, maps):
+        self.names = list(maps.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.tree = fenwickTree([mapWeight(maps[name]) for name in self.names])
+        self.available = len([w for w in self.tree.weights if w > 0])
+
+    def __len__(self):
+        return self.available
+
+    def sample(self, amount, exclude=()):
+        """
+        Up to <amount> different maps, chosen by weight. The maps in exclude (oldest first) are only chosen
+        if there are too few others, the oldest ones for the missing picks.
+        Takes O(amount * log n), chosen and excluded maps are removed from the tree and put back afterwards.
+        """
+        removed, picks = [], []
+        try:
+            excluded = []  # most recent first
+            for name in reversed(exclude):
+                i = self.index.get(name, None)
+                if i is not None and self.tree.weights[i] > 0:
+                    excluded.append((i, self.tree.weights[i]))
+                    self.tree.set(i, 0.0)
+            removed.extend(excluded)
+            for _ in range(min(amount, self.available - len(excluded))):
+                i = self.tree.find(random.random() * self.tree.total())
+                picks.append(self.names[i])
+                removed.append((i, self.tree.weights[i]))
+                self.tree.set(i, 0.0)
+            missing = min(amount, self.available) - len(picks)
+            for i, _ in excluded[::-1][:missing]:
+                picks.append(self.names[i])
+        finally:
+            for i, weight in reversed(removed):
+                self.tree.set(i, weight)
+        return picks
+
+
+class mapPools():
+    """
+    The mapPool of every list, and the maps that were played recently in every list
+    """
+
+    def __init__(self, recentWindow=0):
+        self.pools = {}
+        self.recent = {}
+        self.recentWindow = recentWindow
+
+    def get(self, listname, maps):
+        pool = self.pools.get(listname, None)
+        if pool is None:
+            pool = self.pools[listname] = mapPool(maps)
+        return pool
+
+    def forget(self, listname):
+        """
+        Call when the maps of a list changed
+        """
+        self.pools.pop(listname, None)
+
+    def rename(self, listname, newlistname):
+        self.pools.pop(listname, None)
+        recent = self.recent.pop(listname, None)
+        if recent is not None:
+            self.recent[newlistname] = recent
+
+    def remove(self, listname):
+        self.pools.pop(listname, None)
+        self.recent.pop(listname, None)
+
+    def played(self, listname, names):
+        if self.recentWindow <= 0:
+            return
+        recent = self.recent.get(listname, None)
+        if recent is None or recent.maxlen != self.recentWindow:
+            recent = self.recent[listname] = collections.deque(recent or [], maxlen=self.recentWindow)
+        recent.extend(names)
+
+    def choose(self, listname, maps, amount, remember=True):
+        picks = self.get(listname, maps).sample(amount, exclude=self.recent.get(listname, ()))
+        if remember:
+            self.played(listname, picks)
+        return picks
+
+
+class mapDraft():
+    """
+    Two captains ban and pick maps in turns, see DRAFTORDERS
+    """
+
+    def __init__(self, listname, maps, captains, order):
+        self.listname = listname
+        self.remaining = list(maps)
+        self.captains = list(captains)
+        self.order = order
+        self.turn = 0
+        self.picks = []
+        self.bans = []
+        self.started = time.time()
+
+    @property
+    def done(self):
+        return self.turn >= len(self.order)
+
+    def captain(self):
+        return self.captains[self.turn % 2]
+
+    def action(self):
+        if self.done:
+            return None
+        return 'pick' if self.order[self.turn] == 'p' else 'ban'
+
+    def result(self):
+        """
+        The picked maps and the decider
+        """
+        return self.picks + self.remaining
+
+    def findMap(self, mapname):
+        lower = mapname.lower()
+        for name in self.remaining:
+            if name.lower() == lower:
+                return name
+        return None
+
+    def act(self, nick, action, mapname):
+        """
+        Returns an error message, or None if the ban/pick was done
+        """
+        if self.done:
+            return "The draft is over."
+        if nick.lower() != self.captain().lower():
+            return "It is not your turn, " + nick + "."
+        if action != self.action():
+            return "It is time to " + self.action() + ", not to " + action + "."
+        name = self.findMap(mapname)
+        if name is None:
+            return "There is no such map left to " + action + "."
+        self.remaining.remove(name)
+        (self.picks if action == 'pick' else self.bans).append(name)
+        self.turn += 1
+        return None
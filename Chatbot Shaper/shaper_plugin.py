@@ -4,11 +4,22 @@ import numpy as np
 import asyncio
 import irc3
 from irc3.plugins.command import command
+import json
+import os
+import re
+import sys
 import time
-import threading
 
-NICKSERVIDENTIFIEDRESPONSES = {}
-NICKSERVIDENTIFIEDRESPONSESLOCK = None
+if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from botcore.identify import NickServIdentification
+from botcore.ratelimit import Cooldowns
+from botcore.storage import BatchedDb, manage_list
+from botcore.utils import is_in_channel, filter_in_channel, pack_lines
+from mappool import mapPools, mapDraft, mapWeight, DRAFTORDERS
+
+
+MAPLIST_MAX_FILE_SIZE = 1024 * 1024
 
 
 @irc3.extend
@@ -19,15 +30,18 @@ def action(bot, *args):
 class Plugin(object):
 
     requires = [
-        'irc3.plugins.userlist'
+        'irc3.plugins.userlist',
+        'botcore.identify',
+        'botcore.metrics',
     ]
 
     def __init__(self, bot):
         self.bot = bot
-        self.timers = {}
+        self.cooldowns = Cooldowns(max_age=self.__maxCooldown)
+        self.Db = BatchedDb.of(bot, delay=bot.config.get('db_save_delay', 5))
         self._rage = {}
-        global NICKSERVIDENTIFIEDRESPONSESLOCK
-        NICKSERVIDENTIFIEDRESPONSESLOCK = threading.Lock()
+        self.mapPools = mapPools(recentWindow=int(bot.config.get('recent_maps', 0)))
+        self.drafts = {}
 
     @classmethod
     def reload(cls, old):
@@ -52,7 +66,8 @@ class Plugin(object):
             return
 
         if sender.startswith("NickServ!"):
-            self.__handleNickservMessage(msg)
+            # handled by botcore.identify
+            return
 
     @command(permission='admin')
     @asyncio.coroutine
@@ -111,71 +126,36 @@ class Plugin(object):
                 self.__dbAdd(['maplists'], listname, {'owner' : ownername,
                                                       'admins' : {},
                                                       'maps' : {}})
+                self.mapPools.remove(listname)
                 return "I have done as you wished. The realm is created, and is given to " + ownername + "."
         if delete:
             if not exists:
                 return "I can not delete what is not there."
             self.__dbDel(['maplists'], listname)
+            self.mapPools.remove(listname)
             return "As you wished, the realm was destroyed."
 
     def spam_protect(self, cmd, mask, target, args, specialSpamProtect=None):
-        if not cmd in self.timers:
-            self.timers[cmd] = {}
-        if not target in self.timers[cmd]:
-            self.timers[cmd][target] = 0
         spamProtectTimer = specialSpamProtect or 'spamprotect'
-        remTime = self.bot.config[spamProtectTimer] - (time.time() - self.timers[cmd][target])
+        remTime = self.cooldowns.check((cmd, target), self.bot.config[spamProtectTimer])
         if remTime > 0:
             self.bot.privmsg(mask.nick, "Wait another " + str(int(remTime)) + " seconds before trying again.")
             return True
-        self.timers[cmd][target] = time.time()
         return False
 
-    def __handleNickservMessage(self, message):
-        if message.startswith('STATUS'):
-            words = message.split(" ")
-            global NICKSERVIDENTIFIEDRESPONSES, NICKSERVIDENTIFIEDRESPONSESLOCK
-            NICKSERVIDENTIFIEDRESPONSESLOCK.acquire()
-            NICKSERVIDENTIFIEDRESPONSES[words[1]] = words[2]
-            NICKSERVIDENTIFIEDRESPONSESLOCK.release()
+    def __maxCooldown(self):
+        # cooldowns older than this are over, see Cooldowns
+        return max([v for v in self.bot.config.values() if isinstance(v, (int, float))] + [3600])
 
     @asyncio.coroutine
     def __isNickservIdentified(self, nick):
-        self.bot.privmsg('nickserv', "status {}".format(nick))
-        remainingTries = 20
-        while remainingTries > 0:
-            if NICKSERVIDENTIFIEDRESPONSES.get(nick):
-                value = NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVIDENTIFIEDRESPONSESLOCK.acquire()
-                del NICKSERVIDENTIFIEDRESPONSES[nick]
-                NICKSERVIDENTIFIEDRESPONSESLOCK.release()
-                if int(value) == 3:
-                    return True
-                return False
-            remainingTries -= 1
-            yield from asyncio.sleep(0.1)
-        return False
+        return (yield from self.bot.get_plugin(NickServIdentification).is_identified(nick))
 
     def __isInChannel(self, player, channel):
-        if player in channel:
-            return True
-        return False
+        return is_in_channel(self.bot, player, channel)
 
     def __filterForPlayersInChannel(self, playerlist, channelname):
-        players = {}
-        if not channelname in self.bot.channels:
-            return players
-        channel = self.bot.channels[channelname]
-        for p in playerlist.keys():
-            if self.__isInChannel(p, channel):
-                players[p] = True
-        return players
-
-    def __getNextDictIncremental(self, dict):
-        for i in range(0, 99999999):
-            if not dict.get(str(i), False):
-                return str(i)
-        return "-1"
+        return filter_in_channel(self.bot, playerlist.keys(), channelname)
 
     @command(permission='admin', public=False)
     @asyncio.coroutine
@@ -189,15 +169,6 @@ class Plugin(object):
         """
         return self.__genericCommandManage(mask, target, args, ['quotes'])
 
-    def __getRandomDictKeys(self, dict, amount):
-        """
-        Returns a list of <amount> random elements, a maximum number depending on <amount> and dict size.
-        """
-        amount = min([len(dict), amount])
-        keys = [key for key in dict.keys()]
-        perm = np.random.permutation(keys)
-        return [perm[i] for i in range(0, amount)]
-
     def __getRandomDictElements(self, dict, amount):
         """
         Returns a list of <amount> random elements, a maximum number depending on <amount> and dict size.
@@ -220,7 +191,7 @@ class Plugin(object):
         list, exists = self.__getList(listname)
         if exists:
             maps = list.get('maps', {})
-            return self.__getRandomDictKeys(maps, amount)
+            return self.mapPools.choose(listname, maps, amount)
         return False
 
     @command
@@ -265,6 +236,63 @@ class Plugin(object):
         if maps:
             self.bot.privmsg(target, "I have chosen: " + ", ".join(maps))
 
+    @command
+    @asyncio.coroutine
+    def draft(self, mask, target, args):
+        """Let two captains ban and pick maps of a list, for a best of 1, 3 or 5 (default 3)
+
+            %%draft start <listname> <captain1> <captain2> [<bestof>]
+            %%draft ban MAPNAME ...
+            %%draft pick MAPNAME ...
+            %%draft status
+            %%draft cancel
+        """
+        draft = self.drafts.get(target, None)
+        if draft is not None and time.time() - draft.started > self.bot.config.get('draft_timeout', 900):
+            del self.drafts[target]
+            draft = None
+        if args.get('start'):
+            if draft is not None:
+                return "A draft for " + draft.listname + " is already going on here."
+            if self.spam_protect('draft', mask, target, args):
+                return
+            listname, bestof = args.get('<listname>'), args.get('<bestof>') or '3'
+            order = DRAFTORDERS.get(int(bestof) if bestof.isdigit() else 0, None)
+            if order is None:
+                return "Only a best of " + ", ".join([str(k) for k in sorted(DRAFTORDERS.keys())]) + " can be drafted."
+            list, exists = self.__getList(listname)
+            if not exists:
+                return "Fool, there is no realm of such name. Insignificant."
+            maps = list.get('maps', {})
+            if len(self.mapPools.get(listname, maps)) < len(order) + 1:
+                return "This realm is too small for a draft, it needs " + str(len(order) + 1) + " maps."
+            maps = self.mapPools.choose(listname, maps, len(order) + 1, remember=False)
+            draft = self.drafts[target] = mapDraft(listname, maps, [args.get('<captain1>'), args.get('<captain2>')], order)
+            return "The draft begins, these maps are at stake: " + ", ".join(draft.remaining) + ". " + self.__draftTurn(draft)
+        if draft is None:
+            return "There is no draft going on here."
+        if args.get('cancel'):
+            if mask.nick.lower() not in [c.lower() for c in draft.captains] \
+                    and not self.__isListOwner(draft.listname, mask.nick) and not self.__isListAdmin(draft.listname, mask.nick):
+                return "Only the captains may end the draft."
+            del self.drafts[target]
+            return "The draft was abandoned."
+        if args.get('status'):
+            return "Maps left: " + ", ".join(draft.remaining) + ". " + self.__draftTurn(draft)
+        action = 'ban' if args.get('ban') else 'pick'
+        error = draft.act(mask.nick, action, " ".join(args.get('MAPNAME')))
+        if error:
+            return error
+        if not draft.done:
+            return "Maps left: " + ", ".join(draft.remaining) + ". " + self.__draftTurn(draft)
+        del self.drafts[target]
+        maps = draft.result()
+        self.mapPools.played(draft.listname, maps)
+        return "The draft is complete, the realm has chosen: " + ", ".join(maps)
+
+    def __draftTurn(self, draft):
+        return draft.captain() + ", it is your turn to " + draft.action() + "."
+
     @command
     @asyncio.coroutine
     def lists(self, mask, target, args):
@@ -299,7 +327,8 @@ class Plugin(object):
             self.bot.privmsg(mask.nick, "This realm has yet to take form.")
             return
         self.bot.privmsg(mask.nick, str(len(maps)) + " maps are found in this realm:")
-        self.bot.privmsg(mask.nick, ", ".join(maps))
+        for line in pack_lines(maps.keys()):
+            self.bot.privmsg(mask.nick, line)
 
     @command
     @asyncio.coroutine
@@ -340,7 +369,8 @@ class Plugin(object):
     @command(public=False)
     @asyncio.coroutine
     def list(self, mask, target, args):
-        """Manage a map list
+        """Manage a map list. Maps are separated by ", ". Files are in the maplist directory of the bot,
+        a .txt file has one map per line, a .json file is an exported list.
 
             %%--- Only owner: ---
             %%list rename <listname> <newlistname>
@@ -350,14 +380,18 @@ class Plugin(object):
             %%list map get <listname>
             %%list map add <listname> <mapnames> ...
             %%list map del <listname> <mapnames> ...
+            %%list map weight <listname> <weight> <mapnames> ...
             %%list admin add <listname> <playername>
             %%list admin del <listname> <playername>
+            %%list export <listname>
+            %%list import <listname> <filename>
         """
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
-        rename, delete, add, get, admin, map, listname, newlistname, playername, mapnames \
+        rename, delete, add, get, admin, map, weight, listname, newlistname, playername, mapnames \
             = args.get("rename"), args.get("del"), args.get("add"), args.get("get"), args.get("admin"), args.get("map"),\
-              args.get("<listname>"), args.get("<newlistname>"), args.get("<playername>"), " ".join(args.get("<mapnames>"))
+              args.get("weight"), args.get("<listname>"), args.get("<newlistname>"), args.get("<playername>"), " ".join(args.get("<mapnames>"))
+        export, import_, filename = args.get("export"), args.get("import"), args.get("<filename>")
         isOwner, isAdmin = self.__isListOwner(listname, mask.nick), self.__isListAdmin(listname, mask.nick)
 
         list, exists = self.__getList(listname)
@@ -369,22 +403,50 @@ class Plugin(object):
         if isOwner or isAdmin:
             if map:
                 if add:
-                    for name in maps:
-                        self.__dbAdd(['maplists', listname, 'maps'], name, True)
-                    return "Tried adding " + str(len(maps)) + " maps from your domain."
+                    added = self.__editMaps(listname, add={name: True for name in maps})
+                    return "Added " + str(added) + " of " + str(len(maps)) + " maps to your domain."
                 if delete:
-                    for name in maps:
-                        self.__dbDel(['maplists', listname, 'maps'], name)
-                    return "Tried removing " + str(len(maps)) + " maps from your domain."
+                    removed = self.__editMaps(listname, remove=maps)
+                    return "Removed " + str(removed) + " of " + str(len(maps)) + " maps from your domain."
+                if weight:
+                    try:
+                        value = float(args.get("<weight>"))
+                    except ValueError:
+                        return "A weight is a number, foolish mortal."
+                    if value < 0:
+                        return "A weight can not be negative."
+                    existing = self.__dbGet(['maplists', listname, 'maps'])
+                    maps = [name for name in maps if name in existing]
+                    self.__editMaps(listname, add={name: True if value == 1 else value for name in maps}, overwrite=True)
+                    return "The weight of " + str(len(maps)) + " maps in your domain is now " + str(value) + "."
                 if get:
-                    maps = self.__getMapsInList(listname)
+                    maps = self.__dbGet(['maplists', listname, 'maps'])
                     if len(maps) < 1:
                         return "This realm has yet to take form."
                     self.bot.privmsg(mask.nick, str(len(maps)) + " maps are found in this realm:")
-                    for map in maps:
-                        self.bot.privmsg(mask.nick, map)
+                    names = []
+                    for map, value in maps.items():
+                        if mapWeight(value) != 1:
+                            map += " (weight " + str(mapWeight(value)) + ")"
+                        names.append(map)
+                    for line in pack_lines(names):
+                        self.bot.privmsg(mask.nick, line)
                     return
 
+            if export:
+                path = self.__mapListFile(self.__fileName(listname) + '.json')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as fd:
+                    json.dump({'maps': self.__dbGet(['maplists', listname, 'maps'])}, fd, indent=2, sort_keys=True)
+                return "The realm was written down as " + os.path.basename(path) + "."
+
+            if import_:
+                maps, error = self.__readMapListFile(filename)
+                if error:
+                    return error
+                self.__editMaps(listname, add=maps, replace=True)
+                return "The realm now consists of the " + str(len(maps)) + " maps of " + filename + "."
+
             if admin:
                 if add:
                     self.__dbAdd(['maplists', listname, 'admins'], playername, True)
@@ -401,16 +463,67 @@ class Plugin(object):
                 _, newnameexists = self.__getList(newlistname)
                 if newnameexists:
                     return "This name is already occupied. You shall not disturb this realm with your lack of knowledge."
-                self.__dbAdd(['maplists'], newlistname, list.copy())
-                self.__dbDel(['maplists'], listname)
+                self.Db.rename(['maplists'], listname, newlistname)
+                self.mapPools.rename(listname, newlistname)
                 return "I have done as you requested."
 
             if delete:
                 self.__dbDel(['maplists'], listname)
+                self.mapPools.remove(listname)
                 return "It is done, the realm has vanished. Insignificant."
 
         return "You fool. This realm is not meant for you, and you shall not disturb it."
 
+    def __editMaps(self, listname, add=None, remove=(), overwrite=False, replace=False):
+        """
+        Applies all changes of one command to a copy of the maps of a list, which is then stored at once.
+        Returns the number of added (or changed) plus removed maps.
+        """
+        maps = {} if replace else dict(self.__dbGet(['maplists', listname, 'maps']))
+        changed = 0
+        for name, value in (add or {}).items():
+            if overwrite or name not in maps:
+                maps[name] = value
+                changed += 1
+        for name in remove:
+            if maps.pop(name, None) is not None:
+                changed += 1
+        self.__dbAdd(['maplists', listname], 'maps', maps)
+        self.mapPools.forget(listname)
+        return changed
+
+    def __fileName(self, name):
+        return re.sub(r'[^\w\-]', '_', name)
+
+    def __mapListFile(self, filename):
+        return os.path.join(os.path.abspath(self.bot.config.get('maplist_dir', 'maplists')), filename)
+
+    def __readMapListFile(self, filename):
+        """
+        Reads a map list file from the maplist directory, returns the maps and an error message
+        """
+        if not re.match(r'^[\w\-]+\.(txt|json)$', filename or ''):
+            return None, "Only the names of .txt or .json files in my library are accepted."
+        path = self.__mapListFile(filename)
+        if not os.path.isfile(path):
+            return None, "There is no such file in my library."
+        if os.path.getsize(path) > MAPLIST_MAX_FILE_SIZE:
+            return None, "This file is too large to be read."
+        try:
+            with open(path, encoding='utf-8') as fd:
+                if filename.endswith('.txt'):
+                    maps = {line.strip(): True for line in fd if line.strip()}
+                else:
+                    data = json.load(fd)
+                    data = data.get('maps', {}) if isinstance(data, dict) else data
+                    if isinstance(data, list):
+                        data = {name: True for name in data}
+                    maps = {str(name): value if isinstance(value, (bool, int, float)) else True
+                            for name, value in data.items()}
+        except (ValueError, AttributeError, OSError) as e:
+            return None, "The file can not be read: " + str(e)
+        return maps, None
+
     @command
     @asyncio.coroutine
     def music(self, mask, target, args):
@@ -485,63 +598,16 @@ class Plugin(object):
         """
         if not (yield from self.__isNickservIdentified(mask.nick)):
             return
-        add, delete, get, id, text = args.get('add'), args.get('del'), args.get('get'), args.get('<ID>'), " ".join(args.get('TEXT'))
-        dict = self.__dbGet(path)
-        if add:
-            if not allowSameValue:
-                entries = self.__dbGet(path)
-                for e in entries.values():
-                    if e == text:
-                        return "This already exists, so it won't be added."
-            try:
-                id = self.__getNextDictIncremental(dict)
-                self.__dbAdd(path, id, text)
-                return 'Added to the list.'
-            except:
-                return "Failed adding."
-        elif delete:
-            try:
-                if dict.get(id):
-                    dict = self.__dbDel(path, id)
-                    return 'Removed element of ID "{id}".'.format(**{
-                            "id" : id,
-                        })
-                else:
-                    return 'ID not found in the list.'
-            except:
-                return "Failed deleting."
-        elif get:
-            self.bot.privmsg(mask.nick, str(len(dict)) + " elements:")
-            for id in dict.keys():
-                self.bot.privmsg(mask.nick, '<%s>: %s' % (id, dict[id]))
+        reply, lines = manage_list(self.Db, path, args, allow_same_value=allowSameValue)
+        for line in lines:
+            self.bot.privmsg(mask.nick, line)
+        return reply
 
     def __dbAdd(self, path, key, value, overwriteIfExists=True):
-        cur = self.bot.db
-        for p in path:
-            if p not in cur:
-                cur[p] = {}
-            cur = cur[p]
-        if overwriteIfExists:
-            cur[key] = value
-        elif not cur.get(key):
-            cur[key] = value
-        self.__dbSave()
-        return cur
+        return self.Db.add(path, key, value, overwrite=overwriteIfExists)[0]
 
     def __dbDel(self, path, key):
-        cur = self.bot.db
-        for p in path:
-            cur = cur.get(p, {})
-        if not cur.get(key) is None:
-            del cur[key]
-            self.__dbSave()
-        return cur
+        return self.Db.delete(path, key)
 
     def __dbGet(self, path):
-        reply = self.bot.db
-        for p in path:
-            reply = reply.get(p, {})
-        return reply
-
-    def __dbSave(self):
-        self.bot.db.set('misc', lastSaved=time.time())
\ No newline at end of file
+        return self.Db.get(path)
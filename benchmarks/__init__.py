@@ -0,0 +1,5 @@
+"""
+Benchmarks of the chatbots, run from the repository root, e.g.:
+
+    python -m benchmarks.replay "Chatbot MAI2" --synthetic 20000
+"""
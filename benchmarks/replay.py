@@ -0,0 +1,389 @@
+"""
+Replays channel traffic through a bot and measures how fast its plugins handle it:
+
+    python -m benchmarks.replay "Chatbot MAI2" --log aeolus.log
+    python -m benchmarks.replay "Chatbot Shaper" "Chatbot Clanbot" --synthetic 20000 --save results.json
+    python -m benchmarks.replay "Chatbot MAI2" --synthetic 20000 --compare results.json
+
+Every bot is loaded like botcore.host does it, with its config.ini (or config.ini.example), but it never connects.
+Supported are MAI2, Shaper and Clanbot. MAI only loads on the Python versions its irc3.plugins.async import works
+with (before 3.7). A bot that fails to load is reported and skipped, the others still run.
+Its data paths point into a temporary directory, so nothing of a real bot is touched. The lines are dispatched as if
+the server sent them, which runs on_privmsg, the command dispatch and whatever the commands start. What the bot sends
+goes to a fake server that only counts it and answers NickServ STATUS queries (as identified).
+
+Logs are read in the LOG format of Markov.add_file ("[time] <nick> text") or RAW (one text per line). Synthetic
+traffic is chat of a few hundred users mixed with the commands and game flows of the bot's SCENARIOS.
+
+Reported per bot: messages/sec, p50/p99/max handler latency (dispatch until the loop is idle again), storage
+commits/sec (ZODB transactions and irc3 storage writes) and memory growth. --compare fails (exit code 1) if
+messages/sec dropped or p99 latency grew by more than --tolerance against a saved run, with exit code 2 if a bot
+failed to load.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from irc3.utils import parse_config
+from botcore.host import BotHost, absolute_path
+
+LOG_LINE = re.compile(r'^(?:\[[^\]]*\]\s*)?<[@+%~&]?([^>\s]+)> (.*)$')
+
+WORDS = ('gg wp the game was close i think my team lost because of the t2 air push but your '
+         'eco was just better next time we build more mexes and go for a faster t3 land '
+         'attack with arty support on the left flank and maybe some strats lol').split()
+
+# commands per plugin module, {nick}: the sender, {other}: another user, {word}: a random word,
+# {admin}: a nick with all permissions in the config, {channel}: the replayed channel. "setup" is sent once
+# (privately by the admin) before the replay, "commands" are mixed into the chat.
+SCENARIOS = {
+    'Chatbot MAI': {
+        'setup': [],
+        'commands': ['!chatlvl', '!chatlvl {other}', '!chain {word}', '!chatladder', '!rancaps {word} {word}',
+                     '!cr 5', '!chatroulette 5', '!chattip {other} 1', '!cp signup 5', '!cp odds'],
+    },
+    'Chatbot MAI2': {
+        # points for chatting, so every line goes through on_chat and the batched commits
+        'setup': ['!adminchannels chat add {channel}'],
+        'commands': ['!chatlvl', '!chatlvl {other}', '!chain {word}', '!chain {word} f', '!chatladder',
+                     '!chatitems', '!cr 5', '!chatroulette 5', '!chattip {other} 1', '!market list'],
+    },
+    'Chatbot Shaper': {
+        'setup': ['!design add bench {admin}',
+                  '!list map add bench ' + ', '.join('Map %d' % i for i in range(500))],
+        'commands': ['!shape', '!map bench', '!bo3 bench', '!bo5 bench', '!lists', '!owner bench',
+                     '!draft start bench {nick} {other}', '!draft status', '!draft cancel'],
+    },
+    'Chatbot Clanbot': {
+        'setup': [],
+        'commands': ['!taunt', '!taunt {other}'],
+    },
+}
+
+
+def read_log(path: str, filetype='LOG', nicks=None) -> list:
+    """ (nick, text) of every line, RAW lines get a random nick of nicks """
+    lines = []
+    with open(path, encoding='utf-8', errors='replace') as fd:
+        for line in fd:
+            line = line.rstrip('\r\n')
+            if filetype == 'RAW':
+                if line:
+                    lines.append((random.choice(nicks), line))
+                continue
+            m = LOG_LINE.match(line)
+            if m is not None:
+                lines.append((m.group(1), m.group(2)))
+                continue
+            # like Markov.add_file, everything after the first "> " is the text
+            parts = line.split('> ', maxsplit=1)
+            if len(parts) == 2:
+                nick = parts[0].rsplit('<', 1)[-1].strip('@+%~& ') if '<' in parts[0] else ''
+                lines.append((nick or random.choice(nicks), parts[1]))
+    return lines
+
+
+def synthetic_traffic(count: int, nicks: list, commands: list, command_ratio=0.05, admin='admin') -> list:
+    """ (nick, text) of count lines, random chat with commands mixed in """
+    lines = []
+    for _ in range(count):
+        nick = random.choice(nicks)
+        if commands and random.random() < command_ratio:
+            text = random.choice(commands)
+        else:
+            text = ' '.join(random.choice(WORDS) for _ in range(random.randint(2, 14)))
+        lines.append((nick, fill(text, nick, nicks, admin)))
+    return lines
+
+
+def fill(text: str, nick: str, nicks: list, admin: str, channel='') -> str:
+    while '{word}' in text:
+        text = text.replace('{word}', random.choice(WORDS), 1)
+    text = text.replace('{nick}', nick).replace('{other}', random.choice(nicks)).replace('{admin}', admin)
+    return text.replace('{channel}', channel)
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # max rss, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_calls(obj, name: str, counter: dict, key: str):
+    """ counts the calls of obj.name in counter[key] """
+    original = getattr(obj, name)
+
+    def counted(*args, **kwargs):
+        counter[key] += 1
+        return original(*args, **kwargs)
+    setattr(obj, name, counted)
+
+
+class FakeServer(object):
+    """
+    Stands in for the connection of a bot: counts what it sends and answers NickServ STATUS queries
+    """
+
+    def __init__(self, bot, identified=True):
+        self.bot = bot
+        self.identified = identified
+        self.sent = 0
+        self.replies = []
+        bot.send_line = self.send_line
+
+    def send_line(self, data, nowait=False):
+        self.sent += 1
+        command, _, rest = data.partition(' ')
+        if command.upper() == 'PRIVMSG' and rest.lower().startswith('nickserv :status '):
+            nick = rest.split()[-1]
+            self.replies.append(':NickServ!NickServ@services. NOTICE {bot} :STATUS {nick} {level}'.format(
+                bot=self.bot.nick, nick=nick, level=3 if self.identified else 0))
+
+
+class Replay(object):
+    def __init__(self, bot_dir: str, workdir: str, channel=None, config=None):
+        self.bot_dir = os.path.abspath(bot_dir)
+        self.name = os.path.basename(self.bot_dir.rstrip('/'))
+        self.workdir = workdir
+        if config is None:
+            config = os.path.join(self.bot_dir, 'config.ini')
+            if not os.path.isfile(config):
+                config = os.path.join(self.bot_dir, 'config.ini.example')
+        else:
+            config = os.path.join(self.bot_dir, config)
+        self.config = config
+        self.cfg = parse_config('bot', config)
+        self.channel = channel or '#' + (self.cfg.get('autojoins', None) or ['bench'])[0]
+        self.admin = self.__admin_nick()
+        self.counters = {'zodb_commits': 0, 'storage_writes': 0}
+        self.bot = None
+        self.server = None
+
+    def __admin_nick(self) -> str:
+        for mask, permission in self.cfg.get('irc3.plugins.command.masks', {}).items():
+            if 'all_permissions' in str(permission) and mask != '*':
+                return mask.split('!')[0]
+        return 'admin'
+
+    def load(self, host: BotHost):
+        # the bot's data lives in the temporary directory, example data is copied there as its data
+        example_data = os.path.join(self.bot_dir, 'example_data')
+        if os.path.isdir(example_data):
+            shutil.copytree(example_data, os.path.join(self.workdir, 'data'), dirs_exist_ok=True)
+        overrides = {}
+        for key, value in self.cfg.items():
+            path = absolute_path(value, self.workdir)
+            if key in ['here', 'includes', 'configfiles'] or path == value:
+                continue
+            overrides[key] = path
+            directory = path.split('://')[-1]
+            os.makedirs(directory if directory.endswith('/') else os.path.dirname(directory), exist_ok=True)
+        self.bot = host.add(self.config, **overrides)
+        self.server = FakeServer(self.bot)
+        self.__count_commits()
+
+    def __count_commits(self):
+        try:
+            import ZODB
+        except ImportError:
+            ZODB = None
+        for plugin in self.bot.registry.plugins.values():
+            for value in list(vars(plugin).values()):
+                if ZODB is not None and isinstance(value, ZODB.DB):
+                    count_calls(value.storage, 'tpc_finish', self.counters, 'zodb_commits')
+        backend = getattr(getattr(self.bot, 'db', None), 'backend', None)
+        if backend is not None:
+            count_calls(backend, 'sync' if hasattr(backend, 'sync') else 'set', self.counters, 'storage_writes')
+
+    def send(self, nick: str, text: str, target=None):
+        self.bot.dispatch(':{nick}!{user}@bench.local PRIVMSG {target} :{text}'.format(
+            nick=nick, user=nick.lower()[:10], target=target or self.channel, text=text))
+
+    def settle(self, loop, rounds=3):
+        """ runs the loop until the handlers started by a line are done (or waiting for a timer) """
+        for _ in range(rounds):
+            loop.run_until_complete(asyncio.sleep(0))
+            while self.server.replies:
+                self.bot.dispatch(self.server.replies.pop(0))
+                loop.run_until_complete(asyncio.sleep(0))
+
+    def join(self, loop, nicks: list):
+        self.bot.dispatch(':{bot}!bot@bench.local JOIN {channel}'.format(bot=self.bot.nick, channel=self.channel))
+        for nick in nicks:
+            self.bot.dispatch(':{nick}!{user}@bench.local JOIN {channel}'.format(
+                nick=nick, user=nick.lower()[:10], channel=self.channel))
+        self.settle(loop)
+
+    def run(self, loop, lines: list, setup=(), settle_seconds=2.0, trace_memory=False) -> dict:
+        for text in setup:
+            self.send(self.admin, fill(text, self.admin, [self.admin], self.admin, self.channel), target=self.bot.nick)
+            self.settle(loop)
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        traced_start = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        rss_start = rss_bytes()
+        counters_start = dict(self.counters)
+        sent_start = self.server.sent
+        latencies, command_latencies = [], []
+        start = time.perf_counter()
+        for nick, text in lines:
+            t = time.perf_counter()
+            self.send(nick, text)
+            self.settle(loop, rounds=1)
+            latency = time.perf_counter() - t
+            latencies.append(latency)
+            if text.startswith('!'):
+                command_latencies.append(latency)
+        duration = time.perf_counter() - start
+        # batched commits and delayed writes happen after the traffic
+        loop.run_until_complete(asyncio.sleep(settle_seconds))
+        batched_db = getattr(self.bot, 'batched_db', None)
+        if batched_db is not None:
+            batched_db.flush()
+        total = time.perf_counter() - start
+        gc.collect()
+        traced_end = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        if trace_memory:
+            tracemalloc.stop()
+        latencies.sort()
+        command_latencies.sort()
+        commits = self.counters['zodb_commits'] - counters_start['zodb_commits']
+        writes = self.counters['storage_writes'] - counters_start['storage_writes']
+        return {
+            'bot': self.name,
+            'messages': len(lines),
+            'commands': len(command_latencies),
+            'seconds': round(duration, 3),
+            'messages_per_sec': round(len(lines) / duration, 1) if duration > 0 else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            'command_p50_ms': round(percentile(command_latencies, 0.5) * 1000, 3),
+            'command_p99_ms': round(percentile(command_latencies, 0.99) * 1000, 3),
+            'zodb_commits': commits,
+            'storage_writes': writes,
+            'commits_per_sec': round((commits + writes) / total, 2) if total > 0 else 0.0,
+            'lines_sent': self.server.sent - sent_start,
+            'rss_growth_mb': round((rss_bytes() - rss_start) / 1048576, 2),
+            'traced_growth_mb': round((traced_end - traced_start) / 1048576, 2) if trace_memory else None,
+        }
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """ the regressions of results against baseline, as readable strings """
+    regressions = []
+    old = {r['bot']: r for r in baseline}
+    for r in results:
+        b = old.get(r['bot'], None)
+        if b is None:
+            continue
+        if r['messages_per_sec'] < b['messages_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.1f messages/sec, was %.1f' % (r['bot'], r['messages_per_sec'], b['messages_per_sec']))
+        if r['p99_ms'] > b['p99_ms'] * (1 + tolerance) and r['p99_ms'] - b['p99_ms'] > 0.05:
+            regressions.append('%s: p99 %.3fms, was %.3fms' % (r['bot'], r['p99_ms'], b['p99_ms']))
+    return regressions
+
+
+def print_result(r: dict):
+    print('%s: %d messages (%d commands) in %.2fs' % (r['bot'], r['messages'], r['commands'], r['seconds']))
+    print('  %.1f messages/sec, latency p50 %.3fms, p99 %.3fms, max %.3fms' % (
+        r['messages_per_sec'], r['p50_ms'], r['p99_ms'], r['max_ms']))
+    print('  commands: p50 %.3fms, p99 %.3fms' % (r['command_p50_ms'], r['command_p99_ms']))
+    print('  commits: %d zodb, %d storage writes, %.2f/sec, %d lines sent' % (
+        r['zodb_commits'], r['storage_writes'], r['commits_per_sec'], r['lines_sent']))
+    memory = '  memory growth: %.2fMB rss' % r['rss_growth_mb']
+    if r['traced_growth_mb'] is not None:
+        memory += ', %.2fMB traced' % r['traced_growth_mb']
+    print(memory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay channel traffic through bots and measure their throughput')
+    parser.add_argument('bots', nargs='+', help='bot directories, e.g. "Chatbot MAI2"')
+    parser.add_argument('--config', help='config file in the bot directory, instead of config.ini(.example)')
+    parser.add_argument('--log', help='channel log to replay')
+    parser.add_argument('--log-type', default='LOG', choices=['LOG', 'RAW'])
+    parser.add_argument('--synthetic', type=int, default=10000, help='lines of synthetic traffic, without --log')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--command-ratio', type=float, default=0.05)
+    parser.add_argument('--channel', help='default: the first autojoin of the config')
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds to run the loop after the traffic')
+    parser.add_argument('--trace-memory', action='store_true', help='also measure with tracemalloc (slower)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of an earlier run, fails on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    nicks = ['user%03d' % i for i in range(args.users)]
+    loop = asyncio.new_event_loop()
+    host = BotHost(loop)
+    results, failed = [], []
+    cwd = os.getcwd()
+    for bot_dir in args.bots:
+        workdir = tempfile.mkdtemp(prefix='bench-')
+        try:
+            # paths a plugin uses without a config key are relative to the working directory
+            os.chdir(workdir)
+            try:
+                replay = Replay(os.path.join(cwd, bot_dir), workdir, channel=args.channel, config=args.config)
+                replay.load(host)
+            except (Exception, SystemExit) as e:
+                # irc3 exits on some config errors
+                failed.append(bot_dir)
+                print('%s: failed to load, skipped: %s' % (bot_dir, repr(e)))
+                continue
+            scenario = SCENARIOS.get(replay.name, {'setup': [], 'commands': []})
+            if args.log:
+                lines = read_log(os.path.join(cwd, args.log), args.log_type, nicks)
+            else:
+                lines = synthetic_traffic(args.synthetic, nicks, scenario['commands'], args.command_ratio, replay.admin)
+            replay.join(loop, sorted({nick for nick, _ in lines} | {replay.admin}))
+            result = replay.run(loop, lines, setup=scenario['setup'], settle_seconds=args.settle,
+                                trace_memory=args.trace_memory)
+            results.append(result)
+            print_result(result)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare(results, json.load(fd), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+    if failed:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
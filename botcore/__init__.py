@@ -0,0 +1,4 @@
+"""
+Code shared by the chatbots (MAI, MAI2, Clanbot, Shaper).
+The bots run from their own directories, their plugins add the repository root to sys.path to import this.
+"""
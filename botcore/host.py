@@ -0,0 +1,120 @@
+"""
+Runs several bots in one process, on one asyncio loop:
+
+    python -m botcore.host "Chatbot MAI2/config.ini" "Chatbot Shaper/config.ini"
+
+Every bot keeps its own IrcBot, config, plugin instances and commands. Its plugin module is loaded under an alias
+(e.g. chatbot_mai2__qai_plugin), so plugins with the same module name and their module level state stay separate.
+The helper modules next to a plugin are imported normally and would be shared, which is why every bot directory
+can only be loaded once.
+Relative paths in a config (./data/x.fs, json://db.json) are made relative to the config file, paths a plugin
+uses without a config key stay relative to the working directory.
+Objects that the bots can share, like parsed word files or REST clients, are in botcore.shared.registry.
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import re
+import sys
+import irc3
+from irc3.utils import parse_config
+from botcore.shared import registry
+
+logger = logging.getLogger('botcore.host')
+
+STORAGE_SCHEMES = ['json', 'shelve']
+
+
+def absolute_path(value, here: str):
+    """ value made relative to here, if it is a relative path (or a file storage uri) """
+    if not isinstance(value, str):
+        return value
+    if value.startswith('./') or value.startswith('../'):
+        return os.path.normpath(os.path.join(here, value))
+    scheme, sep, path = value.partition('://')
+    if sep and scheme in STORAGE_SCHEMES and not os.path.isabs(path):
+        return '%s://%s' % (scheme, os.path.normpath(os.path.join(here, path)))
+    return value
+
+
+def load_plugin(name: str, here: str, alias: str):
+    """ imports here/name.py as module alias """
+    module = sys.modules.get(alias, None)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(alias, os.path.join(here, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[alias] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        del sys.modules[alias]
+        raise
+    return module
+
+
+class BotHost(object):
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bots = {}  # bot directory -> IrcBot
+        self.shared = registry
+
+    def add(self, config_path: str, **overrides) -> irc3.IrcBot:
+        cfg = parse_config('bot', config_path)
+        here = cfg['here']
+        if here in self.bots:
+            raise ValueError('The bot in %s is already loaded' % here)
+        if here not in sys.path:
+            # for the imports of the plugin's helper modules
+            sys.path.append(here)
+        prefix = re.sub(r'\W+', '_', os.path.basename(here)).strip('_').lower()
+        includes = []
+        for name in cfg.get('includes', []):
+            if os.path.isfile(os.path.join(here, name + '.py')):
+                alias = '%s__%s' % (prefix, name)
+                load_plugin(name, here, alias)
+                name = alias
+            includes.append(name)
+        for key, value in list(cfg.items()):
+            if key not in ['here', 'includes', 'configfiles']:
+                cfg[key] = absolute_path(value, here)
+        cfg.update(overrides)
+        cfg['includes'] = includes
+        cfg['loop'] = self.loop
+        bot = irc3.IrcBot.from_config(cfg)
+        self.bots[here] = bot
+        logger.info('Loaded %s from %s, plugins: %s' % (bot.nick, here, ', '.join(includes)))
+        return bot
+
+    def run(self, forever=True):
+        for bot in self.bots.values():
+            bot.run(forever=False)
+        if forever:
+            self.loop.run_forever()
+
+    def stop(self):
+        for bot in self.bots.values():
+            try:
+                bot.quit('bye')
+            except Exception as e:
+                logger.warning('Failed stopping %s: %s' % (bot.nick, str(e)))
+        self.loop.call_later(1, self.loop.stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run several bots in one process')
+    parser.add_argument('configs', nargs='+', help='config.ini of every bot')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    host = BotHost()
+    for config_path in args.configs:
+        host.add(config_path, verbose=args.verbose)
+    host.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+import irc3
+
+
+@irc3.plugin
+class NickServIdentification(object):
+    """
+    Asks NickServ whether nicks are identified, for commands that need it. Add 'botcore.identify' to the
+    requires of a plugin and use bot.get_plugin(NickServIdentification).is_identified(nick).
+    Identified nicks are remembered for nickserv_cache_ttl seconds (until they change their nick, quit, or leave
+    the last channel they share with the bot, after which anyone could take the nick unseen), so only the first command of a while needs a round trip. Concurrent checks of a nick share one query,
+    answers are pushed to the waiting checks instead of being polled for.
+    """
+
+    requires = [
+        'irc3.plugins.userlist',
+    ]
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.ttl = float(bot.config.get('nickserv_cache_ttl', 60))
+        self.timeout = float(bot.config.get('nickserv_timeout', 6))
+        self.identified = {}  # lowercase nick -> time until which it counts as identified
+        self.pending = {}     # lowercase nick -> future of the STATUS answer
+        self.sweep_size = 1000
+        self.queries, self.cache_hits = 0, 0
+
+    @classmethod
+    def reload(cls, old):
+        new = cls(old.bot)
+        new.identified = old.identified
+        return new
+
+    @irc3.event(irc3.rfc.PRIVMSG)
+    def on_nickserv_message(self, mask=None, data=None, **kwargs):
+        if mask is None or mask.nick.lower() != 'nickserv':
+            return
+        words = data.split()
+        if len(words) >= 3 and words[0] == 'STATUS':
+            self.on_status(words[1], words[2])
+
+    @irc3.event(irc3.rfc.NEW_NICK)
+    def on_new_nick(self, nick=None, new_nick=None, **kwargs):
+        self.forget(getattr(nick, 'nick', nick))
+        self.forget(new_nick)
+
+    @irc3.event(irc3.rfc.QUIT)
+    def on_quit(self, mask=None, **kwargs):
+        self.forget(getattr(mask, 'nick', mask))
+
+    @irc3.event(irc3.rfc.JOIN_PART_QUIT)
+    def on_part(self, mask=None, event=None, channel=None, **kwargs):
+        if event == 'PART':
+            self.left(getattr(mask, 'nick', mask), channel)
+
+    @irc3.event(irc3.rfc.KICK)
+    def on_kick(self, channel=None, target=None, **kwargs):
+        self.left(getattr(target, 'nick', target), channel)
+
+    def left(self, nick: str, channel: str):
+        """ nick left channel, forgets it (or, if it is the bot, everyone) no longer seen in another channel """
+        if not nick:
+            return
+        others = [users for name, users in getattr(self.bot, 'channels', {}).items() if name != channel]
+        if nick == self.bot.nick:
+            seen = set(n.lower() for users in others for n in users)
+            self.identified = {k: t for k, t in self.identified.items() if k in seen}
+        elif not any(nick in users for users in others):
+            self.forget(nick)
+
+    def on_status(self, nick: str, status: str):
+        key = nick.lower()
+        try:
+            status = int(status)
+        except ValueError:
+            status = 0
+        if status == 3:
+            self.identified[key] = time.time() + self.ttl
+            if len(self.identified) > self.sweep_size:
+                self.__sweep()
+        else:
+            self.identified.pop(key, None)
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(status)
+
+    def forget(self, nick: str):
+        if nick:
+            self.identified.pop(nick.lower(), None)
+
+    def __sweep(self):
+        now = time.time()
+        self.identified = {k: t for k, t in self.identified.items() if t > now}
+        self.sweep_size = max(2 * len(self.identified), 1000)
+
+    async def is_identified(self, nick: str) -> bool:
+        key = nick.lower()
+        if self.identified.get(key, 0) > time.time():
+            self.cache_hits += 1
+            return True
+        future = self.pending.get(key, None)
+        if future is None:
+            future = self.pending[key] = self.bot.loop.create_future()
+            self.queries += 1
+            self.bot.privmsg('nickserv', 'status {}'.format(nick))
+        try:
+            return (await asyncio.wait_for(asyncio.shield(future), self.timeout)) == 3
+        except asyncio.TimeoutError:
+            if self.pending.get(key, None) is future:
+                del self.pending[key]
+            return False
+
+    def stats(self) -> dict:
+        return {
+            'identified': len(self.identified),
+            'pending': len(self.pending),
+            'queries': self.queries,
+            'cache_hits': self.cache_hits,
+        }
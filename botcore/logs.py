@@ -0,0 +1,41 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+LEVELS = {
+    'critical': logging.CRITICAL,
+    'error': logging.ERROR,
+    'warning': logging.WARNING,
+    'info': logging.INFO,
+    'debug': logging.DEBUG,
+}
+
+_queue = None
+_listener = None
+
+
+def _start_listener():
+    global _queue, _listener
+    if _listener is None:
+        _queue = queue.SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s: %(message)s'))
+        _listener = logging.handlers.QueueListener(_queue, handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+    return _queue
+
+
+def get_queue_logger(name: str, level='info') -> logging.Logger:
+    """
+    A logger that only puts its records into a queue, they are formatted and written by one background thread.
+    Logging (and skipping records below the level) stays cheap for the caller, e.g. for every chat line.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(LEVELS.get(level, level) if isinstance(level, str) else level)
+    if not any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers):
+        logger.addHandler(logging.handlers.QueueHandler(_start_listener()))
+        logger.propagate = False
+    return logger
@@ -0,0 +1,348 @@
+"""
+Timings of the bots' hot paths: every command and irc event handler, waiting for and holding locks,
+and storage commits. Add 'botcore.metrics' to the requires of a plugin to time its commands and events,
+admins can then see the slowest ones with !stats. With metrics_port set, they are also served on
+http://metrics_host:metrics_port/metrics (prometheus text format) and /metrics.json.
+Other code records into the process wide botcore.metrics.metrics, e.g. with metrics.timer(kind, name).
+"""
+import asyncio
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+import irc3
+from irc3.plugins.command import command, Commands
+from botcore.identify import NickServIdentification
+from botcore.shared import registry
+
+logger = logging.getLogger('botcore.metrics')
+
+# upper bounds in seconds, 0.1ms to about 105s
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram(object):
+    """ durations in seconds, counted in exponential buckets """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """ upper bound of the bucket the p-th percentile (0-100) is in, at most the max """
+        if self.count == 0:
+            return 0.0
+        rank, seen = self.count * p / 100, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+
+class InstrumentedLock(object):
+    """
+    A lock that records how long acquiring it waited and how long it was held.
+    Wraps anything with acquire/release, or any context manager (e.g. a nullcontext, then only the time held counts).
+    """
+
+    def __init__(self, lock, name: str, metrics):
+        self.lock = lock
+        self.name = name
+        self.wait = metrics.histogram('lock_wait', name)
+        self.held = metrics.histogram('lock_held', name)
+        self.local = threading.local()
+
+    def acquire(self, blocking=True, timeout=-1) -> bool:
+        t0 = time.perf_counter()
+        if hasattr(self.lock, 'acquire'):
+            acquired = self.lock.acquire(blocking, timeout)
+            t1 = time.perf_counter()
+            self.wait.observe(t1 - t0)
+        else:
+            self.lock.__enter__()
+            acquired, t1 = True, t0
+        if acquired:
+            self.local.since = t1
+        return acquired
+
+    def release(self):
+        since = getattr(self.local, 'since', None)
+        if since is not None:
+            self.held.observe(time.perf_counter() - since)
+            self.local.since = None
+        if hasattr(self.lock, 'release'):
+            self.lock.release()
+        else:
+            self.lock.__exit__(None, None, None)
+
+    def locked(self) -> bool:
+        return self.lock.locked() if hasattr(self.lock, 'locked') else False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Metrics(object):
+    """
+    Histograms by (kind, name), e.g. ('command', 'MAI2/roll') or ('commit', 'batched_db'), and counters by name.
+    One instance is shared by every bot of the process.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.since = time.time()
+
+    def histogram(self, kind: str, name: str) -> Histogram:
+        key = (kind, name)
+        histogram = self.histograms.get(key, None)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, kind: str, name: str, seconds: float):
+        self.histogram(kind, name).observe(seconds)
+
+    def count(self, name: str, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def timer(self, kind: str, name: str):
+        histogram = self.histogram(kind, name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - t0)
+
+    def wrap(self, fun, kind: str, name: str):
+        """ fun timed on every call, coroutine functions until they are done. Wrapping twice does nothing. """
+        if getattr(fun, '__metrics__', None) is not None:
+            return fun
+        histogram = self.histogram(kind, name)
+        if asyncio.iscoroutinefunction(fun):
+            @functools.wraps(fun)
+            async def timed(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fun(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - t0)
+        else:
+            @functools.wraps(fun)
+            def timed(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - t0)
+        timed.__metrics__ = (kind, name)
+        return timed
+
+    def instrument_lock(self, lock, name: str) -> InstrumentedLock:
+        return InstrumentedLock(lock, name, self)
+
+    def top(self, text='', amount=10) -> list:
+        """ ((kind, name), histogram) containing text, by total time """
+        with self.lock:
+            items = [(k, h) for k, h in self.histograms.items() if h.count and text in '%s %s' % k]
+        return sorted(items, key=lambda item: item[1].sum, reverse=True)[:amount]
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.since = time.time()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            histograms, counters = list(self.histograms.items()), dict(self.counters)
+        return {
+            'since': self.since,
+            'histograms': [dict(kind=k, name=n, **h.to_dict()) for (k, n), h in histograms],
+            'counters': counters,
+        }
+
+    def prometheus(self) -> str:
+        """ everything in the prometheus text format """
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        with self.lock:
+            histograms, counters = sorted(self.histograms.items()), sorted(self.counters.items())
+        lines = [
+            '# HELP chatbot_duration_seconds Durations of commands, irc events, lock waits and holds, storage commits',
+            '# TYPE chatbot_duration_seconds histogram',
+        ]
+        for (kind, name), h in histograms:
+            labels = 'kind="%s",name="%s"' % (label(kind), label(name))
+            with h.lock:
+                counts, count, total = list(h.counts), h.count, h.sum
+            seen = 0
+            for bound, n in zip(BUCKETS, counts):
+                seen += n
+                lines.append('chatbot_duration_seconds_bucket{%s,le="%g"} %d' % (labels, bound, seen))
+            lines.append('chatbot_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+            lines.append('chatbot_duration_seconds_sum{%s} %.6f' % (labels, total))
+            lines.append('chatbot_duration_seconds_count{%s} %d' % (labels, count))
+        lines.append('# HELP chatbot_events_total Counted events, e.g. storage conflicts')
+        lines.append('# TYPE chatbot_events_total counter')
+        for name, n in counters:
+            lines.append('chatbot_events_total{name="%s"} %d' % (label(name), n))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsServer(object):
+    """ serves the metrics over http on the loop, only meant for local scraping """
+
+    def __init__(self, host: str, port: int, loop):
+        self.host = host
+        self.port = port
+        self.runner = None
+        loop.create_task(self.start())
+
+    async def start(self):
+        from aiohttp import web
+
+        async def text(request):
+            return web.Response(text=metrics.prometheus(), content_type='text/plain')
+
+        async def as_json(request):
+            return web.Response(text=json.dumps(metrics.to_dict()), content_type='application/json')
+
+        app = web.Application()
+        app.router.add_get('/metrics', text)
+        app.router.add_get('/metrics.json', as_json)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+            logger.info('Serving metrics on http://%s:%d/metrics' % (self.host, self.port))
+        except OSError as e:
+            logger.warning('Failed serving metrics on %s:%d: %s' % (self.host, self.port, str(e)))
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def format_seconds(seconds: float) -> str:
+    return '%.1fms' % (seconds * 1000) if seconds < 1 else '%.2fs' % seconds
+
+
+@irc3.plugin
+class MetricsPlugin(object):
+    """
+    Times every command and irc event handler of the bot. Handlers are wrapped once the plugins are loaded,
+    and again after connecting (for anything added later), wrapping is skipped for handlers that are timed already.
+    """
+
+    requires = [
+        'irc3.plugins.command',
+        'botcore.identify',
+    ]
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.metrics = metrics
+        self.prefix = str(bot.config.get('nick', bot.nick))
+        port = int(bot.config.get('metrics_port', 0))
+        if port > 0:
+            host = bot.config.get('metrics_host', '127.0.0.1')
+            # one server per process, whichever bot comes first
+            self.server = registry.get(('metrics', host, port), MetricsServer, host, port, bot.loop)
+        bot.loop.call_soon(self.instrument)
+
+    @classmethod
+    def reload(cls, old):
+        return cls(old.bot)
+
+    @irc3.event(irc3.rfc.CONNECTED)
+    def on_connected(self, **kwargs):
+        self.instrument()
+
+    def __name(self, callback) -> str:
+        owner = getattr(callback, '__self__', None)
+        name = getattr(callback, '__name__', type(callback).__name__)
+        if owner is not None:
+            name = '%s.%s' % (type(owner).__name__, name)
+        return '%s/%s' % (self.prefix, name)
+
+    def instrument(self) -> int:
+        """ wraps the commands and events that are not timed yet, returns how many """
+        wrapped = 0
+        commands = self.bot.get_plugin(Commands)
+        for name, (predicates, meth) in list(commands.items()):
+            if getattr(meth, '__metrics__', None) is None:
+                commands[name] = (predicates, self.metrics.wrap(meth, 'command', '%s/%s' % (self.prefix, name)))
+                wrapped += 1
+        for iotype in ['in']:
+            for events in self.bot.registry.events[iotype].values():
+                for e in events:
+                    if getattr(e.callback, '__metrics__', None) is None:
+                        e.callback = self.metrics.wrap(e.callback, 'event', self.__name(e.callback))
+                        wrapped += 1
+        if wrapped:
+            logger.debug('Timing %d more handlers of %s' % (wrapped, self.prefix))
+        return wrapped
+
+    @command(permission='admin', show_in_help_list=False)
+    async def stats(self, mask, target, args):
+        """Shows the handlers, locks and commits that took the most time in total, optionally only those containing the filter
+            %%stats [<filter>]
+        """
+        if not (await self.bot.get_plugin(NickServIdentification).is_identified(mask.nick)):
+            return
+        top = self.metrics.top(args.get('<filter>') or '')
+        lines = ['Since %s, %d timings:' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(self.metrics.since)),
+                                            len(self.metrics.histograms))]
+        for (kind, name), h in top:
+            lines.append('{kind} {name}: {count}x, p50 {p50}, p99 {p99}, max {max}, total {sum}'.format(**{
+                'kind': kind,
+                'name': name,
+                'count': h.count,
+                'p50': format_seconds(h.percentile(50)),
+                'p99': format_seconds(h.percentile(99)),
+                'max': format_seconds(h.max),
+                'sum': format_seconds(h.sum),
+            }))
+        if self.metrics.counters:
+            lines.append(', '.join(['%s: %d' % item for item in sorted(self.metrics.counters.items())]))
+        for line in lines:
+            self.bot.privmsg(mask.nick, line)
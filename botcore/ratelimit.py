@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+class Cooldowns(object):
+    """
+    When something (any hashable key, e.g. (command, channel)) was used last, only kept in memory, thread safe.
+    Checking and refreshing a cooldown is a dict lookup. Entries older than max_age can not be on cooldown
+    anymore, they are dropped whenever the table doubled in size since the last sweep (amortized O(1)).
+    max_age can be a function, it is only called when sweeping.
+    """
+
+    def __init__(self, max_age=3600, min_sweep_size=1000):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.max_age = max_age
+        self.min_sweep_size = min_sweep_size
+        self.sweep_size = min_sweep_size
+
+    def __len__(self):
+        return len(self.times)
+
+    def get(self, key) -> float:
+        """ when key was used last, 0 if never """
+        return self.times.get(key, 0)
+
+    def set(self, key, t: float=None, max_age: float=None):
+        with self.lock:
+            self.times[key] = time.time() if t is None else t
+            if len(self.times) > self.sweep_size:
+                self._sweep(max_age)
+
+    def remaining(self, key, cooldown: float, now: float=None) -> float:
+        """ seconds until key can be used again, <= 0 if it can """
+        return cooldown - ((time.time() if now is None else now) - self.times.get(key, 0))
+
+    def check(self, key, cooldown: float, update=True) -> float:
+        """ 0 if key can be used (and then marks it as used now if update), else the remaining seconds """
+        now = time.time()
+        remaining = self.remaining(key, cooldown, now)
+        if remaining > 0:
+            return remaining
+        if update:
+            self.set(key, now)
+        return 0
+
+    def remove(self, key):
+        with self.lock:
+            self.times.pop(key, None)
+
+    def _sweep(self, max_age: float=None):
+        """ call with the lock held """
+        if max_age is None:
+            max_age = self.max_age() if callable(self.max_age) else self.max_age
+        min_time = time.time() - max_age
+        self.times = {k: t for k, t in self.times.items() if t > min_time}
+        self.sweep_size = max(2 * len(self.times), self.min_sweep_size)
+
+    def sweep(self, max_age: float=None):
+        with self.lock:
+            self._sweep(max_age)
+
+    def clear(self):
+        with self.lock:
+            self.times.clear()
+            self.sweep_size = self.min_sweep_size
@@ -0,0 +1,211 @@
+import asyncio
+import collections
+import json
+import time
+import urllib.parse
+import aiohttp
+
+
+def join_paths(*paths) -> str:
+    parts = [p.strip('/') for p in paths if p and p.strip('/')]
+    return '/' + '/'.join(parts)
+
+
+def max_age(headers) -> float:
+    """ seconds the response may be used without asking again, 0 if it has to be revalidated """
+    for directive in headers.get('Cache-Control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name in ['no-cache', 'no-store', 'private']:
+            return 0
+        if name == 'max-age':
+            try:
+                return max(float(value), 0)
+            except ValueError:
+                return 0
+    return 0
+
+
+class RestResponse(object):
+    def __init__(self, status: int, headers, content: bytes, from_cache=False):
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    @property
+    def json(self):
+        if not hasattr(self, '_json'):
+            self._json = json.loads(self.content.decode('utf-8'))
+        return self._json
+
+
+class ResponseCache(object):
+    """
+    Successful GET responses with an ETag or Last-Modified header, by url.
+    Least recently used entries are evicted once more than max_bytes of content are cached.
+    """
+
+    def __init__(self, max_bytes=8 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()  # url -> (response, time it is fresh until)
+        self.hits, self.revalidated, self.misses = 0, 0, 0
+
+    def get(self, url: str):
+        entry = self.entries.get(url, None)
+        if entry is not None:
+            self.entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, response: RestResponse):
+        if not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            return
+        if 'no-store' in response.headers.get('Cache-Control', '').lower():
+            return
+        if len(response.content) > self.max_bytes:
+            return
+        self.remove(url)
+        self.entries[url] = (response, time.time() + max_age(response.headers))
+        self.size += len(response.content)
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, url: str):
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.size -= len(entry[0].content)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class RestRequester(object):
+    """
+    Asynchronous http requests, for use on the bots loop.
+    All requests share one session, which keeps connections to each host alive and reuses them.
+    At most max_per_host requests run against the same host at a time, the others wait.
+    GET responses are cached: fresh ones (Cache-Control max-age) are returned right away,
+    stale ones are revalidated with If-None-Match / If-Modified-Since and reused if the server answers 304.
+    """
+
+    def __init__(self, base_url: str=None, timeout=10, max_per_host=4, cache_bytes=8 << 20,
+                 user_agent='FAF-stuff bot'):
+        self.base_scheme, self.base_host, self.base_path = None, None, ''
+        if base_url:
+            self.set_base_url(base_url)
+        self.timeout = aiohttp.ClientTimeout(total=float(timeout))
+        self.max_per_host = max(int(max_per_host), 1)
+        self.user_agent = user_agent
+        self.cache = ResponseCache(int(cache_bytes))
+        self.semaphores = {}
+        self.session = None
+        self.requests = 0
+
+    def set_base_url(self, base_url: str):
+        self.base_scheme, self.base_host, self.base_path, _, _ = urllib.parse.urlsplit(base_url)
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.max_per_host, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                 headers={'User-Agent': self.user_agent})
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __url(self, path: str) -> str:
+        return '%s://%s%s' % (self.base_scheme, self.base_host, join_paths(self.base_path, path))
+
+    async def get(self, path: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(self.__url(path), 'GET', args=args, headers=headers)
+
+    async def get_absolute(self, url: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(url, 'GET', args=args, headers=headers)
+
+    async def post(self, path: str, args: dict=None, body=None, headers: dict=None) -> RestResponse:
+        return await self.request(self.__url(path), 'POST', args=args, body=body, headers=headers)
+
+    async def post_absolute(self, url: str, args: dict=None, body=None, headers: dict=None) -> RestResponse:
+        return await self.request(url, 'POST', args=args, body=body, headers=headers)
+
+    async def put(self, path: str, args: dict=None, body=None, headers: dict=None) -> RestResponse:
+        return await self.request(self.__url(path), 'PUT', args=args, body=body, headers=headers)
+
+    async def put_absolute(self, url: str, args: dict=None, body=None, headers: dict=None) -> RestResponse:
+        return await self.request(url, 'PUT', args=args, body=body, headers=headers)
+
+    async def delete(self, path: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(self.__url(path), 'DELETE', args=args, headers=headers)
+
+    async def delete_absolute(self, url: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(url, 'DELETE', args=args, headers=headers)
+
+    async def head(self, path: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(self.__url(path), 'HEAD', args=args, headers=headers)
+
+    async def head_absolute(self, url: str, args: dict=None, headers: dict=None) -> RestResponse:
+        return await self.request(url, 'HEAD', args=args, headers=headers)
+
+    def __semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urllib.parse.urlsplit(url).netloc
+        semaphore = self.semaphores.get(host, None)
+        if semaphore is None:
+            semaphore = self.semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return semaphore
+
+    async def request(self, url: str, method='GET', args: dict=None, body=None, headers: dict=None) -> RestResponse:
+        """ like the old requester, args go into the query of GET/DELETE/HEAD and form encoded into the body else """
+        method = method.upper()
+        headers = dict(headers or {})
+        if args:
+            if method in ['POST', 'PUT']:
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+                body = urllib.parse.urlencode(args, True)
+            else:
+                url += ('&' if '?' in url else '?') + urllib.parse.urlencode(args, True)
+        cached = self.cache.get(url) if method == 'GET' else None
+        if cached is not None:
+            if cached[1] > time.time():
+                self.cache.hits += 1
+                return RestResponse(cached[0].status, cached[0].headers, cached[0].content, from_cache=True)
+            if cached[0].headers.get('ETag'):
+                headers['If-None-Match'] = cached[0].headers['ETag']
+            if cached[0].headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached[0].headers['Last-Modified']
+        async with self.__semaphore(url):
+            self.requests += 1
+            async with self.get_session().request(method, url, data=body, headers=headers) as r:
+                response = RestResponse(r.status, r.headers.copy(), await r.read())
+        if method != 'GET':
+            return response
+        if response.status == 304 and cached is not None:
+            self.cache.revalidated += 1
+            # the 304 may come with new caching headers
+            merged = cached[0].headers.copy()
+            for key in ['ETag', 'Cache-Control', 'Expires']:
+                if key in response.headers:
+                    merged[key] = response.headers[key]
+            response = RestResponse(cached[0].status, merged, cached[0].content, from_cache=True)
+        else:
+            self.cache.misses += 1
+        if response.ok:
+            self.cache.put(url, response)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'cache_entries': len(self.cache.entries),
+            'cache_bytes': self.cache.size,
+            'cache_hits': self.cache.hits,
+            'cache_revalidated': self.cache.revalidated,
+            'cache_misses': self.cache.misses,
+        }
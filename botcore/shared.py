@@ -0,0 +1,36 @@
+import threading
+
+
+class SharedRegistry(object):
+    """
+    Objects that all bots of the process can use, e.g. parsed word files or REST clients.
+    Each is created once per key by the first bot asking for it, later bots get the same object,
+    so they must not keep bot specific state in it. Running a single bot, it is just a cache.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, factory, *args, **kwargs):
+        """ the object stored under key, created by factory(*args, **kwargs) if there is none yet """
+        with self.lock:
+            if key not in self.objects:
+                self.objects[key] = factory(*args, **kwargs)
+                self.users[key] = 0
+            self.users[key] += 1
+            return self.objects[key]
+
+    def remove(self, key):
+        with self.lock:
+            self.users.pop(key, None)
+            return self.objects.pop(key, None)
+
+    def stats(self) -> dict:
+        """ key -> how often it was requested """
+        with self.lock:
+            return dict(self.users)
+
+
+registry = SharedRegistry()
@@ -0,0 +1,196 @@
+import atexit
+import collections.abc
+import logging
+from botcore.metrics import metrics
+
+logger = logging.getLogger('botcore.storage')
+
+
+def next_free_key(dct: dict) -> str:
+    """ the smallest "0", "1", ... that is not used (or only with an empty value) """
+    used = {k for k, v in dct.items() if v}
+    i = 0
+    while str(i) in used:
+        i += 1
+    return str(i)
+
+
+class BatchedDb(object):
+    """
+    Access to the irc3 storage (bot.db) by path, e.g. db.get(['maplists', name]).
+    The top level entries are read from the storage once and then kept. Changes mark their top level entry
+    dirty, and all dirty entries are written back together after delay seconds (0 = right away) or on flush(),
+    instead of the whole storage being written after every change.
+    Everything should access the storage through one BatchedDb, the cached entries are not reloaded.
+    """
+
+    def __init__(self, bot, delay=5):
+        self.bot = bot
+        self.delay = max(float(delay), 0)
+        self.entries = {}
+        self.dirty = set()
+        self.handle = None
+        self.writes = 0
+        atexit.register(self.flush)
+
+    @classmethod
+    def of(cls, bot, delay=5):
+        """ the BatchedDb of bot, plugins (and their reloaded instances) share it """
+        db = getattr(bot, 'batched_db', None)
+        if db is None:
+            db = bot.batched_db = cls(bot, delay)
+        db.delay = max(float(delay), 0)
+        return db
+
+    def __entry(self, key: str, create=False):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            entry = self.bot.db.get(key, None)
+            if entry is None:
+                if not create:
+                    return {}
+                entry = {}
+                self.dirty.add(key)
+            self.entries[key] = entry
+        return entry
+
+    def get(self, path: list):
+        """ the dict (or value) at path, an empty dict if it does not exist """
+        if not path:
+            raise ValueError('Path must not be empty')
+        cur = self.__entry(path[0])
+        for p in path[1:]:
+            cur = cur.get(p, {})
+        return cur
+
+    def add(self, path: list, key: str, value, overwrite=True, try_new_key=False, save=True):
+        """
+        sets key in the dict at path (created if necessary), path [] sets a top level entry
+        :param overwrite: replace an existing value
+        :param try_new_key: if it exists and is not replaced, add it as key0, key1, ... instead
+        :return: the dict, whether key existed, whether it was added with a new key
+        """
+        if not path:
+            exists = self.__entry(key) != {}
+            if overwrite or not exists:
+                self.entries[key] = value
+                self.dirty.add(key)
+            if save:
+                self.save()
+            return self.entries.get(key, {}), exists, False
+        cur = self.__entry(path[0], create=True)
+        for p in path[1:]:
+            if p not in cur:
+                cur[p] = {}
+            cur = cur[p]
+        exists, added_with_new_key = cur.get(key), False
+        if overwrite or not exists:
+            cur[key] = value
+        elif try_new_key:
+            for i in range(0, 1000):
+                if not cur.get(key + str(i)):
+                    cur[key + str(i)] = value
+                    added_with_new_key = True
+                    break
+        self.dirty.add(path[0])
+        if save:
+            self.save()
+        return cur, exists, added_with_new_key
+
+    def delete(self, path: list, key: str, save=True):
+        """ removes key from the dict at path, path [] removes a top level entry, returns the dict """
+        if not path:
+            self.entries.pop(key, None)
+            self.dirty.discard(key)
+            if key in self.bot.db:
+                del self.bot.db[key]
+            return {}
+        cur = self.get(path)
+        if cur.get(key) is not None:
+            del cur[key]
+            self.dirty.add(path[0])
+            if save:
+                self.save()
+        return cur
+
+    def rename(self, path: list, key: str, new_key: str, save=True) -> bool:
+        """ moves the value of key in the dict at path to new_key without copying it, False if key does not exist """
+        cur = self.get(path)
+        if key not in cur or new_key in cur:
+            return False
+        cur[new_key] = cur.pop(key)
+        self.dirty.add(path[0])
+        if save:
+            self.save()
+        return True
+
+    def touch(self, key: str):
+        """ mark a top level entry as changed, e.g. after changing a dict returned by get() """
+        self.dirty.add(key)
+
+    def save(self):
+        """ write the changes soon """
+        if self.delay <= 0:
+            self.flush()
+        elif self.handle is None:
+            self.handle = self.bot.loop.call_later(self.delay, self.flush)
+
+    def flush(self, everything=False):
+        """ write the changes now, everything also writes the entries that are not known to be changed """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if everything:
+            self.dirty.update(self.entries.keys())
+        if not self.dirty:
+            return
+        with metrics.timer('commit', 'batched_db'):
+            self.__write()
+
+    def __write(self):
+        backend = getattr(self.bot.db, 'backend', None)
+        if isinstance(getattr(backend, 'db', None), collections.abc.MutableMapping):
+            # json/shelve keep everything in one mapping, set all entries and write the file once
+            for key in self.dirty:
+                backend.db[key] = self.entries[key]
+            backend.sync()
+            self.writes += 1
+            self.dirty.clear()
+            return
+        for key in list(self.dirty):
+            try:
+                self.bot.db[key] = self.entries[key]
+                self.writes += 1
+            except Exception as e:
+                logger.warning('Failed writing %s to the storage: %s' % (key, str(e)))
+                continue
+            self.dirty.discard(key)
+
+
+def manage_list(db: BatchedDb, path: list, args: dict, allow_same_value=False) -> (str, [str]):
+    """
+    The generic "add TEXT / del <ID> / get" command of a list of texts stored at path.
+    :return: the reply, lines to send privately
+    """
+    add, delete, get, id_ = args.get('add'), args.get('del'), args.get('get'), args.get('<ID>')
+    text = " ".join(args.get('TEXT') or [])
+    entries = db.get(path)
+    if add:
+        if not allow_same_value and text in entries.values():
+            return "This already exists, so it won't be added.", []
+        try:
+            db.add(path, next_free_key(entries), text)
+            return 'Added to the list.', []
+        except Exception:
+            return "Failed adding.", []
+    elif delete:
+        try:
+            if entries.get(id_):
+                db.delete(path, id_)
+                return 'Removed element of ID "{id}".'.format(id=id_), []
+            return 'ID not found in the list.', []
+        except Exception:
+            return "Failed deleting.", []
+    elif get:
+        return None, [str(len(entries)) + " elements:"] + ['<%s>: %s' % (k, v) for k, v in entries.items()]
+    return None, []
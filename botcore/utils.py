@@ -0,0 +1,30 @@
+def is_in_channel(bot, player: str, channel) -> bool:
+    """ channel is a channel name or the userlist set of bot.channels """
+    if isinstance(channel, str):
+        channel = bot.channels.get(channel, ())
+    return player in channel
+
+
+def filter_in_channel(bot, players, channel_name: str) -> dict:
+    """ {player: True} for the players that are in the channel """
+    channel = bot.channels.get(channel_name, None)
+    if channel is None:
+        return {}
+    return {p: True for p in players if p in channel}
+
+
+def pack_lines(items, separator=', ', max_bytes=400) -> list:
+    """ joins the items to as few lines as possible, each at most max_bytes long in utf-8 (irc messages are limited) """
+    lines, line, size = [], [], 0
+    sep_size = len(separator.encode('utf-8'))
+    for item in items:
+        item = str(item)
+        item_size = len(item.encode('utf-8'))
+        if line and size + sep_size + item_size > max_bytes:
+            lines.append(separator.join(line))
+            line, size = [], 0
+        size += item_size + (sep_size if line else 0)
+        line.append(item)
+    if line:
+        lines.append(separator.join(line))
+    return lines